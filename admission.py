@@ -0,0 +1,355 @@
+"""
+Admission control for the detection endpoints.
+
+Every detection request asks for admission before its upload is read:
+
+    ticket = admission.acquire(user_id, 'interactive', cost=1)   # may raise Rejected
+    try:
+        ...run the detector...
+    finally:
+        ticket.release()
+
+Three checks run in one SQLite transaction, so all gunicorn workers on the
+host share the same state (ADMISSION_DB_PATH, a small database of its own
+so the app database's write lock is not involved):
+
+    per-user token bucket   `cost` tokens per request, refilled at
+                            ADMISSION_USER_RATE per second up to
+                            ADMISSION_USER_BURST; an empty bucket is a 429
+    load shedding           the expected latency (queued work ahead plus
+                            this request, from the measured time each class
+                            holds a slot) must stay within the class's SLO,
+                            and at most ADMISSION_MAX_QUEUE requests wait;
+                            otherwise a 503
+    concurrency cap         at most ADMISSION_MAX_CONCURRENT detections run
+                            at once; later requests wait for a slot
+
+Both rejections carry a Retry-After (seconds). Waiting requests get slots
+in priority order: 'interactive' (single uploads) before 'bulk' (batch
+requests), FIFO within a class. Bulk work also holds at most
+ADMISSION_BULK_MAX_CONCURRENT slots, so single uploads always find room.
+A request still waiting when its SLO has passed gives up with a 503.
+
+Slots of crashed workers are reclaimed when their process is gone or
+after ADMISSION_LEASE_SECONDS.
+
+Settings:
+    ADMISSION_ENABLED              default 1
+    ADMISSION_DB_PATH              default admission.db
+    ADMISSION_USER_RATE            tokens per second per user   (default 2)
+    ADMISSION_USER_BURST           bucket size                  (default 20)
+    ADMISSION_MAX_CONCURRENT       default 4
+    ADMISSION_BULK_MAX_CONCURRENT  default 2
+    ADMISSION_MAX_QUEUE            default 64
+    ADMISSION_SLO_SECONDS          interactive SLO              (default 10)
+    ADMISSION_BULK_SLO_SECONDS     bulk SLO                     (default 120)
+    ADMISSION_LEASE_SECONDS        default 600
+    ADMISSION_VIDEO_COST           tokens per video             (default 5)
+    ADMISSION_BATCH_COST           tokens per batch request     (default 10)
+"""
+import math
+import os
+import time
+
+import db
+from metrics import ADMISSION_DECISIONS, ADMISSION_WAIT_SECONDS, QUEUE_DEPTH
+
+ENABLED = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+DB_PATH = os.environ.get('ADMISSION_DB_PATH', 'admission.db')
+
+USER_RATE = float(os.environ.get('ADMISSION_USER_RATE', '2'))
+USER_BURST = float(os.environ.get('ADMISSION_USER_BURST', '20'))
+MAX_CONCURRENT = max(1, int(os.environ.get('ADMISSION_MAX_CONCURRENT', '4')))
+BULK_MAX_CONCURRENT = max(1, min(int(os.environ.get('ADMISSION_BULK_MAX_CONCURRENT', '2')), MAX_CONCURRENT))
+MAX_QUEUE = int(os.environ.get('ADMISSION_MAX_QUEUE', '64'))
+LEASE_SECONDS = float(os.environ.get('ADMISSION_LEASE_SECONDS', '600'))
+
+# Tokens charged per request, by kind
+COSTS = {
+    'image': 1,
+    'text': 1,
+    'video': float(os.environ.get('ADMISSION_VIDEO_COST', '5')),
+    'batch': float(os.environ.get('ADMISSION_BATCH_COST', '10')),
+}
+
+# Priority classes: lower value is served first
+PRIORITIES = {'interactive': 0, 'bulk': 1}
+SLO_SECONDS = {
+    'interactive': float(os.environ.get('ADMISSION_SLO_SECONDS', '10')),
+    'bulk': float(os.environ.get('ADMISSION_BULK_SLO_SECONDS', '120')),
+}
+# Slot hold time assumed until a class has been measured
+_INITIAL_SECONDS = {'interactive': 1.0, 'bulk': 10.0}
+# Weight of the newest sample in the moving average
+_EWMA_ALPHA = 0.2
+
+# Waiting requests poll for a slot, backing off up to this interval
+_POLL_MIN = 0.005
+_POLL_MAX = 0.1
+
+_CLASSES = {value: name for name, value in PRIORITIES.items()}
+
+
+class Rejected(Exception):
+    """The request was not admitted; answer with status_code and a Retry-After header."""
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+def _schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS admission_buckets (
+        user_id INTEGER PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at REAL NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS admission_slots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        priority INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        pid INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        expires_at REAL NOT NULL
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_admission_slots_state ON admission_slots (state, priority, id)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS admission_latency (
+        priority INTEGER PRIMARY KEY,
+        seconds REAL NOT NULL,
+        samples INTEGER NOT NULL
+    )''')
+
+
+db.register_schema(_schema, DB_PATH)
+
+# Evaluated only when /metrics is scraped
+QUEUE_DEPTH.set_function(
+    lambda: db.query_one("SELECT COUNT(*) FROM admission_slots WHERE state = 'waiting'", (), DB_PATH)[0],
+    queue='admission'
+)
+
+
+# ---------- Shared state ----------
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _reclaim(conn, now, check_pids=False):
+    """Drop slots past their lease, and (when the server looks full) slots of dead processes."""
+    conn.execute('DELETE FROM admission_slots WHERE expires_at < ?', (now,))
+    if check_pids:
+        for (pid,) in conn.execute('SELECT DISTINCT pid FROM admission_slots').fetchall():
+            if pid != os.getpid() and not _pid_alive(pid):
+                conn.execute('DELETE FROM admission_slots WHERE pid = ?', (pid,))
+
+
+def _slot_seconds(conn):
+    """Measured slot hold time per priority class."""
+    seconds = {PRIORITIES[name]: value for name, value in _INITIAL_SECONDS.items()}
+    seconds.update(conn.execute('SELECT priority, seconds FROM admission_latency').fetchall())
+    return seconds
+
+
+def _take_tokens(conn, user_id, cost, now):
+    """Charge the user's bucket; raises Rejected (429) when it holds fewer than `cost` tokens."""
+    cost = min(cost, USER_BURST)
+    row = conn.execute('SELECT tokens, updated_at FROM admission_buckets WHERE user_id = ?', (user_id,)).fetchone()
+    tokens = USER_BURST if row is None else min(USER_BURST, row[0] + max(0.0, now - row[1]) * USER_RATE)
+    if tokens < cost:
+        raise Rejected('Rate limit exceeded, please retry later', 429,
+                       (cost - tokens) / USER_RATE if USER_RATE > 0 else 60)
+    conn.execute('''INSERT INTO admission_buckets (user_id, tokens, updated_at) VALUES (?, ?, ?)
+                    ON CONFLICT (user_id) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at''',
+                 (user_id, tokens - cost, now))
+
+
+def _load(conn, priority):
+    """(running by class, waiting ahead of a new `priority` request by class)."""
+    running, ahead = {}, {}
+    for state, cls, count in conn.execute(
+        'SELECT state, priority, COUNT(*) FROM admission_slots GROUP BY state, priority'
+    ):
+        if state == 'running':
+            running[cls] = count
+        elif cls <= priority:
+            ahead[cls] = count
+    return running, ahead
+
+
+def _can_start(running, priority):
+    if sum(running.values()) >= MAX_CONCURRENT:
+        return False
+    return priority != PRIORITIES['bulk'] or running.get(priority, 0) < BULK_MAX_CONCURRENT
+
+
+def _estimated_wait(running, ahead, seconds):
+    """Seconds until a new request would get a slot, spreading queued work over the slots."""
+    # Running requests are on average half done
+    work = sum(count * seconds[cls] / 2 for cls, count in running.items())
+    work += sum(count * seconds[cls] for cls, count in ahead.items())
+    return work / MAX_CONCURRENT
+
+
+# ---------- Tickets ----------
+
+class Ticket:
+    """An admitted request; call release() once the detection has finished."""
+
+    def __init__(self, slot_id, priority, started_at):
+        self.slot_id = slot_id
+        self.priority = priority
+        self.started_at = started_at
+
+    def release(self):
+        if self.slot_id is None:
+            return
+        slot_id, self.slot_id = self.slot_id, None
+        held = time.time() - self.started_at
+        with db.transaction(DB_PATH) as conn:
+            conn.execute('DELETE FROM admission_slots WHERE id = ?', (slot_id,))
+            conn.execute('''INSERT INTO admission_latency (priority, seconds, samples) VALUES (?, ?, 1)
+                            ON CONFLICT (priority) DO UPDATE SET
+                                seconds = seconds + ? * (excluded.seconds - seconds),
+                                samples = samples + 1''',
+                         (self.priority, held, _EWMA_ALPHA))
+
+
+class _NullTicket:
+    def release(self):
+        pass
+
+
+_NULL_TICKET = _NullTicket()
+
+
+def _enter(user_id, priority, cost):
+    """Charge tokens and either take a slot or join the queue; returns (slot id, started)."""
+    name = _CLASSES[priority]
+    now = time.time()
+    with db.transaction(DB_PATH) as conn:
+        _reclaim(conn, now)
+        running, ahead = _load(conn, priority)
+        if ahead or not _can_start(running, priority):
+            # Full: make sure dead workers are not holding slots before judging the queue
+            _reclaim(conn, now, check_pids=True)
+            running, ahead = _load(conn, priority)
+        try:
+            _take_tokens(conn, user_id, cost, now)
+        except Rejected:
+            ADMISSION_DECISIONS.inc(priority=name, decision='rate_limited')
+            raise
+        seconds = _slot_seconds(conn)
+        start = not ahead and _can_start(running, priority)
+        if not start:
+            wait = _estimated_wait(running, ahead, seconds)
+            if sum(ahead.values()) >= MAX_QUEUE or wait + seconds[priority] > SLO_SECONDS[name]:
+                # Raising rolls the transaction back, so shed requests cost no tokens
+                ADMISSION_DECISIONS.inc(priority=name, decision='shed')
+                raise Rejected('Server is busy, please retry later', 503, wait)
+        expires = now + (LEASE_SECONDS if start else SLO_SECONDS[name] + _POLL_MAX)
+        slot_id = conn.execute(
+            '''INSERT INTO admission_slots (priority, state, pid, created_at, started_at, expires_at)
+               VALUES (?, ?, ?, ?, ?, ?)''',
+            (priority, 'running' if start else 'waiting', os.getpid(), now, now if start else None, expires)
+        ).lastrowid
+    return slot_id, start
+
+
+def _try_start(slot_id, priority):
+    """Promote a waiting slot once it is first in line and a slot is free."""
+    now = time.time()
+    with db.transaction(DB_PATH) as conn:
+        _reclaim(conn, now)
+        ahead = conn.execute(
+            '''SELECT COUNT(*) FROM admission_slots
+               WHERE state = 'waiting' AND (priority < ? OR (priority = ? AND id < ?))''',
+            (priority, priority, slot_id)
+        ).fetchone()[0]
+        running = dict(conn.execute(
+            "SELECT priority, COUNT(*) FROM admission_slots WHERE state = 'running' GROUP BY priority"
+        ).fetchall())
+        if ahead or not _can_start(running, priority):
+            return None
+        updated = conn.execute(
+            "UPDATE admission_slots SET state = 'running', started_at = ?, expires_at = ? WHERE id = ?",
+            (now, now + LEASE_SECONDS, slot_id)
+        ).rowcount
+    return now if updated else None
+
+
+def _leave(slot_id):
+    db.execute('DELETE FROM admission_slots WHERE id = ?', (slot_id,), DB_PATH)
+
+
+def acquire(user_id, priority='interactive', cost=1):
+    """
+    Admit one request of class `priority`, charging `cost` tokens to the
+    user, and wait for a slot. Returns a ticket to release() when done;
+    raises Rejected (429 / 503) instead of queueing past the SLO.
+    """
+    if not ENABLED:
+        return _NULL_TICKET
+    level = PRIORITIES[priority]
+    entered = time.time()
+    slot_id, started = _enter(user_id, level, cost)
+    if started:
+        ADMISSION_DECISIONS.inc(priority=priority, decision='admitted')
+        ADMISSION_WAIT_SECONDS.observe(0.0, priority=priority)
+        return Ticket(slot_id, level, entered)
+
+    deadline = entered + SLO_SECONDS[priority]
+    delay = _POLL_MIN
+    try:
+        while True:
+            started_at = _try_start(slot_id, level)
+            if started_at is not None:
+                break
+            if time.time() >= deadline:
+                ADMISSION_DECISIONS.inc(priority=priority, decision='timed_out')
+                raise Rejected('Server is busy, please retry later', 503, SLO_SECONDS[priority] / 2)
+            time.sleep(delay)
+            delay = min(delay * 2, _POLL_MAX)
+    except BaseException:
+        _leave(slot_id)
+        raise
+    ADMISSION_DECISIONS.inc(priority=priority, decision='admitted')
+    ADMISSION_WAIT_SECONDS.observe(started_at - entered, priority=priority)
+    return Ticket(slot_id, level, started_at)
+
+
+def charge(user_id, priority='bulk', cost=1):
+    """Apply only the user's token bucket (e.g. for queued jobs); raises Rejected (429)."""
+    if not ENABLED:
+        return
+    with db.transaction(DB_PATH) as conn:
+        try:
+            _take_tokens(conn, user_id, cost, time.time())
+        except Rejected:
+            ADMISSION_DECISIONS.inc(priority=priority, decision='rate_limited')
+            raise
+    ADMISSION_DECISIONS.inc(priority=priority, decision='admitted')
+
+
+def stats():
+    """Current slots, queue and measured slot time per class."""
+    with db.transaction(DB_PATH) as conn:
+        _reclaim(conn, time.time())
+        seconds = _slot_seconds(conn)
+        counts = conn.execute(
+            'SELECT state, priority, COUNT(*) FROM admission_slots GROUP BY state, priority'
+        ).fetchall()
+    classes = {name: {'running': 0, 'waiting': 0, 'slot_seconds': round(seconds[level], 3),
+                      'slo_seconds': SLO_SECONDS[name]}
+               for name, level in PRIORITIES.items()}
+    for state, level, count in counts:
+        classes[_CLASSES[level]][state] = count
+    return {'enabled': ENABLED, 'max_concurrent': MAX_CONCURRENT, 'classes': classes}
@@ -1,15 +1,32 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify, session, g, Response,
+                   make_response, stream_with_context)
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 import pyotp
 import sqlite3
 import os
+import time
 import logging
 from datetime import datetime
+from functools import wraps
 from werkzeug.utils import secure_filename
 
-# --- NEW: import our detector ---
-from detectors.detect_image import detect_image_ai
+# Detectors (and transformers/torch) are imported lazily, see detection.py / warmup.py
+from detection import image_record, text_record, video_record, record_response
+from history_stats import DEFAULT_DAYS as STATS_DEFAULT_DAYS, get_user_stats
+from history_store import (DEFAULT_PAGE_SIZE, add_history_entry, add_history_record, clear_history,
+                           delete_history_entry, get_history_entry, list_history, utc_date_str)
+import batch_detection
+from history_export import FORMATS as EXPORT_FORMATS, export_stream, parquet_available
+import history_search
+from jobs import JOB_TYPES, enqueue as enqueue_job, get_job
+from detectors.ingest import MAX_UPLOAD_BYTES as MAX_IMAGE_UPLOAD_BYTES, IngestError, check_image
+import admission
+import db
+import metrics
+import user_cache
+import blob_store
+import warmup
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # Secure secret key for session management
@@ -17,40 +34,14 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (LOG_LEVEL=DEBUG for per-request history logs)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper())
 
-# Ensure uploads directory exists
+# Uploads live in the content-addressed blob store (BLOB_STORE_DIR, see blob_store.py)
 BASE_DIR = os.path.dirname(__file__)
-UPLOAD_DIR = os.path.join(BASE_DIR, "static", "uploads")
+UPLOAD_DIR = blob_store.ROOT
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# SQLite database setup
-def init_db():
-    with sqlite3.connect('users.db') as conn:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            totp_secret TEXT
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            type TEXT,
-            content TEXT,
-            score INTEGER,
-            confidence INTEGER,
-            date TEXT,
-            full_content TEXT,
-            analysis TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )''')
-        conn.commit()
-
-init_db()
-
 # User model for Flask-Login
 class User(UserMixin):
     def __init__(self, id, username, totp_secret=None):
@@ -58,16 +49,19 @@ class User(UserMixin):
         self.username = username
         self.totp_secret = totp_secret
 
-# User loader for Flask-Login
+def _load_user_row(user_id):
+    return db.query_one('SELECT id, username, totp_secret FROM users WHERE id = ?', (user_id,))
+
+# User loader for Flask-Login; rows are cached per process (see user_cache.py)
 @login_manager.user_loader
 def load_user(user_id):
-    with sqlite3.connect('users.db') as conn:
-        c = conn.cursor()
-        c.execute('SELECT id, username, totp_secret FROM users WHERE id = ?', (user_id,))
-        user_data = c.fetchone()
-        if user_data:
-            return User(user_data[0], user_data[1], user_data[2])
+    if request.endpoint == 'static':
+        # Static files are public: no user lookup at all
         return None
+    user_data = user_cache.get_or_load(user_id, _load_user_row)
+    if user_data:
+        return User(user_data[0], user_data[1], user_data[2])
+    return None
 
 @app.route('/')
 def index():
@@ -92,30 +86,23 @@ def video():
 @login_required
 def history():
     try:
-        with sqlite3.connect('users.db') as conn:
-            c = conn.cursor()
-            c.execute('SELECT id, type, content, score, confidence, date, full_content, analysis FROM history WHERE user_id = ?', (current_user.id,))
-            analyses = [{
-                'id': row[0],
-                'type': row[1],
-                'content': row[2],
-                'score': row[3],
-                'confidence': row[4],
-                'date': row[5],
-                'fullContent': row[6],
-                'analysis': row[7]
-            } for row in c.fetchall()]
-        logging.debug(f"Rendering history with {len(analyses)} entries for user {current_user.id}")
-        return render_template('history.html', analyses=analyses)
+        analyses, next_cursor = list_history(current_user.id)
+        logging.debug("Rendering history with %d entries for user %s", len(analyses), current_user.id)
+        return render_template('history.html', analyses=analyses, next_cursor=next_cursor)
     except Exception as e:
         flash(f'Error loading history: {str(e)}', 'error')
         logging.error(f"History load error for user {current_user.id}: {str(e)}")
-        return render_template('history.html', analyses=[])
+        return render_template('history.html', analyses=[], next_cursor=None)
 
 @app.route('/profile')
 @login_required
 def profile():
-    return render_template('profile.html')
+    try:
+        stats = get_user_stats(current_user.id)
+    except Exception as e:
+        logging.error(f"Stats load error for user {current_user.id}: {str(e)}")
+        stats = None
+    return render_template('profile.html', stats=stats)
 
 @app.route('/settings')
 @login_required
@@ -134,18 +121,17 @@ def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        with sqlite3.connect('users.db') as conn:
-            c = conn.cursor()
-            c.execute('SELECT id, username, password, totp_secret FROM users WHERE username = ?', (username,))
-            user_data = c.fetchone()
-            if user_data and check_password_hash(user_data[2], password):
-                user = User(user_data[0], user_data[1], user_data[3])
-                login_user(user)
-                if user.totp_secret:
-                    session['pending_2fa'] = user.id
-                    return redirect(url_for('two_factor'))
-                return redirect(url_for('index'))
-            flash('Invalid username or password', 'error')
+        user_data = db.query_one('SELECT id, username, password, totp_secret FROM users WHERE username = ?', (username,))
+        if user_data and check_password_hash(user_data[2], password):
+            user = User(user_data[0], user_data[1], user_data[3])
+            # Fresh row: the next requests' user_loader calls need no query
+            user_cache.put(user.id, (user_data[0], user_data[1], user_data[3]))
+            login_user(user)
+            if user.totp_secret:
+                session['pending_2fa'] = user.id
+                return redirect(url_for('two_factor'))
+            return redirect(url_for('index'))
+        flash('Invalid username or password', 'error')
         return redirect(url_for('login'))
     return render_template('login.html')
 
@@ -156,18 +142,15 @@ def signup():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        with sqlite3.connect('users.db') as conn:
-            c = conn.cursor()
-            try:
-                hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
-                totp_secret = pyotp.random_base32()
-                c.execute('INSERT INTO users (username, password, totp_secret) VALUES (?, ?, ?)',
-                          (username, hashed_password, totp_secret))
-                conn.commit()
-                flash('Account created successfully! Please sign in.', 'success')
-                return redirect(url_for('login'))
-            except sqlite3.IntegrityError:
-                flash('Username already exists', 'error')
+        try:
+            hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
+            totp_secret = pyotp.random_base32()
+            db.execute('INSERT INTO users (username, password, totp_secret) VALUES (?, ?, ?)',
+                       (username, hashed_password, totp_secret))
+            flash('Account created successfully! Please sign in.', 'success')
+            return redirect(url_for('login'))
+        except sqlite3.IntegrityError:
+            flash('Username already exists', 'error')
         return redirect(url_for('signup'))
     return render_template('signup.html')
 
@@ -178,29 +161,23 @@ def two_factor():
     if request.method == 'POST':
         code = request.form['code']
         user_id = session['pending_2fa']
-        with sqlite3.connect('users.db') as conn:
-            c = conn.cursor()
-            c.execute('SELECT totp_secret FROM users WHERE id = ?', (user_id,))
-            row = c.fetchone()
-            if not row:
-                flash('User not found', 'error')
-                return redirect(url_for('login'))
-            totp_secret = row[0]
-            totp = pyotp.TOTP(totp_secret)
-            if totp.verify(code, valid_window=1):
-                session.pop('pending_2fa', None)
-                return redirect(url_for('index'))
-            flash('Invalid 2FA code', 'error')
-        return redirect(url_for('two_factor'))
-    user_id = session['pending_2fa']
-    with sqlite3.connect('users.db') as conn:
-        c = conn.cursor()
-        c.execute('SELECT totp_secret FROM users WHERE id = ?', (user_id,))
-        row = c.fetchone()
+        row = db.query_one('SELECT totp_secret FROM users WHERE id = ?', (user_id,))
         if not row:
             flash('User not found', 'error')
             return redirect(url_for('login'))
         totp_secret = row[0]
+        totp = pyotp.TOTP(totp_secret)
+        if totp.verify(code, valid_window=1):
+            session.pop('pending_2fa', None)
+            return redirect(url_for('index'))
+        flash('Invalid 2FA code', 'error')
+        return redirect(url_for('two_factor'))
+    user_id = session['pending_2fa']
+    row = db.query_one('SELECT totp_secret FROM users WHERE id = ?', (user_id,))
+    if not row:
+        flash('User not found', 'error')
+        return redirect(url_for('login'))
+    totp_secret = row[0]
     username_for_uri = 'pending_user'
     totp_uri = pyotp.TOTP(totp_secret).provisioning_uri(name=username_for_uri, issuer_name='AI Content Detector')
     return render_template('two_factor.html', totp_uri=totp_uri)
@@ -212,6 +189,32 @@ def logout():
     flash('Logged out successfully', 'success')
     return redirect(url_for('login'))
 
+def _history_filter_args():
+    """
+    Parse history list filters from the query string:
+    type (comma-separated), min_score, max_score, since, until (YYYY-MM-DD).
+    Raises ValueError on malformed values.
+    """
+    args = request.args
+    types = [t for t in (args.get('type') or '').split(',') if t]
+    filters = {'types': types or None}
+    for key in ('min_score', 'max_score'):
+        value = args.get(key)
+        if value not in (None, ''):
+            try:
+                filters[key] = int(value)
+            except ValueError:
+                raise ValueError(f'{key} must be an integer')
+    for key in ('since', 'until'):
+        value = args.get(key)
+        if value:
+            try:
+                datetime.strptime(value[:10], '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f'{key} must be a date (YYYY-MM-DD)')
+            filters[key] = value
+    return filters
+
 @app.route('/api/history', methods=['GET', 'POST', 'DELETE'])
 @login_required
 def api_history():
@@ -221,157 +224,463 @@ def api_history():
             required_fields = ['type', 'content', 'score', 'confidence', 'date', 'fullContent', 'analysis']
             if not all(field in data for field in required_fields):
                 return jsonify({'status': 'error', 'message': 'Missing required fields'}), 400
-            with sqlite3.connect('users.db') as conn:
-                c = conn.cursor()
-                c.execute('''INSERT INTO history (user_id, type, content, score, confidence, date, full_content, analysis)
-                             VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                          (current_user.id, data['type'], data['content'], data['score'], data['confidence'],
-                           data['date'], data['fullContent'], data['analysis']))
-                conn.commit()
-                c.execute('SELECT last_insert_rowid()')
-                new_id = c.fetchone()[0]
-            logging.debug(f"Added history entry {new_id} for user {current_user.id}")
+            new_id = add_history_entry(current_user.id, data['type'], data['content'], data['score'],
+                                       data['confidence'], data['fullContent'], data['analysis'], data['date'])
+            logging.debug("Added history entry %s for user %s", new_id, current_user.id)
             return jsonify({'status': 'success', 'message': 'History entry added', 'id': new_id})
         except Exception as e:
             logging.error(f"Error adding history for user {current_user.id}: {str(e)}")
             return jsonify({'status': 'error', 'message': str(e)}), 500
     elif request.method == 'DELETE':
         try:
-            with sqlite3.connect('users.db') as conn:
-                c = conn.cursor()
-                c.execute('DELETE FROM history WHERE user_id = ?', (current_user.id,))
-                conn.commit()
-            logging.debug(f"Cleared all history for user {current_user.id}")
+            clear_history(current_user.id)
+            logging.debug("Cleared all history for user %s", current_user.id)
             return jsonify({'status': 'success', 'message': 'All history cleared'})
         except Exception as e:
             logging.error(f"Error clearing history for user {current_user.id}: {str(e)}")
             return jsonify({'status': 'error', 'message': str(e)}), 500
     else:
         try:
-            with sqlite3.connect('users.db') as conn:
-                c = conn.cursor()
-                c.execute('SELECT id, type, content, score, confidence, date, full_content, analysis FROM history WHERE user_id = ?',
-                          (current_user.id,))
-                history = [{
-                    'id': row[0], 'type': row[1], 'content': row[2], 'score': row[3], 'confidence': row[4],
-                    'date': row[5], 'fullContent': row[6], 'analysis': row[7]
-                } for row in c.fetchall()]
-            logging.debug(f"Fetched {len(history)} history entries for user {current_user.id}")
-            return jsonify(history)
+            filters = _history_filter_args()
+            limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+            cursor = request.args.get('cursor')
+            cursor = int(cursor) if cursor else None
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        try:
+            history, next_cursor = list_history(current_user.id, limit=limit, cursor=cursor, **filters)
+            logging.debug("Fetched %d history entries for user %s", len(history), current_user.id)
+            return jsonify({'items': history, 'next_cursor': next_cursor})
         except Exception as e:
             logging.error(f"Error fetching history for user {current_user.id}: {str(e)}")
             return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/api/history/export', methods=['GET'])
+@login_required
+def api_history_export():
+    """
+    Stream the user's history as ?format=csv (default) | jsonl | parquet.
+    Accepts the same filters as GET /api/history; include_full=1 adds full_content,
+    and q= exports only the entries matching that search (GET /api/history/search).
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'status': 'error', 'message': f'format must be one of {", ".join(EXPORT_FORMATS)}'}), 400
+    if fmt == 'parquet' and not parquet_available():
+        return jsonify({'status': 'error', 'message': 'Parquet export is not available (pyarrow not installed)'}), 501
+    query = (request.args.get('q') or '').strip() or None
+    if query and not history_search.AVAILABLE:
+        return jsonify({'status': 'error', 'message': 'Search is not available (SQLite built without FTS5)'}), 501
+    if query and history_search.match_expression(current_user.id, query) is None:
+        return jsonify({'status': 'error', 'message': 'q must contain at least one search term'}), 400
+    try:
+        filters = _history_filter_args()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    filename = f"ai_detection_history_{datetime.utcnow().strftime('%Y-%m-%d')}.{extension}"
+    stream = export_stream(current_user.id, fmt, include_full=request.args.get('include_full') == '1', query=query,
+                           **filters)
+    logging.debug("Exporting history for user %s as %s", current_user.id, fmt)
+    return Response(stream_with_context(stream), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/api/history/search', methods=['GET'])
+@login_required
+def api_history_search():
+    """
+    Full-text search of the user's history (?q=, see history_search.py),
+    ranked by relevance (sort=rank, default) or newest first (sort=newest).
+    Accepts the filters and limit / cursor paging of GET /api/history;
+    each item adds an HTML `snippet` with the matches in <mark>.
+    `truncated` is true when relevance ranking left older matches out
+    (sort=newest lists them all).
+    """
+    if not history_search.AVAILABLE:
+        return jsonify({'status': 'error', 'message': 'Search is not available (SQLite built without FTS5)'}), 501
+    try:
+        filters = _history_filter_args()
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        items, next_cursor, truncated = history_search.search_history(
+            current_user.id, request.args.get('q', ''), limit=limit, cursor=request.args.get('cursor') or None,
+            sort=request.args.get('sort', 'rank'), **filters
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error searching history for user {current_user.id}: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    logging.debug("Search returned %d history entries for user %s", len(items), current_user.id)
+    return jsonify({'items': items, 'next_cursor': next_cursor, 'truncated': truncated})
+
 @app.route('/api/history/<int:entry_id>', methods=['GET', 'DELETE'])
 @login_required
 def history_entry(entry_id):
     if request.method == 'GET':
         try:
-            with sqlite3.connect('users.db') as conn:
-                c = conn.cursor()
-                c.execute('SELECT id, type, content, score, confidence, date, full_content, analysis FROM history WHERE id = ? AND user_id = ?',
-                          (entry_id, current_user.id))
-                entry = c.fetchone()
-                if entry:
-                    result = {
-                        'id': entry[0],
-                        'type': entry[1],
-                        'content': entry[2],
-                        'score': entry[3],
-                        'confidence': entry[4],
-                        'date': entry[5],
-                        'fullContent': entry[6],
-                        'analysis': entry[7]
-                    }
-                    logging.debug(f"Fetched entry {entry_id} for user {current_user.id}")
-                    return jsonify(result)
-                else:
-                    logging.warning(f"Entry {entry_id} not found or unauthorized for user {current_user.id}")
-                    return jsonify({'status': 'error', 'message': 'Entry not found or unauthorized'}), 404
+            result = get_history_entry(current_user.id, entry_id)
+            if result:
+                logging.debug("Fetched entry %s for user %s", entry_id, current_user.id)
+                return jsonify(result)
+            else:
+                logging.warning(f"Entry {entry_id} not found or unauthorized for user {current_user.id}")
+                return jsonify({'status': 'error', 'message': 'Entry not found or unauthorized'}), 404
         except Exception as e:
             logging.error(f"Error fetching entry {entry_id} for user {current_user.id}: {str(e)}")
             return jsonify({'status': 'error', 'message': str(e)}), 500
     elif request.method == 'DELETE':
         try:
-            with sqlite3.connect('users.db') as conn:
-                c = conn.cursor()
-                c.execute('DELETE FROM history WHERE id = ? AND user_id = ?', (entry_id, current_user.id))
-                conn.commit()
-                if c.rowcount == 0:
-                    logging.warning(f"Delete attempt failed for entry {entry_id} by user {current_user.id}: Not found or unauthorized")
-                    return jsonify({'status': 'error', 'message': 'Entry not found or unauthorized'}), 404
-                logging.debug(f"Deleted history entry {entry_id} for user {current_user.id}")
-                return jsonify({'status': 'success', 'message': 'History entry deleted'})
+            if not delete_history_entry(current_user.id, entry_id):
+                logging.warning(f"Delete attempt failed for entry {entry_id} by user {current_user.id}: Not found or unauthorized")
+                return jsonify({'status': 'error', 'message': 'Entry not found or unauthorized'}), 404
+            logging.debug("Deleted history entry %s for user %s", entry_id, current_user.id)
+            return jsonify({'status': 'success', 'message': 'History entry deleted'})
         except Exception as e:
             logging.error(f"Error deleting entry {entry_id} for user {current_user.id}: {str(e)}")
             return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/api/stats', methods=['GET'])
+@login_required
+def api_stats():
+    """
+    Totals, score histograms and daily volume (?days=, default 30) from the
+    precomputed rollups in history_stats.py; cost does not grow with history.
+    """
+    try:
+        days = int(request.args.get('days', STATS_DEFAULT_DAYS))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'days must be an integer'}), 400
+    try:
+        stats = get_user_stats(current_user.id, days)
+        return jsonify({'status': 'success', **stats})
+    except Exception as e:
+        logging.error(f"Error fetching stats for user {current_user.id}: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+def save_upload(file, max_bytes=None, validate=None, kind='file'):
+    """Stream an uploaded file into the blob store. Returns (save_path, SHA-256 hex digest)."""
+    with metrics.timed(metrics.UPLOAD_SAVE_SECONDS):
+        digest, save_path = blob_store.receive(file.stream, file.filename, max_bytes, validate, kind)
+    return save_path, digest
+
+def _save_history_record(record):
+    date_str = utc_date_str()
+    new_id = add_history_record(current_user.id, record, date_str)
+    return jsonify(record_response(new_id, date_str, record)), 200
+
+def _receive_upload(field, max_bytes=None, validate=None, kind='file'):
+    """Store request.files[field] in the blob store. Returns (filename, save_path, digest)."""
+    file = request.files.get(field)
+    if not file or not file.filename:
+        raise ValueError(f'No {field} uploaded')
+    filename = secure_filename(file.filename)
+    save_path, digest = save_upload(file, max_bytes, validate, kind)
+    return filename, save_path, digest
+
+def _receive_image_upload():
+    """
+    Like _receive_upload('image') with the image ingest limits: upload size,
+    format whitelist and pixel count (header only). Raises IngestError.
+    """
+    # Refuse oversized bodies before reading them (small allowance for the multipart framing)
+    if request.content_length and request.content_length > MAX_IMAGE_UPLOAD_BYTES + 64 * 1024:
+        raise IngestError(f'File exceeds the {MAX_IMAGE_UPLOAD_BYTES // (1024 * 1024)} MB upload limit', 413)
+    # check_image runs before the file is stored, so rejected uploads leave nothing behind
+    return _receive_upload('image', MAX_IMAGE_UPLOAD_BYTES, validate=check_image, kind='image')
+
+def _rejected(e):
+    response = jsonify({'status': 'error', 'message': str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, e.status_code
+
+def admission_controlled(priority, cost=1):
+    """
+    Admit the request before its body is read (see admission.py): 429 / 503
+    with Retry-After when the user's rate limit or the server's queue is
+    exhausted. The slot is held until the response, including a streamed
+    one, has been sent.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                ticket = admission.acquire(current_user.id, priority, cost)
+            except admission.Rejected as e:
+                return _rejected(e)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                ticket.release()
+                raise
+            response.call_on_close(ticket.release)
+            return response
+        return wrapper
+    return decorator
+
 # --------------------------
 # Image Detection API (fixed)
 # --------------------------
 @app.route('/api/detect/image', methods=['POST'])
 @login_required
+@admission_controlled('interactive', cost=admission.COSTS['image'])
 def api_detect_image():
     """
     Expects multipart/form-data with field name: 'image'
-    Saves the file, runs detect_image_ai(save_path) -> (label, ai_percent),
+    Saves the file, runs detect_image_ai(save_path) -> result dict,
     stores a row in 'history', and returns JSON.
+    Identical uploads (same SHA-256, same model) reuse the cached result.
     """
-    file = request.files.get('image')
-    if not file or not file.filename:
-        return jsonify({'status': 'error', 'message': 'No image uploaded'}), 400
-
-    # Save uploaded file
+    # Save uploaded file (size / format / pixel limits, see detectors/ingest.py)
     try:
-        filename = secure_filename(file.filename)
-        save_path = os.path.join(UPLOAD_DIR, filename)
-        file.save(save_path)
+        filename, save_path, digest = _receive_image_upload()
+    except IngestError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), e.status_code
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         app.logger.exception("Failed to save uploaded file")
         return jsonify({'status': 'error', 'message': f'Failed to save file: {str(e)}'}), 500
 
-    # Run detector (expects: (label: str, ai_percent: int or float 0-100))
+    # Run detector
     try:
-        label, ai_percent = detect_image_ai(save_path)
-        score = int(round(float(ai_percent)))   # 0–100
-        confidence = score                      # placeholder: same as score
+        record = image_record(save_path, filename, digest, user_id=current_user.id)
+    except IngestError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), e.status_code
     except Exception as e:
         app.logger.exception("Image detection failed")
         return jsonify({'status': 'error', 'message': f'Detection failed: {str(e)}'}), 500
 
-    # Build record for DB
-    date_str = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")
-    short_content = filename
-    full_content = f"static/uploads/{filename}"
-
     # Save to history
     try:
-        with sqlite3.connect('users.db') as conn:
-            c = conn.cursor()
-            c.execute(
-                '''INSERT INTO history (user_id, type, content, score, confidence, date, full_content, analysis)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
-                (current_user.id, 'image', short_content, score, confidence, date_str, full_content, label)
-            )
-            conn.commit()
-            c.execute('SELECT last_insert_rowid()')
-            new_id = c.fetchone()[0]
+        return _save_history_record(record)
     except Exception as e:
         app.logger.exception("Failed to save history")
         return jsonify({'status': 'error', 'message': f'Failed to save history: {str(e)}'}), 500
 
-    # Success
+# --------------------------
+# Bulk Image Detection API
+# --------------------------
+@app.route('/api/detect/batch', methods=['POST'])
+@login_required
+@admission_controlled('bulk', cost=admission.COSTS['batch'])
+def api_detect_batch():
+    """
+    Score many images in one request; the response is NDJSON streamed as
+    results complete (see batch_detection.py). Accepts either
+      - multipart/form-data with files in 'images' (or 'image'), and/or one
+        zip / tar archive in 'archive', or
+      - a raw zip or tar body (Content-Type application/zip, application/x-tar,
+        application/gzip, ...), read as a stream.
+    All history rows are written in one transaction at the end.
+    Images past the admission cost are charged to the user per chunk.
+    """
+    if request.content_length and request.content_length > batch_detection.MAX_ARCHIVE_BYTES:
+        return jsonify({'status': 'error', 'message': 'Upload exceeds the batch size limit'}), 413
+
+    if request.mimetype == 'multipart/form-data':
+        sources = [batch_detection.iter_files(request.files.getlist('images') + request.files.getlist('image'))]
+        archive = request.files.get('archive')
+        if archive and archive.filename:
+            members = batch_detection.members_for(archive.filename, archive.mimetype, archive.stream)
+            if members is None:
+                return jsonify({'status': 'error', 'message': 'archive must be a zip or tar file'}), 400
+            sources.append(members)
+        if not request.files:
+            return jsonify({'status': 'error', 'message': 'No images uploaded'}), 400
+        members = (member for source in sources for member in source)
+    else:
+        members = batch_detection.members_for(None, request.mimetype, request.stream)
+        if members is None:
+            return jsonify({'status': 'error', 'message': 'Send multipart files or a zip / tar archive'}), 415
+
+    stream = batch_detection.detect_stream(members, current_user.id)
+    return Response(stream_with_context(stream), mimetype='application/x-ndjson')
+
+# --------------------------
+# Text Detection API
+# --------------------------
+@app.route('/api/detect/text', methods=['POST'])
+@login_required
+@admission_controlled('interactive', cost=admission.COSTS['text'])
+def api_detect_text():
+    """
+    Expects JSON: {"text": "..."}
+    Runs detect_text(text) (long texts are scored in token windows),
+    stores a row in 'history', and returns JSON.
+    """
+    data = request.get_json(silent=True) or {}
+    text = data.get('text') or ''
+    if len(text.strip()) < 50:
+        return jsonify({'status': 'error', 'message': 'Please enter at least 50 characters for analysis'}), 400
+
+    try:
+        record = text_record(text)
+    except Exception as e:
+        app.logger.exception("Text detection failed")
+        return jsonify({'status': 'error', 'message': f'Detection failed: {str(e)}'}), 500
+
+    try:
+        return _save_history_record(record)
+    except Exception as e:
+        app.logger.exception("Failed to save history")
+        return jsonify({'status': 'error', 'message': f'Failed to save history: {str(e)}'}), 500
+
+# --------------------------
+# Video Detection API
+# --------------------------
+@app.route('/api/detect/video', methods=['POST'])
+@login_required
+@admission_controlled('interactive', cost=admission.COSTS['video'])
+def api_detect_video():
+    """
+    Expects multipart/form-data with field name: 'video'
+    (optional 'strategy': uniform | keyframe | scene).
+    Saves the file, runs detect_video(save_path) on sampled frames,
+    stores a row in 'history', and returns JSON.
+    """
+    try:
+        filename, save_path, _ = _receive_upload('video')
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        app.logger.exception("Failed to save uploaded file")
+        return jsonify({'status': 'error', 'message': f'Failed to save file: {str(e)}'}), 500
+
+    try:
+        record = video_record(save_path, filename, strategy=request.form.get('strategy') or None)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        app.logger.exception("Video detection failed")
+        return jsonify({'status': 'error', 'message': f'Detection failed: {str(e)}'}), 500
+
+    try:
+        return _save_history_record(record)
+    except Exception as e:
+        app.logger.exception("Failed to save history")
+        return jsonify({'status': 'error', 'message': f'Failed to save history: {str(e)}'}), 500
+
+# --------------------------
+# Async Detection Jobs API
+# --------------------------
+@app.route('/api/jobs', methods=['POST'])
+@login_required
+def api_create_job():
+    """
+    Queue a detection and return immediately with a job id.
+    multipart/form-data: 'type' = image | video with the file in field
+    'image' / 'video' (video may add 'strategy'), or JSON / form
+    {"type": "text", "text": "..."}.
+    Poll GET /api/jobs/<id> for status, progress and result.
+    """
+    data = request.get_json(silent=True) or request.form
+    job_type = data.get('type')
+    if job_type not in JOB_TYPES:
+        return jsonify({'status': 'error', 'message': f'type must be one of {", ".join(JOB_TYPES)}'}), 400
+
+    try:
+        if job_type == 'text':
+            text = data.get('text') or ''
+            if len(text.strip()) < 50:
+                return jsonify({'status': 'error', 'message': 'Please enter at least 50 characters for analysis'}), 400
+            payload = {'text': text}
+        else:
+            if job_type == 'image':
+                filename, save_path, digest = _receive_image_upload()
+            else:
+                filename, save_path, digest = _receive_upload(job_type)
+            payload = {'path': save_path, 'filename': filename, 'digest': digest}
+            if job_type == 'video' and data.get('strategy'):
+                payload['strategy'] = data.get('strategy')
+    except IngestError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), e.status_code
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        app.logger.exception("Failed to save uploaded file")
+        return jsonify({'status': 'error', 'message': f'Failed to save file: {str(e)}'}), 500
+
+    # Queued jobs run in the job workers, so only the user's rate limit applies here;
+    # charged once the payload is valid, so rejected input costs nothing (an
+    # unreferenced upload is left to the blob store's GC)
+    try:
+        admission.charge(current_user.id, 'bulk', admission.COSTS[job_type])
+    except admission.Rejected as e:
+        return _rejected(e)
+
+    try:
+        job_id = enqueue_job(current_user.id, job_type, payload)
+    except Exception as e:
+        app.logger.exception("Failed to enqueue job")
+        return jsonify({'status': 'error', 'message': f'Failed to queue job: {str(e)}'}), 500
+
     return jsonify({
-        'status': 'success',
-        'id': new_id,
-        'type': 'image',
-        'filename': filename,
-        'path': full_content,
-        'score': score,
-        'confidence': confidence,
-        'analysis': label,   # e.g., "AI Generated" or "Human"
-        'date': date_str
-    }), 200
+        'status': 'queued',
+        'job_id': job_id,
+        'status_url': url_for('api_job_status', job_id=job_id)
+    }), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@login_required
+def api_job_status(job_id):
+    job = get_job(job_id, current_user.id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job not found or unauthorized'}), 404
+    job.pop('user_id', None)
+    return jsonify(job)
+
+@app.route('/api/detect/image/stats', methods=['GET'])
+@login_required
+def api_detect_image_stats():
+    """Queue depth and micro-batch size statistics of the image detector, plus admission state."""
+    from detectors.detect_image import get_batch_stats
+    stats = get_batch_stats()
+    stats['admission'] = admission.stats()
+    return jsonify(stats)
+
+# ---------------------------
+# Metrics
+# ---------------------------
+if metrics.ENABLED:
+    @app.before_request
+    def _start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unknown',
+                                            method=request.method, status=response.status_code)
+        return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition (404 unless METRICS_ENABLED=1)."""
+    if not metrics.ENABLED:
+        return jsonify({'status': 'error', 'message': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+# ---------------------------
+# Health / readiness
+# ---------------------------
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the worker is up. Always 200; includes detector states."""
+    return jsonify({'status': 'ok', 'pid': os.getpid(), 'models': warmup.status()})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 once the warmed-up detectors are loaded, 503 before that."""
+    state = warmup.status()
+    code = 200 if state['ready'] else 503
+    return jsonify({'status': 'ready' if state['ready'] else 'not_ready', 'models': state}), code
 
 if __name__ == '__main__':
+    db.init_schema()
+    warmup.start()
+    blob_store.start_gc()
     app.run(debug=True)
@@ -0,0 +1,229 @@
+"""
+Bulk image detection for POST /api/detect/batch.
+
+Inputs are read as a stream of (name, file) members: several multipart
+files, a tar archive (read member by member straight from the request
+body, optionally compressed) or a zip archive (spooled to a temporary file
+first, since zip keeps its index at the end). Each member is saved and
+checked like a single upload (detectors/ingest.py) and stored in the blob
+store (blob_store.py), then scored in chunks
+of IMAGE_BATCH_MAX_SIZE with one batched model call per chunk.
+
+Results go out as NDJSON while the batch runs, one line per file:
+    {"index": 0, "status": "success", "filename": "a.jpg", "score": 91, ...}
+    {"index": 1, "status": "error", "filename": "b.txt", "code": 415, "message": "..."}
+and a final summary line once every history row has been written in a
+single transaction:
+    {"status": "done", "processed": 1, "failed": 1, "ids": {"0": 123}, "date": "..."}
+If that write fails the last line is an error instead, and nothing was saved:
+    {"status": "error", "code": 500, "processed": 1, "failed": 1, "message": "..."}
+
+The request's admission charge (ADMISSION_BATCH_COST) covers that many
+images; every chunk past it is charged to the user's token bucket
+(admission.charge) before it is scored. Once the bucket runs dry the
+batch stops with {"status": "error", "code": 429, "retry_after": ...} and
+the summary covers the files scored so far.
+
+Settings:
+    BATCH_MAX_FILES       files per request           (default 1000)
+    BATCH_MAX_ARCHIVE_MB  archive size / total upload (default 1024)
+"""
+import json
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+from werkzeug.utils import secure_filename
+
+import admission
+import blob_store
+from detectors.ingest import MAX_UPLOAD_BYTES, IngestError, check_image
+
+MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', '1000'))
+MAX_ARCHIVE_BYTES = int(float(os.environ.get('BATCH_MAX_ARCHIVE_MB', '1024')) * 1024 * 1024)
+
+ZIP_MIMETYPES = ('application/zip', 'application/x-zip-compressed')
+TAR_MIMETYPES = ('application/x-tar', 'application/gzip', 'application/x-gzip', 'application/x-bzip2',
+                 'application/x-xz')
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+class _LimitedReader:
+    """File-like wrapper that raises IngestError(413) past `limit` bytes."""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.remaining = limit
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        if self.remaining < 0:
+            raise IngestError(f'Upload exceeds the {MAX_ARCHIVE_BYTES // (1024 * 1024)} MB batch limit', 413)
+        return data
+
+
+def _skip(name):
+    base = os.path.basename(name.rstrip('/'))
+    return not base or base.startswith('.') or '__MACOSX' in name
+
+
+# ---------- Members ----------
+
+def iter_files(files):
+    """Members from werkzeug FileStorage objects."""
+    for f in files:
+        if f and f.filename:
+            yield f.filename, f.stream
+
+
+def iter_tar(stream):
+    """Members of a (possibly compressed) tar archive, read sequentially."""
+    with tarfile.open(fileobj=_LimitedReader(stream, MAX_ARCHIVE_BYTES), mode='r|*') as tar:
+        for member in tar:
+            if member.isfile() and not _skip(member.name):
+                yield member.name, tar.extractfile(member)
+
+
+def iter_zip(stream):
+    """Members of a zip archive; non-seekable streams are spooled to disk first."""
+    spooled = None
+    try:
+        if not (hasattr(stream, 'seekable') and stream.seekable()):
+            spooled = tempfile.TemporaryFile()
+            shutil.copyfileobj(_LimitedReader(stream, MAX_ARCHIVE_BYTES), spooled, 1 << 20)
+            spooled.seek(0)
+            stream = spooled
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or _skip(info.filename):
+                    continue
+                with archive.open(info) as member:
+                    yield info.filename, member
+    finally:
+        if spooled is not None:
+            spooled.close()
+
+
+def members_for(filename, mimetype, stream):
+    """Pick iter_zip / iter_tar by mimetype or file name; None if not an archive."""
+    name = (filename or '').lower()
+    if mimetype in ZIP_MIMETYPES or name.endswith('.zip'):
+        return iter_zip(stream)
+    if mimetype in TAR_MIMETYPES or name.endswith(TAR_EXTENSIONS):
+        return iter_tar(stream)
+    return None
+
+
+# ---------- Detection ----------
+
+def _line(obj):
+    return json.dumps(obj) + '\n'
+
+
+def _error_line(index, filename, message, code=400):
+    return _line({'index': index, 'status': 'error', 'filename': filename, 'code': code, 'message': message})
+
+
+def detect_stream(members, user_id):
+    """Generator of NDJSON lines for a batch (see module docstring)."""
+    from detection import image_records
+    from detectors.detect_image import _BATCH_MAX_SIZE
+    from history_store import add_history_records, utc_date_str
+
+    stored = []     # (index, record) in the order they will be inserted
+    failed = 0
+    chunk = []      # (index, save_path, filename, digest)
+    prepaid = admission.COSTS['batch']  # images covered by the request's own admission charge
+    limited = False
+
+    def charge_chunk():
+        nonlocal prepaid
+        cost = len(chunk) * admission.COSTS['image']
+        covered = min(prepaid, cost)
+        prepaid -= covered
+        if cost > covered:
+            admission.charge(user_id, 'bulk', cost - covered)
+
+    def run_chunk():
+        nonlocal failed, limited
+        try:
+            charge_chunk()
+        except admission.Rejected as e:
+            limited = True
+            yield _line({'status': 'error', 'code': e.status_code, 'retry_after': e.retry_after,
+                         'message': f'{e}; stopped at file {chunk[0][0]}, rest skipped'})
+            chunk.clear()
+            return
+        try:
+            records = image_records([(p, f, d) for _, p, f, d in chunk], user_id)
+        except Exception as e:
+            logging.exception('Batch chunk detection failed')
+            records = [RuntimeError(f'Detection failed: {e}')] * len(chunk)
+        for (index, _, filename, _), record in zip(chunk, records):
+            if isinstance(record, Exception):
+                failed += 1
+                code = getattr(record, 'status_code', 400 if isinstance(record, ValueError) else 500)
+                yield _error_line(index, filename, str(record), code)
+                continue
+            stored.append((index, record))
+            body = {'index': index, 'status': 'success', 'type': record['type'], 'score': record['score'],
+                    'confidence': record['confidence'], 'analysis': record['analysis']}
+            body.update(record['details'])
+            yield _line(body)
+        chunk.clear()
+
+    completed = False
+    try:
+        index = -1
+        try:
+            for index, (name, stream) in enumerate(members):
+                if index >= MAX_FILES:
+                    yield _line({'status': 'error', 'message': f'Batch limit of {MAX_FILES} files reached; rest skipped'})
+                    break
+                filename = secure_filename(os.path.basename(name)) or f'upload_{index}'
+                try:
+                    digest, save_path = blob_store.receive(stream, filename, MAX_UPLOAD_BYTES,
+                                                           validate=check_image, kind='image')
+                except IngestError as e:
+                    failed += 1
+                    yield _error_line(index, filename, str(e), e.status_code)
+                    continue
+                chunk.append((index, save_path, filename, digest))
+                if len(chunk) >= _BATCH_MAX_SIZE:
+                    yield from run_chunk()
+                    if limited:
+                        break
+        except (IngestError, tarfile.TarError, zipfile.BadZipFile, EOFError, OSError) as e:
+            # Broken or oversized archive: keep what was read so far
+            yield _line({'status': 'error', 'code': getattr(e, 'status_code', 400),
+                         'message': f'Could not read the upload after {index + 1} file(s): {e}'})
+        if chunk:
+            yield from run_chunk()
+        completed = True
+    finally:
+        if not completed and stored:
+            # Client went away mid-stream: still keep what was scored
+            try:
+                add_history_records(user_id, [r for _, r in stored])
+            except Exception:
+                logging.exception('Failed to save partial batch history')
+
+    date_str = utc_date_str()
+    try:
+        ids = add_history_records(user_id, [r for _, r in stored], date_str)
+    except Exception as e:
+        logging.exception('Failed to save batch history')
+        yield _line({'status': 'error', 'code': 500, 'processed': len(stored), 'failed': failed,
+                     'message': f'Failed to save history: {e}'})
+        return
+    yield _line({
+        'status': 'done',
+        'processed': len(stored),
+        'failed': failed,
+        'ids': {str(index): new_id for (index, _), new_id in zip(stored, ids)},
+        'date': date_str,
+    })
@@ -0,0 +1,12 @@
+"""
+Offline, reproducible benchmarks for the detectors, history queries and API.
+
+Everything runs against synthetic fixtures (benchmarks/fixtures.py) and a
+stub model (benchmarks/stub_model.py) in a throwaway directory, so no
+network, model download or existing database is needed.
+
+    python -m benchmarks.run --out before.json
+    # ... change code ...
+    python -m benchmarks.run --out after.json
+    python -m benchmarks.compare before.json after.json   # exit 1 on regressions
+"""
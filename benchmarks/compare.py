@@ -0,0 +1,82 @@
+"""
+Compare two benchmark JSON files and flag regressions.
+
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 0.10]
+
+Every numeric leaf present in both files is compared. Keys ending in _ms,
+_s or _mb count as "lower is better"; keys ending in _per_s as "higher is
+better"; other numbers (counts, config) are ignored. A change worse than
+`threshold` (relative) is a regression, and the exit status is 1 if any
+regression was found.
+"""
+import argparse
+import json
+import sys
+
+
+def _direction(key):
+    if key.endswith('_per_s'):
+        return 1     # higher is better
+    if key.endswith(('_ms', '_s', '_mb')):
+        return -1    # lower is better
+    return 0
+
+
+def _leaves(node, prefix=''):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from _leaves(value, f'{prefix}.{key}' if prefix else key)
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        yield prefix, float(node)
+
+
+def compare(baseline, candidate, threshold=0.10):
+    """List of {metric, baseline, candidate, change, status} rows."""
+    base = dict(_leaves(baseline.get('results', {})))
+    cand = dict(_leaves(candidate.get('results', {})))
+    rows = []
+    for metric in sorted(set(base) & set(cand)):
+        direction = _direction(metric.rsplit('.', 1)[-1])
+        if direction == 0:
+            continue
+        old, new = base[metric], cand[metric]
+        change = (new - old) / old if old else 0.0
+        worse = -change if direction == 1 else change
+        status = 'regression' if worse > threshold else 'improvement' if worse < -threshold else 'same'
+        rows.append({'metric': metric, 'baseline': old, 'candidate': new,
+                     'change': round(change, 4), 'status': status})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files.')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative change treated as significant')
+    parser.add_argument('--json', action='store_true', help='print rows as JSON instead of a table')
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding='utf-8') as f:
+        candidate = json.load(f)
+    rows = compare(baseline, candidate, args.threshold)
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"baseline  {baseline.get('meta', {}).get('commit')}")
+        print(f"candidate {candidate.get('meta', {}).get('commit')}")
+        width = max([len(r['metric']) for r in rows] + [6])
+        for r in rows:
+            marker = {'regression': '!!', 'improvement': '++', 'same': '  '}[r['status']]
+            print(f"{marker} {r['metric']:<{width}} {r['baseline']:>12.3f} -> {r['candidate']:>12.3f} "
+                  f"({r['change']:+.1%})")
+    regressions = [r for r in rows if r['status'] == 'regression']
+    if regressions:
+        print(f'{len(regressions)} regression(s) above {args.threshold:.0%}', file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Synthetic, seeded benchmark inputs: images, texts and videos.
+
+The same seed always produces byte-identical images and texts, so runs on
+different commits measure the same work.
+"""
+import io
+import os
+import random
+
+import numpy as np
+from PIL import Image
+
+_WORDS = ('the model data image text video result score detector human generated analysis '
+          'sample window token frame batch queue cache history request latency signal '
+          'noise pattern pixel feature layer output input value review report').split()
+
+
+def image(width=512, height=512, seed=0, fmt='PNG'):
+    """Encoded image bytes with smooth gradients plus noise (compresses like a photo)."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([
+        (x * 255 // max(1, width - 1)),
+        (y * 255 // max(1, height - 1)),
+        ((x + y) * 127 // max(1, width + height - 2)),
+    ], axis=-1).astype(np.int16)
+    noise = rng.integers(-24, 24, size=base.shape, dtype=np.int16)
+    pixels = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels, 'RGB').save(buf, fmt)
+    return buf.getvalue()
+
+
+def images(count, width=512, height=512, seed=0, fmt='PNG'):
+    """`count` distinct encoded images (distinct bytes, so caches never hit)."""
+    return [image(width, height, seed + i, fmt) for i in range(count)]
+
+
+def text(words=500, seed=0):
+    """Pseudo-English text of `words` words, split into sentences."""
+    rng = random.Random(seed)
+    out = []
+    for i in range(words):
+        word = rng.choice(_WORDS)
+        out.append(word.capitalize() if i == 0 or out[-1].endswith('.') else word)
+        if rng.random() < 0.08:
+            out[-1] += '.'
+    return ' '.join(out) + '.'
+
+
+def video(path, seconds=10, fps=24, width=320, height=240, scenes=5, seed=0):
+    """Write an MJPG .avi with `scenes` hard cuts and moving content; returns `path`."""
+    import cv2
+
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f'OpenCV cannot write {path}')
+    total = int(seconds * fps)
+    per_scene = max(1, total // max(1, scenes))
+    colors = rng.integers(0, 255, size=(max(1, scenes) + 1, 3))
+    try:
+        for i in range(total):
+            frame = np.empty((height, width, 3), dtype=np.uint8)
+            frame[:] = colors[min(i // per_scene, len(colors) - 1)]
+            x = (i * 7) % max(1, width - 40)
+            frame[height // 3:height // 3 + 40, x:x + 40] = 255 - frame[0, 0]
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+def write_images(directory, count, width=512, height=512, seed=0, fmt='PNG'):
+    """Write images() to `directory`; returns the paths."""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i, data in enumerate(images(count, width, height, seed, fmt)):
+        path = os.path.join(directory, f'bench_{seed + i}.{fmt.lower()}')
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
@@ -0,0 +1,350 @@
+"""
+Run the benchmark suite and write the results as JSON.
+
+    python -m benchmarks.run --out results.json
+    python -m benchmarks.run --quick                 # smaller inputs, fewer rounds
+    python -m benchmarks.run --only image_single,api_detect_image
+
+Everything runs in a temporary directory with its own databases and upload
+folder. Latencies are in milliseconds; throughputs in items per second;
+peak_rss_mb is the process's peak resident set size after the benchmark.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Isolate every database before any project module reads its settings
+_WORKDIR = tempfile.mkdtemp(prefix='aidetector-bench-')
+os.environ.setdefault('DATABASE_PATH', os.path.join(_WORKDIR, 'bench.db'))
+os.environ.setdefault('JOBS_DB_PATH', os.path.join(_WORKDIR, 'jobs.db'))
+os.environ.setdefault('BLOB_STORE_DIR', os.path.join(_WORKDIR, 'uploads'))
+os.environ.setdefault('ADMISSION_DB_PATH', os.path.join(_WORKDIR, 'admission.db'))
+# Throughput runs would otherwise hit the per-user rate limit
+os.environ.setdefault('ADMISSION_ENABLED', '0')
+os.environ.setdefault('RESULT_CACHE_ENABLED', '0')
+os.environ.setdefault('WARMUP_MODE', 'off')
+
+from benchmarks import fixtures, stub_model  # noqa: E402
+
+SCHEMA_VERSION = 1
+
+
+# ---------- Helpers ----------
+
+def _percentiles(samples_ms):
+    ordered = sorted(samples_ms)
+
+    def pct(p):
+        if not ordered:
+            return None
+        k = (len(ordered) - 1) * p / 100.0
+        lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+        return round(ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo), 3)
+
+    return {
+        'n': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered), 3) if ordered else None,
+        'p50_ms': pct(50),
+        'p95_ms': pct(95),
+        'p99_ms': pct(99),
+        'max_ms': round(ordered[-1], 3) if ordered else None,
+    }
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0, 1)
+
+
+def _time_calls(fn, rounds):
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return samples
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).decode().strip()
+    except Exception:
+        return None
+
+
+# ---------- Benchmarks ----------
+
+def bench_image_single(cfg):
+    """detect_image_ai on one file at a time (decode + micro-batch round trip)."""
+    from detectors.detect_image import detect_image_ai
+    paths = fixtures.write_images(os.path.join(_WORKDIR, 'img'), cfg.images, cfg.image_size, cfg.image_size)
+    detect_image_ai(paths[0])  # load the stub outside the timed part
+    it = iter(paths * (cfg.rounds // len(paths) + 1))
+    return _percentiles(_time_calls(lambda: detect_image_ai(next(it)), cfg.rounds))
+
+
+def bench_image_batched(cfg):
+    """detect_images_ai on a list (direct batches) and concurrent detect_image_ai (micro-batching)."""
+    from detectors.detect_image import detect_image_ai, detect_images_ai
+    paths = fixtures.write_images(os.path.join(_WORKDIR, 'img'), cfg.images, cfg.image_size, cfg.image_size)
+    detect_images_ai(paths[:1])
+
+    started = time.perf_counter()
+    detect_images_ai(paths)
+    direct = len(paths) / (time.perf_counter() - started)
+
+    with ThreadPoolExecutor(max_workers=cfg.max_concurrency) as pool:
+        started = time.perf_counter()
+        list(pool.map(detect_image_ai, paths))
+        concurrent = len(paths) / (time.perf_counter() - started)
+    return {
+        'images': len(paths),
+        'direct_images_per_s': round(direct, 2),
+        'concurrent_images_per_s': round(concurrent, 2),
+        'concurrency': cfg.max_concurrency,
+    }
+
+
+def bench_image_cascade(cfg):
+    """detect_images_ai through the default two-stage cascade vs. the single model."""
+    from detectors import detect_image
+    paths = fixtures.write_images(os.path.join(_WORKDIR, 'img'), cfg.images, cfg.image_size, cfg.image_size)
+
+    def run():
+        detect_image.detect_images_ai(paths[:1])
+        started = time.perf_counter()
+        results = detect_image.detect_images_ai(paths)
+        return len(paths) / (time.perf_counter() - started), results
+
+    single, _ = run()
+    saved = (detect_image._CASCADE, detect_image._PIPE, detect_image._PIPE_MODEL_NAME, detect_image._STAGES)
+    detect_image._CASCADE, detect_image._PIPE = True, None
+    try:
+        cascade, results = run()
+    finally:
+        detect_image._CASCADE, detect_image._PIPE, detect_image._PIPE_MODEL_NAME, detect_image._STAGES = saved
+    return {
+        'images': len(paths),
+        'single_images_per_s': round(single, 2),
+        'cascade_images_per_s': round(cascade, 2),
+        'escalation_rate': round(sum(r['escalated'] for r in results) / len(results), 3),
+        'band': list(detect_image._CASCADE_BAND),
+    }
+
+
+def bench_text(cfg):
+    """detect_text on short and long documents (windowing + aggregation)."""
+    from detectors.detect_text import detect_text
+    out = {}
+    for words in cfg.text_words:
+        doc = fixtures.text(words)
+        out[f'{words}_words'] = _percentiles(_time_calls(lambda: detect_text(doc), max(3, cfg.rounds // 4)))
+    return out
+
+
+def bench_video(cfg):
+    """detect_video end to end on a synthetic clip (decode pool + frame batches)."""
+    from detectors.detect_video import detect_video
+    path = fixtures.video(os.path.join(_WORKDIR, 'bench.avi'), seconds=cfg.video_seconds)
+    detect_video(path)  # start the decode pool outside the timed part
+    samples = _time_calls(lambda: detect_video(path), max(2, cfg.rounds // 10))
+    return _percentiles(samples)
+
+
+def bench_history(cfg):
+    """Keyset page reads, filtered reads, full-text search pages and a full export walk over a seeded history."""
+    import db
+    from history_search import search_history
+    from history_store import iter_history_rows, list_history, utc_date_str, utc_now_iso
+
+    db.init_schema()
+    user_id = db.execute('INSERT INTO users (username, password) VALUES (?, ?)',
+                         (f'history-bench-{time.time_ns()}', 'x')).lastrowid
+    rows = [(user_id, ('image', 'text', 'video')[i % 3], f'item {i}', i % 101, 50 + i % 50,
+             utc_date_str(), f'full content {i}', 'Benchmark', utc_now_iso())
+            for i in range(cfg.history_rows)]
+    started = time.perf_counter()
+    with db.transaction():
+        db.executemany('''INSERT INTO history (user_id, type, content, score, confidence, date, full_content,
+                                              analysis, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
+    insert_rows_per_s = len(rows) / (time.perf_counter() - started)
+
+    first_page = _percentiles(_time_calls(lambda: list_history(user_id), cfg.rounds))
+
+    def deep_pages():
+        cursor = None
+        for _ in range(10):
+            _, cursor = list_history(user_id, cursor=cursor)
+            if cursor is None:
+                break
+    paged = _percentiles(_time_calls(deep_pages, max(3, cfg.rounds // 5)))
+    filtered = _percentiles(_time_calls(lambda: list_history(user_id, types=['text'], min_score=50),
+                                        cfg.rounds))
+    # 'item' matches every row: the worst case for relevance ranking
+    search_rank = _percentiles(_time_calls(lambda: search_history(user_id, 'item'), cfg.rounds))
+    search_newest = _percentiles(_time_calls(lambda: search_history(user_id, 'item', sort='newest'), cfg.rounds))
+    started = time.perf_counter()
+    exported = sum(1 for _ in iter_history_rows(user_id))
+    export_rows_per_s = exported / (time.perf_counter() - started)
+    return {
+        'rows': len(rows),
+        'insert_rows_per_s': round(insert_rows_per_s, 1),
+        'first_page': first_page,
+        'ten_pages': paged,
+        'filtered_page': filtered,
+        'search_page_rank': search_rank,
+        'search_page_newest': search_newest,
+        'export_rows_per_s': round(export_rows_per_s, 1),
+    }
+
+
+def _api_client(app_module, username):
+    import db
+    db.init_schema()
+    user_id = db.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, 'x')).lastrowid
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user_id)
+        sess['_fresh'] = True
+    return client
+
+
+def bench_api_detect_image(cfg):
+    """POST /api/detect/image through the Flask test client at several concurrency levels."""
+    import app as app_module
+
+    app_module.app.config['TESTING'] = True
+    payloads = fixtures.images(cfg.images, cfg.image_size, cfg.image_size, seed=1000)
+
+    out = {}
+    for level in cfg.concurrency:
+        clients = [_api_client(app_module, f'api-bench-{level}-{i}-{time.time_ns()}') for i in range(level)]
+        requests_per_client = max(1, cfg.rounds // level)
+        lock = threading.Lock()
+        samples, errors = [], 0
+
+        def worker(index):
+            nonlocal errors
+            client = clients[index]
+            local = []
+            for n in range(requests_per_client):
+                data = payloads[(index * requests_per_client + n) % len(payloads)]
+                started = time.perf_counter()
+                resp = client.post('/api/detect/image', content_type='multipart/form-data',
+                                   data={'image': (io.BytesIO(data), f'b{index}_{n}.png')})
+                local.append((time.perf_counter() - started) * 1000.0)
+                if resp.status_code != 200:
+                    with lock:
+                        errors += 1
+            with lock:
+                samples.extend(local)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(level)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        stats = _percentiles(samples)
+        stats['requests_per_s'] = round(len(samples) / elapsed, 2)
+        stats['errors'] = errors
+        out[f'c{level}'] = stats
+    return out
+
+
+BENCHMARKS = {
+    'image_single': bench_image_single,
+    'image_batched': bench_image_batched,
+    'image_cascade': bench_image_cascade,
+    'text': bench_text,
+    'video': bench_video,
+    'history': bench_history,
+    'api_detect_image': bench_api_detect_image,
+}
+
+
+# ---------- CLI ----------
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(description='Run the offline benchmark suite.')
+    parser.add_argument('--out', help='write JSON here (default: stdout)')
+    parser.add_argument('--only', help='comma-separated benchmark names: ' + ','.join(BENCHMARKS))
+    parser.add_argument('--quick', action='store_true', help='small inputs and few rounds (CI smoke run)')
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--images', type=int, default=32)
+    parser.add_argument('--image-size', type=int, default=512)
+    parser.add_argument('--text-words', default='200,5000', help='comma-separated document lengths')
+    parser.add_argument('--video-seconds', type=float, default=20)
+    parser.add_argument('--history-rows', type=int, default=20000)
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated client thread counts')
+    parser.add_argument('--stub-batch-ms', type=float, default=stub_model.BATCH_MS)
+    parser.add_argument('--stub-item-ms', type=float, default=stub_model.ITEM_MS)
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.rounds, args.images, args.image_size = 10, 8, 256
+        args.text_words, args.video_seconds, args.history_rows, args.concurrency = '200,2000', 5, 2000, '1,4'
+    args.text_words = [int(w) for w in args.text_words.split(',')]
+    args.concurrency = [int(c) for c in args.concurrency.split(',')]
+    args.max_concurrency = max(args.concurrency)
+    return args
+
+
+def main(argv=None):
+    cfg = _parse_args(argv)
+    names = cfg.only.split(',') if cfg.only else list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        raise SystemExit(f'Unknown benchmark(s): {", ".join(unknown)}')
+
+    stub_model.install(cfg.stub_batch_ms, cfg.stub_item_ms)
+    report = {
+        'schema': SCHEMA_VERSION,
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'config': {k: v for k, v in vars(cfg).items() if k not in ('out', 'only')},
+        },
+        'results': {},
+    }
+    try:
+        for name in names:
+            print(f'running {name} ...', file=sys.stderr)
+            started = time.perf_counter()
+            try:
+                result = BENCHMARKS[name](cfg)
+            except Exception as e:
+                result = {'error': f'{type(e).__name__}: {e}'}
+            result['wall_s'] = round(time.perf_counter() - started, 3)
+            result['peak_rss_mb'] = _peak_rss_mb()
+            report['results'][name] = result
+    finally:
+        shutil.rmtree(_WORKDIR, ignore_errors=True)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if cfg.out:
+        with open(cfg.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Stub models so benchmarks run offline and measure our code, not a download.
+
+install() swaps the model loaders of detectors.detect_image and
+detectors.detect_text for deterministic stand-ins:
+
+- the image "pipeline" resizes each image to 224x224, converts it to an
+  array (the real preprocessing cost) and sleeps a fixed per-batch plus
+  per-image time, releasing the GIL like a real forward pass (a quarter
+  of that for backend "onnx", standing in for an int8 model); scores are
+  spread over 0..1 by a hash of the pixels;
+- the text "model" tokenizes on whitespace and scores windows with the
+  same fixed costs.
+
+Set the costs with --stub-batch-ms / --stub-item-ms (see run.py) to model
+a faster or slower machine. Everything around the model (decoding,
+batching, windowing, aggregation, caching, the DB and the HTTP layer)
+runs unchanged.
+"""
+import time
+import zlib
+
+import numpy as np
+
+BATCH_MS = 5.0
+ITEM_MS = 2.0
+MODEL_NAME = 'benchmark-stub'
+
+
+ONNX_COST_SCALE = 0.25
+
+
+def _forward_cost(n, scale=1.0):
+    time.sleep(scale * (BATCH_MS + ITEM_MS * n) / 1000.0)
+
+
+class StubImagePipeline:
+    def __init__(self, cost_scale=1.0):
+        self.cost_scale = cost_scale
+
+    def __call__(self, images, batch_size=None):
+        single = not isinstance(images, list)
+        batch = [images] if single else images
+        arrays = [np.asarray(img.resize((224, 224)), dtype=np.float32) / 255.0 for img in batch]
+        _forward_cost(len(batch), self.cost_scale)
+        outputs = []
+        for arr in arrays:
+            ai = float(0.05 + 0.9 * (zlib.crc32(arr[::8, ::8].tobytes()) % 1000) / 1000.0)
+            outputs.append([{'label': 'fake', 'score': ai}, {'label': 'real', 'score': 1.0 - ai}])
+        return outputs[0] if single else outputs
+
+
+class StubTokenizer:
+    def __call__(self, text, add_special_tokens=False, verbose=False):
+        return {'input_ids': [zlib.crc32(w.encode()) % 50000 for w in text.split()]}
+
+
+def _score_windows(windows):
+    probs = []
+    for i in range(0, len(windows), 16):
+        chunk = windows[i:i + 16]
+        _forward_cost(len(chunk))
+        for w in chunk:
+            ai = (sum(w) % 1000) / 1000.0
+            probs.append({'ai': ai, 'human': 1.0 - ai})
+    return probs
+
+
+def install(batch_ms=None, item_ms=None):
+    """Patch the detectors to use the stubs (call before the first detection)."""
+    global BATCH_MS, ITEM_MS
+    if batch_ms is not None:
+        BATCH_MS = float(batch_ms)
+    if item_ms is not None:
+        ITEM_MS = float(item_ms)
+
+    from detectors import detect_image, detect_text
+
+    def build_pipeline(model_name, backend=None):
+        if backend is None:
+            return StubImagePipeline(), MODEL_NAME
+        scale = ONNX_COST_SCALE if backend == 'onnx' else 1.0
+        return StubImagePipeline(scale), f'{MODEL_NAME}:{model_name}@{backend}'
+
+    detect_image._build_pipeline = build_pipeline
+    detect_image._PIPE = None
+    detect_image._PIPE_MODEL_NAME = None
+
+    detect_text._TOKENIZER = StubTokenizer()
+    detect_text._MODEL = object()
+    detect_text._MODEL_NAME = MODEL_NAME
+    detect_text._score_windows = _score_windows
@@ -0,0 +1,300 @@
+"""
+Content-addressed store for uploaded files.
+
+Each distinct upload is stored once, at
+
+    <BLOB_STORE_DIR>/<h[0:2]>/<h[2:4]>/<sha256><ext>
+
+so identical files are kept once whoever uploads them and under whatever
+name, and two users uploading "image.png" no longer overwrite each other.
+Files are streamed to a temporary name under <BLOB_STORE_DIR>/tmp and
+renamed into place, so a partial upload is never visible under its hash.
+
+The `blobs` table lists the stored files. `history.blob_hash` names the
+blob a row was scored from, and triggers on `history` keep
+`blobs.refcount` equal to the number of rows pointing at it (deleting an
+entry or clearing the history releases its blobs). The collector
+(`python -m blob_store gc`, or the start_gc() timer in each web worker)
+deletes:
+    - blobs that nothing has referenced for BLOB_GC_GRACE_HOURS; uploads
+      are stored before their history row exists and jobs may sit queued,
+      so a fresh blob is never collected straight away
+    - with BLOB_RETENTION_DAYS > 0, blobs last uploaded longer ago than
+      that, referenced or not; their history rows keep the path as text
+The timers share one lease row (`blob_gc_lease`): each interval, only the
+worker that claims it runs collect(), so workers never scan the same
+directory at once.
+
+Settings:
+    BLOB_STORE_DIR            root directory               (default static/uploads)
+    BLOB_STORE_IMAGE_MODE     original | compressed | thumbnail (default original)
+        compressed  images re-encoded as WebP (BLOB_WEBP_QUALITY, default 90)
+                    when that is smaller than the upload
+        thumbnail   images kept as WebP at most BLOB_THUMBNAIL_SIDE px
+                    (default 448, the size the detector decodes to anyway)
+    BLOB_GC_GRACE_HOURS       default 24
+    BLOB_RETENTION_DAYS       default 0 (referenced blobs are kept)
+    BLOB_GC_INTERVAL_SECONDS  default 600; 0 disables the background collector
+"""
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+import db
+from detectors.ingest import load_image, save_stream
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.environ.get('BLOB_STORE_DIR', os.path.join(BASE_DIR, 'static', 'uploads')))
+TMP_DIR = os.path.join(ROOT, 'tmp')
+
+IMAGE_MODES = ('original', 'compressed', 'thumbnail')
+IMAGE_MODE = os.environ.get('BLOB_STORE_IMAGE_MODE', 'original').strip().lower()
+WEBP_QUALITY = int(os.environ.get('BLOB_WEBP_QUALITY', '90'))
+THUMBNAIL_SIDE = int(os.environ.get('BLOB_THUMBNAIL_SIDE', '448'))
+if IMAGE_MODE not in IMAGE_MODES:
+    logging.warning(f"Unknown BLOB_STORE_IMAGE_MODE '{IMAGE_MODE}'; storing originals")
+    IMAGE_MODE = 'original'
+
+GC_GRACE = float(os.environ.get('BLOB_GC_GRACE_HOURS', '24')) * 3600
+RETENTION = float(os.environ.get('BLOB_RETENTION_DAYS', '0')) * 86400
+GC_INTERVAL = float(os.environ.get('BLOB_GC_INTERVAL_SECONDS', '600'))
+
+# Blobs deleted per transaction, so the collector never holds the write lock for long
+_GC_BATCH = 500
+# Largest side kept by "compressed" (anything under ingest's pixel limit fits)
+_FULL_SIZE = 1 << 16
+
+_HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+_EXT_RE = re.compile(r'^\.[a-z0-9]{1,8}$')
+_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+_gc_pid = None
+_gc_lock = threading.Lock()
+
+
+@db.register_schema
+def _schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS blobs (
+        hash TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        last_put_at REAL NOT NULL,
+        released_at REAL
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_blobs_released ON blobs (released_at) WHERE refcount <= 0')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_blobs_last_put ON blobs (last_put_at)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS blob_gc_lease (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        holder TEXT,
+        expires_at REAL NOT NULL
+    )''')
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(history)')]
+    if 'blob_hash' not in columns:
+        conn.execute('ALTER TABLE history ADD COLUMN blob_hash TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_blob_hash ON history (blob_hash) WHERE blob_hash IS NOT NULL')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_history_blob_ref
+        AFTER INSERT ON history WHEN NEW.blob_hash IS NOT NULL BEGIN
+            UPDATE blobs SET refcount = refcount + 1, released_at = NULL WHERE hash = NEW.blob_hash;
+        END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_history_blob_unref
+        AFTER DELETE ON history WHEN OLD.blob_hash IS NOT NULL BEGIN
+            UPDATE blobs SET refcount = refcount - 1,
+                             released_at = CASE WHEN refcount <= 1 THEN {_NOW} ELSE released_at END
+            WHERE hash = OLD.blob_hash;
+        END''')
+
+
+# ---------- Paths ----------
+
+def blob_relpath(digest, ext=''):
+    """Sharded location of a blob, relative to ROOT."""
+    return f'{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+
+def path_for(relpath):
+    return os.path.join(ROOT, *relpath.split('/'))
+
+
+def relative_path(path):
+    """
+    Path as stored in history.full_content: relative to the app directory
+    ("static/uploads/..."), or absolute for a BLOB_STORE_DIR outside it.
+    """
+    rel = os.path.relpath(os.path.abspath(path), BASE_DIR)
+    return os.path.abspath(path) if rel.startswith(os.pardir) else rel.replace(os.sep, '/')
+
+
+def hash_for_path(path):
+    """The blob hash if `path` is a file in this store, else None (e.g. legacy uploads)."""
+    path = os.path.abspath(path)
+    digest = os.path.splitext(os.path.basename(path))[0]
+    if not _HASH_RE.match(digest):
+        return None
+    return digest if os.path.dirname(path) == os.path.dirname(path_for(blob_relpath(digest))) else None
+
+
+def _extension(filename):
+    ext = os.path.splitext(filename or '')[1].lower()
+    return ext if _EXT_RE.match(ext) else ''
+
+
+# ---------- Writes ----------
+
+def _transcode(tmp_path, ext):
+    """Apply IMAGE_MODE to a validated image upload; returns (path, ext)."""
+    side = THUMBNAIL_SIDE if IMAGE_MODE == 'thumbnail' else _FULL_SIZE
+    out = f'{tmp_path}.webp'
+    load_image(tmp_path, side).save(out, 'WEBP', quality=WEBP_QUALITY, method=4)
+    if IMAGE_MODE == 'compressed' and os.path.getsize(out) >= os.path.getsize(tmp_path):
+        os.remove(out)
+        return tmp_path, ext
+    return out, '.webp'
+
+
+def put(src, digest, ext=''):
+    """
+    Move the file at `src` into the store under `digest` (dropping it if
+    that blob already exists) and return the blob's absolute path.
+    """
+    now = time.time()
+    with db.transaction() as conn:
+        row = conn.execute('SELECT path FROM blobs WHERE hash = ?', (digest,)).fetchone()
+        if row:
+            relpath = row[0]
+            # A re-upload restarts the grace period of an unreferenced blob
+            conn.execute('''UPDATE blobs SET last_put_at = ?,
+                                             released_at = CASE WHEN refcount <= 0 THEN ? ELSE released_at END
+                            WHERE hash = ?''', (now, now, digest))
+        else:
+            relpath = blob_relpath(digest, ext)
+            conn.execute('''INSERT INTO blobs (hash, path, size, refcount, created_at, last_put_at, released_at)
+                            VALUES (?, ?, ?, 0, ?, ?, ?)''', (digest, relpath, os.path.getsize(src), now, now, now))
+        target = path_for(relpath)
+        # Checked under the write lock, so the collector cannot remove it in between
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(src, target)
+    return target
+
+
+def receive(stream, filename, max_bytes=None, validate=None, kind='file'):
+    """
+    Store an upload stream. `validate(path)` may raise to reject the file
+    before it is stored; images are stored per IMAGE_MODE.
+    Returns (sha256 of the uploaded bytes, blob path).
+    """
+    os.makedirs(TMP_DIR, exist_ok=True)
+    tmp_path = os.path.join(TMP_DIR, uuid.uuid4().hex)
+    stored = tmp_path
+    ext = _extension(filename)
+    try:
+        digest, _ = save_stream(stream, tmp_path, max_bytes)
+        if validate:
+            validate(tmp_path)
+        if kind == 'image' and IMAGE_MODE != 'original':
+            stored, ext = _transcode(tmp_path, ext)
+        return digest, put(stored, digest, ext)
+    finally:
+        for path in {tmp_path, stored}:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+# ---------- Garbage collection ----------
+
+def _delete(conn, rows):
+    for digest, relpath, refcount in rows:
+        if refcount > 0:
+            conn.execute('UPDATE history SET blob_hash = NULL WHERE blob_hash = ?', (digest,))
+        conn.execute('DELETE FROM blobs WHERE hash = ?', (digest,))
+        try:
+            os.remove(path_for(relpath))
+        except FileNotFoundError:
+            pass
+
+
+def collect(now=None):
+    """Delete released and expired blobs (see module docstring); returns the number removed."""
+    now = now or time.time()
+    queries = [('SELECT hash, path, refcount FROM blobs WHERE refcount <= 0 AND released_at < ? LIMIT ?',
+                now - GC_GRACE)]
+    if RETENTION > 0:
+        queries.append(('SELECT hash, path, refcount FROM blobs WHERE last_put_at < ? LIMIT ?', now - RETENTION))
+    removed = 0
+    for sql, cutoff in queries:
+        while True:
+            with db.transaction() as conn:
+                rows = conn.execute(sql, (cutoff, _GC_BATCH)).fetchall()
+                _delete(conn, rows)
+            removed += len(rows)
+            if len(rows) < _GC_BATCH:
+                break
+    # Temp files left behind by crashed uploads
+    if os.path.isdir(TMP_DIR):
+        for entry in os.scandir(TMP_DIR):
+            try:
+                if entry.stat().st_mtime < now - GC_GRACE:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def _claim(holder, interval, now=None):
+    """Take the collector lease for `interval` seconds; False while another process holds it."""
+    now = now or time.time()
+    with db.transaction() as conn:
+        conn.execute('INSERT OR IGNORE INTO blob_gc_lease (id, holder, expires_at) VALUES (1, NULL, 0)')
+        return conn.execute('UPDATE blob_gc_lease SET holder = ?, expires_at = ? WHERE id = 1 AND expires_at <= ?',
+                            (holder, now + interval, now)).rowcount == 1
+
+
+def _gc_loop(interval):
+    holder = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    while True:
+        time.sleep(interval)
+        try:
+            if not _claim(holder, interval):
+                continue
+            removed = collect()
+            if removed:
+                logging.info(f"Blob store GC removed {removed} blobs")
+        except Exception:
+            logging.exception('Blob store GC failed')
+
+
+def start_gc(interval=GC_INTERVAL):
+    """
+    Start a daemon thread (once per process) that runs collect() every
+    `interval` seconds whenever it holds the collector lease.
+    """
+    global _gc_pid
+    if interval <= 0:
+        return
+    with _gc_lock:
+        if _gc_pid == os.getpid():
+            return
+        _gc_pid = os.getpid()
+    threading.Thread(target=_gc_loop, args=(interval,), name='blob-gc', daemon=True).start()
+
+
+def stats():
+    row = db.query_one('SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount <= 0), 0) FROM blobs')
+    return {'blobs': row[0], 'bytes': row[1], 'unreferenced': row[2]}
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Upload blob store maintenance.')
+    parser.add_argument('command', choices=('gc', 'stats'))
+    args = parser.parse_args()
+    if args.command == 'gc':
+        print(f'Removed {collect()} blobs')
+    print(json.dumps(stats()))
@@ -0,0 +1,208 @@
+"""
+SQLite data access layer.
+
+Connections are pooled per thread (and per process, so forked gunicorn
+workers never share a handle) and reused across requests, which also keeps
+sqlite3's prepared-statement cache warm. Every connection runs in WAL mode
+so readers are not blocked by a writer in another worker:
+
+    journal_mode=WAL      readers and one writer run concurrently
+    synchronous=NORMAL    fsync at checkpoints only (safe with WAL)
+    cache_size=-16000     ~16 MB page cache per connection
+    mmap_size=256 MB      read pages straight from the OS page cache
+    temp_store=MEMORY
+    busy_timeout          wait for a lock instead of failing at once
+
+Connections are in autocommit mode; use `transaction()` to group writes.
+Calls that still hit "database is locked" are retried with backoff.
+
+The schema is created once per process before the first query (and by
+gunicorn's on_starting hook before workers fork, see gunicorn.conf.py).
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DB_PATH = os.environ.get('DATABASE_PATH', 'users.db')
+
+BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+MAX_RETRIES = 5
+_RETRY_BASE_DELAY = 0.05
+
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA cache_size=-16000',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA temp_store=MEMORY',
+)
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = set()   # (pid, path) pairs whose schema hooks have run
+_schema_hooks = {}      # path -> [callable(conn)]
+
+
+# ---------- Connections ----------
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000.0, isolation_level=None,
+                           check_same_thread=True, cached_statements=256)
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_conn(path=None):
+    """This thread's pooled connection to `path` (default: the app database)."""
+    path = path or DB_PATH
+    pid = os.getpid()
+    pool = getattr(_local, 'pool', None)
+    if pool is None or getattr(_local, 'pid', None) != pid:
+        pool = _local.pool = {}
+        _local.pid = pid
+    conn = pool.get(path)
+    if conn is None:
+        conn = pool[path] = _connect(path)
+    if (pid, path) not in _schema_ready:
+        _ensure_schema(path, conn)
+    return conn
+
+
+def close_all():
+    """Close this thread's connections (e.g. before a worker exits)."""
+    pool = getattr(_local, 'pool', None) or {}
+    for conn in pool.values():
+        conn.close()
+    _local.pool = {}
+
+
+# ---------- Retries / queries ----------
+
+def _is_busy(exc):
+    msg = str(exc).lower()
+    return 'locked' in msg or 'busy' in msg
+
+
+def with_retry(fn, *args, **kwargs):
+    """Call fn, retrying with jittered backoff while SQLite reports busy/locked."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return fn(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if attempt == MAX_RETRIES or not _is_busy(e):
+                raise
+            time.sleep(_RETRY_BASE_DELAY * (2 ** attempt) * (0.5 + random.random()))
+
+
+def execute(sql, args=(), path=None):
+    """Run one statement and return the cursor (lastrowid / rowcount)."""
+    conn = get_conn(path)
+    if conn.in_transaction:
+        # Retrying a single statement would break the caller's transaction
+        return conn.execute(sql, args)
+    return with_retry(conn.execute, sql, args)
+
+
+def executemany(sql, rows, path=None):
+    conn = get_conn(path)
+    if conn.in_transaction:
+        return conn.executemany(sql, rows)
+    return with_retry(conn.executemany, sql, rows)
+
+
+def query_one(sql, args=(), path=None):
+    return execute(sql, args, path).fetchone()
+
+
+def query_all(sql, args=(), path=None):
+    return execute(sql, args, path).fetchall()
+
+
+@contextmanager
+def transaction(path=None):
+    """
+    BEGIN IMMEDIATE ... COMMIT on this thread's connection; rolls back on error.
+    Taking the write lock up front avoids lock-upgrade deadlocks between workers.
+    """
+    conn = get_conn(path)
+    with_retry(conn.execute, 'BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    else:
+        with_retry(conn.execute, 'COMMIT')
+
+
+# ---------- Schema ----------
+
+def register_schema(fn, path=None):
+    """Register fn(conn) to create tables/indexes for `path`; runs once per process."""
+    path = path or DB_PATH
+    with _schema_lock:
+        _schema_hooks.setdefault(path, []).append(fn)
+        # Make processes that already touched this database run the new hook too
+        _schema_ready.difference_update({key for key in _schema_ready if key[1] == path})
+    return fn
+
+
+def _ensure_schema(path, conn):
+    with _schema_lock:
+        key = (os.getpid(), path)
+        if key in _schema_ready:
+            return
+        # One transaction, so workers starting together do not race on migrations
+        with_retry(conn.execute, 'BEGIN IMMEDIATE')
+        try:
+            for hook in _schema_hooks.get(path, []):
+                hook(conn)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        _schema_ready.add(key)
+
+
+def init_schema(path=None):
+    """Create schema for `path` now (startup hook)."""
+    get_conn(path)
+
+
+@register_schema
+def _app_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        totp_secret TEXT
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        type TEXT,
+        content TEXT,
+        score INTEGER,
+        confidence INTEGER,
+        date TEXT,
+        full_content TEXT,
+        analysis TEXT,
+        created_at TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''')
+    # Older databases: add created_at (UTC, sortable) and fill it from
+    # server-written `date` values ("YYYY-MM-DD HH:MM:SS UTC")
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(history)')]
+    if 'created_at' not in columns:
+        conn.execute('ALTER TABLE history ADD COLUMN created_at TEXT')
+        conn.execute("""UPDATE history SET created_at = substr(date, 1, 19)
+                        WHERE created_at IS NULL
+                          AND date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]*'""")
+    # Keyset pagination walks (user_id, id) newest first
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_user_id ON history (user_id, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_history_user_created ON history (user_id, created_at)')
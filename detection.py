@@ -0,0 +1,189 @@
+"""
+Run a detector on one input and shape the outcome as a history record.
+
+Shared by the synchronous /api/detect/* endpoints, the bulk endpoint
+(batch_detection.py) and the job workers in jobs.py. Every function returns a dict with the `history` columns
+(type, content, score, confidence, full_content, analysis) plus a
+`details` dict of extra fields for the API response.
+
+Detectors are imported inside the functions so that importing this module
+(and app.py) does not load any ML code.
+"""
+
+
+def _near_duplicate_details(match):
+    return {'distance': match['distance'], 'score': match['score'], 'analysis': match['analysis'],
+            'history_id': match['history_id']}
+
+
+def _image_lookup(save_path, digest, model, cache, user_id):
+    """
+    Everything before inference: exact-cache lookup, one bounded decode,
+    perceptual hashes and near-duplicate match against `user_id`'s own
+    uploads (none without a user). `state['result']` is None when the model
+    still has to run on `state['image']`.
+    """
+    from detectors import near_dup
+    from detectors.detect_image import _open_image
+    from detectors.phash import image_hashes
+
+    result = cache.get(digest) if cache else None
+    cached = result is not None
+
+    # Decode once (bounded size, see detectors/ingest.py) for hashing and the model
+    image = _open_image(save_path) if near_dup.enabled() or not cached else None
+    hashes = image_hashes(image) if image is not None and near_dup.enabled() else None
+    match = near_dup.find(hashes, model, user_id) if hashes and user_id is not None else None
+    reused = False
+    if not cached and match and near_dup.MODE == 'reuse':
+        result = near_dup.verdict_from_match(match, model)
+        reused = True
+    return {'result': result, 'cached': cached, 'image': image, 'hashes': hashes,
+            'match': match, 'reused': reused, 'digest': digest, 'path': save_path}
+
+
+def _stored_file(save_path):
+    """(full_content, blob hash or None) for an uploaded file, see blob_store.py."""
+    import blob_store
+
+    return blob_store.relative_path(save_path), blob_store.hash_for_path(save_path)
+
+
+def _image_record_from(state, filename, model):
+    result = state['result']
+    full_content, blob_hash = _stored_file(state['path'])
+    details = {'filename': filename, 'path': full_content, 'cached': state['cached']}
+    if 'stages' in result:
+        # Model cascade (IMAGE_CASCADE, see detectors/detect_image.py)
+        details['stages'] = result['stages']
+        details['escalated'] = result['escalated']
+    if state['match']:
+        details['near_duplicate'] = _near_duplicate_details(state['match'])
+        details['reused'] = state['reused']
+    record = {
+        'type': 'image',
+        'content': filename,
+        'score': int(round(float(result['ai_percent']))),          # 0–100
+        'confidence': int(round(float(result['confidence']) * 100)),
+        'full_content': full_content,
+        'analysis': result['label'],   # e.g., "AI-generated" or "Human"
+        'blob_hash': blob_hash,
+        'details': details,
+    }
+    if state['hashes']:
+        # Indexed by history_store.add_history_record(s) once the row exists
+        record['image_hashes'] = {'model': model, **state['hashes']}
+    return record
+
+
+def image_record(save_path, filename, digest, progress=None, user_id=None):
+    """
+    Score an uploaded image, reusing the content-hash cache when possible.
+
+    With near-duplicate detection on (NEAR_DUP_MODE, see detectors/near_dup.py)
+    the image's perceptual hashes are looked up among the user's earlier
+    uploads too: in "reuse" mode a close enough earlier verdict is returned
+    without running the model, in "flag" mode it is only reported under
+    details['near_duplicate'].
+    """
+    from detectors.detect_image import detect_image_ai, get_model_name
+    from detectors.result_cache import get_result_cache
+
+    model = get_model_name()
+    cache = get_result_cache(model)
+    state = _image_lookup(save_path, digest, model, cache, user_id)
+    if state['result'] is None:
+        state['result'] = detect_image_ai(state['image'])
+        if cache:
+            cache.put(digest, state['result'])
+    if progress:
+        progress(1.0)
+    return _image_record_from(state, filename, model)
+
+
+def image_records(uploads, user_id=None):
+    """
+    Score a list of (save_path, filename, digest) with one batched model call
+    for every image not answered by a cache.
+
+    Returns one entry per upload, in order: a record, or the exception that
+    upload raised (e.g. an unreadable file), so one bad file does not fail
+    the others.
+    """
+    from detectors.detect_image import detect_images_ai, get_model_name
+    from detectors.result_cache import get_result_cache
+
+    model = get_model_name()
+    cache = get_result_cache(model)
+    states = []
+    for save_path, _, digest in uploads:
+        try:
+            states.append(_image_lookup(save_path, digest, model, cache, user_id))
+        except ValueError as e:
+            states.append(e)
+    pending = [s for s in states if isinstance(s, dict) and s['result'] is None]
+    if pending:
+        for state, result in zip(pending, detect_images_ai([s['image'] for s in pending])):
+            state['result'] = result
+            if cache:
+                cache.put(state['digest'], result)
+    return [s if isinstance(s, Exception) else _image_record_from(s, filename, model)
+            for s, (_, filename, _) in zip(states, uploads)]
+
+
+def text_record(text, progress=None):
+    """Score a (possibly very long) text."""
+    from detectors.detect_text import detect_text
+
+    result = detect_text(text)
+    if progress:
+        progress(1.0)
+    short_content = text[:70] + ('...' if len(text) > 70 else '')
+    return {
+        'type': 'text',
+        'content': short_content,
+        'score': result['score'],
+        'confidence': result['confidence'],
+        'full_content': text,
+        'analysis': result['analysis'],
+        'details': {'content': short_content, 'label': result['label'], 'chunks': result['chunks']},
+    }
+
+
+def video_record(save_path, filename, strategy=None, progress=None):
+    """Score an uploaded video from sampled frames."""
+    from detectors.detect_video import detect_video
+
+    result = detect_video(save_path, strategy=strategy, progress=progress)
+    full_content, blob_hash = _stored_file(save_path)
+    return {
+        'type': 'video',
+        'content': filename,
+        'score': result['score'],
+        'confidence': result['confidence'],
+        'full_content': full_content,
+        'analysis': result['analysis'],
+        'blob_hash': blob_hash,
+        'details': {
+            'filename': filename,
+            'path': full_content,
+            'label': result['label'],
+            'strategy': result['strategy'],
+            'frames': result['frames'],
+        },
+    }
+
+
+def record_response(new_id, date_str, record):
+    """JSON body returned for a stored record (sync endpoints and finished jobs)."""
+    body = {
+        'status': 'success',
+        'id': new_id,
+        'type': record['type'],
+        'score': record['score'],
+        'confidence': record['confidence'],
+        'analysis': record['analysis'],
+        'date': date_str
+    }
+    body.update(record['details'])
+    return body
@@ -0,0 +1,169 @@
+# detectors/batching.py
+"""
+Dynamic micro-batching for detector pipelines.
+
+Callers submit one item at a time from any thread (e.g. one Flask request
+per upload). A single background thread collects items that arrive close
+together and hands them to a batch function in one call, so the model does
+one batched forward pass instead of N single-image passes.
+
+A batch is flushed when either:
+    - it reaches `max_batch_size` items, or
+    - `max_wait_ms` has passed since the first item of the batch arrived.
+
+Usage:
+    from detectors.batching import MicroBatcher
+    batcher = MicroBatcher(run_batch, max_batch_size=8, max_wait_ms=10)
+    result = batcher.submit(item)          # blocks until the batch ran
+    batcher.stats()                        # queue depth / batch-size stats
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+
+class MicroBatcher:
+    """
+    Collect single submissions into batches for `batch_fn`.
+
+    `batch_fn(items: List) -> List` must return one result per item, in the
+    same order. If it raises, every caller in that batch gets the exception.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[object]], List[object]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 10.0,
+        name: str = "batcher",
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.batch_fn = batch_fn
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_seen = 0
+        self._last_batch_size = 0
+        self._last_wait = 0.0
+        self._size_hist = [0] * (self.max_batch_size + 1)
+
+    # ---------- Worker thread ----------
+
+    def _ensure_started(self):
+        # The worker thread does not survive a fork (gunicorn preload), so
+        # restart it if we are in a different process than the one that
+        # started it.
+        pid = os.getpid()
+        if self._thread is not None and self._thread_pid == pid and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread_pid == pid and self._thread.is_alive():
+                return
+            if self._thread_pid != pid:
+                self._queue = queue.Queue()
+            self._thread = threading.Thread(
+                target=self._run, name=f"{self.name}-worker", daemon=True
+            )
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _collect(self) -> List[tuple]:
+        """Block for the first item, then gather more until full or timed out."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # Still take whatever is already waiting, without blocking
+                try:
+                    batch.append(self._queue.get_nowait())
+                    continue
+                except queue.Empty:
+                    break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _, _ in batch]
+            futures = [fut for _, fut, _ in batch]
+            # How long the oldest item waited for the model
+            self._record(len(batch), time.monotonic() - min(t for _, _, t in batch))
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(
+                        f"{self.name}: batch_fn returned {len(results)} results for {len(items)} items"
+                    )
+            except BaseException as e:
+                for fut in futures:
+                    fut.set_exception(e)
+                continue
+            for fut, res in zip(futures, results):
+                if isinstance(res, BaseException):
+                    fut.set_exception(res)
+                else:
+                    fut.set_result(res)
+
+    # ---------- Stats ----------
+
+    def _record(self, size: int, wait: float):
+        with self._stats_lock:
+            self._batches += 1
+            self._items += size
+            self._last_batch_size = size
+            self._last_wait = wait
+            self._max_seen = max(self._max_seen, size)
+            self._size_hist[min(size, self.max_batch_size)] += 1
+
+    def stats(self) -> Dict[str, object]:
+        """Snapshot of queue depth and batch-size statistics."""
+        with self._stats_lock:
+            batches = self._batches
+            return {
+                "name": self.name,
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": batches,
+                "items": self._items,
+                "avg_batch_size": (self._items / batches) if batches else 0.0,
+                "max_batch_seen": self._max_seen,
+                "last_batch_size": self._last_batch_size,
+                "last_wait_ms": round(self._last_wait * 1000.0, 3),
+                # index = batch size, value = number of batches of that size
+                "batch_size_histogram": {
+                    str(i): n for i, n in enumerate(self._size_hist) if n
+                },
+            }
+
+    # ---------- Public API ----------
+
+    def submit_async(self, item) -> Future:
+        """Queue one item and return a Future for its result."""
+        self._ensure_started()
+        fut: Future = Future()
+        self._queue.put((item, fut, time.monotonic()))
+        return fut
+
+    def submit(self, item, timeout: Optional[float] = None):
+        """Queue one item and block until its batch has run."""
+        return self.submit_async(item).result(timeout=timeout)
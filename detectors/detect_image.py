@@ -18,13 +18,42 @@ Usage:
     #   "confidence": 0.87,
     #   "model": "falconsai/image-detection-fake-vs-real",
     # }
+
+Concurrent callers are grouped into micro-batches (see detectors/batching.py):
+    IMAGE_BATCH_MAX_SIZE     max images per forward pass  (default 8)
+    IMAGE_BATCH_MAX_WAIT_MS  max time to wait for a batch  (default 10)
+
+Inference backend:
+    IMAGE_BACKEND=torch   transformers/PyTorch pipeline (default)
+    IMAGE_BACKEND=onnx    ONNX Runtime, int8-quantized; see detectors/onnx_backend.py
+
+Cascade (IMAGE_CASCADE=1): a cheap first stage scores every image and only
+images whose AI probability falls inside the uncertainty band are scored
+again by the second stage (one model, or several averaged as an ensemble).
+Stages are "model@backend" specs:
+    IMAGE_CASCADE_FIRST   default falconsai/image-detection-fake-vs-real@onnx
+    IMAGE_CASCADE_SECOND  default falconsai/image-detection-fake-vs-real@torch,
+                                  uclanlp/clip-ai-generated-images@torch
+    IMAGE_CASCADE_BAND    low,high AI probability to escalate (default 0.3,0.7)
+Results then carry "stages" (model and AI percent per stage that ran) and
+"escalated"; aidetector_image_cascade_images_total{escalated} gives the
+escalation rate.
+
+With DETECTOR_POOL_SOCKET set, inference runs in the shared worker pool
+(detectors/worker_pool.py) and no model is loaded in this process.
 """
 
+import os
 import threading
-from typing import Dict, List
+from typing import Dict, List, Sequence, Union
 
 from PIL import Image
-from transformers import pipeline
+
+from detectors.batching import MicroBatcher
+from detectors import worker_pool
+from detectors.ingest import load_image
+from metrics import (DETECTIONS, IMAGE_CASCADE_IMAGES, IMAGE_DECODE_SECONDS, MODEL_FORWARD_SECONDS,
+                     NORMALIZE_SECONDS, PIPELINE_WAIT_SECONDS, QUEUE_DEPTH, timed)
 
 # ---------- Model setup (load once, thread-safe) ----------
 
@@ -35,19 +64,81 @@ _PIPE = None
 _PIPE_MODEL_NAME = None
 _PIPE_LOCK = threading.Lock()
 
+_BACKEND = os.environ.get("IMAGE_BACKEND", "torch").strip().lower()
+
+_BATCH_MAX_SIZE = int(os.environ.get("IMAGE_BATCH_MAX_SIZE", "8"))
+_BATCH_MAX_WAIT_MS = float(os.environ.get("IMAGE_BATCH_MAX_WAIT_MS", "10"))
+
+_BATCHER = None
+_BATCHER_LOCK = threading.Lock()
+
+_CASCADE = os.environ.get("IMAGE_CASCADE", "0") == "1"
+_CASCADE_FIRST = os.environ.get("IMAGE_CASCADE_FIRST", f"{_PRIMARY_MODEL}@onnx")
+_CASCADE_SECOND = os.environ.get("IMAGE_CASCADE_SECOND", f"{_PRIMARY_MODEL}@torch,{_FALLBACK_MODEL}@torch")
+_CASCADE_BAND = tuple(float(x) for x in os.environ.get("IMAGE_CASCADE_BAND", "0.3,0.7").split(","))
+
+# Loaded cascade: {"first": (pipe, tag), "second": [(pipe, tag), ...]}
+_STAGES = None
+
+
+def _build_pipeline(model_name: str, backend: str = None):
+    """(classifier, model tag) for `backend` (default: IMAGE_BACKEND)."""
+    backend = backend or _BACKEND
+    if backend == "onnx":
+        from detectors import onnx_backend
+        return onnx_backend.load_classifier(model_name), onnx_backend.model_tag(model_name)
+    if backend != "torch":
+        raise RuntimeError(f"Unknown image backend '{backend}' (expected 'torch' or 'onnx')")
+    # Deferred so importing this module does not pull in transformers/torch
+    from transformers import pipeline
+    pipe = pipeline(
+        task="image-classification",
+        model=model_name,
+        device=-1,  # CPU
+    )
+    return pipe, model_name
+
+
+def _parse_stage(spec: str):
+    """"model@backend" -> (model, backend); the backend defaults to IMAGE_BACKEND."""
+    model_name, _, backend = spec.strip().partition("@")
+    return model_name, backend or _BACKEND
+
+
+def _stage_backends() -> List[str]:
+    if not _CASCADE:
+        return [_BACKEND]
+    return [_parse_stage(s)[1] for s in [_CASCADE_FIRST] + _CASCADE_SECOND.split(",") if s.strip()]
+
+
+def _load_cascade():
+    """Load every cascade stage; the cascade's id (used as the model name) covers its whole config."""
+    global _PIPE, _PIPE_MODEL_NAME, _STAGES
+    low, high = _CASCADE_BAND
+    if not 0.0 <= low <= high <= 1.0:
+        raise RuntimeError(f"IMAGE_CASCADE_BAND must be 0 <= low <= high <= 1, got {low},{high}")
+    try:
+        first = _build_pipeline(*_parse_stage(_CASCADE_FIRST))
+        second = [_build_pipeline(*_parse_stage(s)) for s in _CASCADE_SECOND.split(",") if s.strip()]
+    except Exception as e:
+        raise RuntimeError(f"Failed to load the image cascade: {e}")
+    if not second:
+        raise RuntimeError("IMAGE_CASCADE_SECOND names no models")
+    _STAGES = {"first": first, "second": second}
+    _PIPE = first[0]
+    _PIPE_MODEL_NAME = f"cascade:{first[1]}>{'+'.join(tag for _, tag in second)}@{low:g}-{high:g}"
+
 
 def _load_pipeline():
-    """Load the image-classification pipeline on CPU."""
+    """Load the image classifier on CPU."""
     global _PIPE, _PIPE_MODEL_NAME
+    if _CASCADE:
+        _load_cascade()
+        return
     # Try preferred model first, then fallback
     for model_name in (_PRIMARY_MODEL, _FALLBACK_MODEL):
         try:
-            _PIPE = pipeline(
-                task="image-classification",
-                model=model_name,
-                device=-1,  # CPU
-            )
-            _PIPE_MODEL_NAME = model_name
+            _PIPE, _PIPE_MODEL_NAME = _build_pipeline(model_name)
             return
         except Exception as e:
             # Try next model
@@ -113,40 +204,29 @@ def _normalize_results(results: List[dict]) -> Dict[str, float]:
     return {"ai": ai_score, "human": human_score}
 
 
-# ---------- Public API ----------
-
-def detect_image_ai(image_path: str) -> Dict[str, object]:
+def _open_image(image) -> Image.Image:
     """
-    Detect if an image is AI-generated or Human-created.
+    Accept a path or a PIL image and return an RGB PIL image.
 
-    Returns a dict:
-        {
-          "ai_percent": int,
-          "human_percent": int,
-          "label": "AI-generated" | "Human",
-          "confidence": float (0..1),
-          "model": str (model id),
-        }
-    Raises:
-        RuntimeError if the model cannot be loaded.
-        ValueError for invalid image input.
+    Paths go through detectors/ingest.py: format and pixel limits are
+    checked from the header and the image is decoded at reduced size.
     """
-    pipe = _get_pipeline()
+    with timed(IMAGE_DECODE_SECONDS):
+        if isinstance(image, Image.Image):
+            return image if image.mode == "RGB" else image.convert("RGB")
+        return load_image(image)
 
-    # Open with PIL to ensure RGB
-    try:
-        img = Image.open(image_path).convert("RGB")
-    except Exception as e:
-        raise ValueError(f"Failed to open image '{image_path}': {e}")
 
-    # Run the model
-    outputs = pipe(img)
+def _build_result(outputs) -> Dict[str, object]:
+    """Turn one image's raw pipeline output into the public result dict."""
     # Some pipelines return a dict; ensure list
     if isinstance(outputs, dict):
         outputs = [outputs]
+    return _result_from_probs(_normalize_results(outputs))
 
-    # Normalize
-    probs = _normalize_results(outputs)
+
+def _result_from_probs(probs: Dict[str, float]) -> Dict[str, object]:
+    """Public result dict from normalized {"ai", "human"} probabilities."""
     ai_p = probs["ai"]
     human_p = probs["human"]
 
@@ -167,11 +247,154 @@ def detect_image_ai(image_path: str) -> Dict[str, object]:
     }
 
 
+def _forward(pipe, tag: str, images: List[Image.Image]) -> list:
+    """Raw pipeline outputs, one list of {label, score} per image."""
+    with timed(MODEL_FORWARD_SECONDS, detector="image", model=tag):
+        outputs = pipe(images, batch_size=len(images))
+    # A single-image list may come back unwrapped as one result
+    if len(images) == 1 and outputs and isinstance(outputs[0], dict):
+        outputs = [outputs]
+    return [[out] if isinstance(out, dict) else out for out in outputs]
+
+
+def _run_cascade(images: List[Image.Image]) -> List[Dict[str, object]]:
+    """First stage on every image, second stage only on those inside the uncertainty band."""
+    _get_pipeline()
+    first_pipe, first_tag = _STAGES["first"]
+    with timed(NORMALIZE_SECONDS, detector="image"):
+        probs = [_normalize_results(out) for out in _forward(first_pipe, first_tag, images)]
+    stages = [[{"model": first_tag, "ai_percent": int(round(p["ai"] * 100))}] for p in probs]
+
+    low, high = _CASCADE_BAND
+    hard = [i for i, p in enumerate(probs) if low <= p["ai"] <= high]
+    if hard:
+        subset = [images[i] for i in hard]
+        per_model = [(tag, _forward(pipe, tag, subset)) for pipe, tag in _STAGES["second"]]
+        with timed(NORMALIZE_SECONDS, detector="image"):
+            for j, i in enumerate(hard):
+                second = [(tag, _normalize_results(outputs[j])) for tag, outputs in per_model]
+                stages[i] += [{"model": tag, "ai_percent": int(round(p["ai"] * 100))} for tag, p in second]
+                # Ensemble: average the second-stage probabilities, renormalized like any model output
+                ai = sum(p["ai"] for _, p in second) / len(second)
+                probs[i] = _normalize_results([{"label": "ai", "score": ai}, {"label": "human", "score": 1.0 - ai}])
+
+    results = []
+    for p, ran in zip(probs, stages):
+        res = _result_from_probs(p)
+        res["stages"] = ran
+        res["escalated"] = len(ran) > 1
+        IMAGE_CASCADE_IMAGES.inc(escalated=str(res["escalated"]).lower())
+        results.append(res)
+    return results
+
+
+def _run_batch(images: List[Image.Image]) -> List[Dict[str, object]]:
+    """One pipeline call (or one cascade pass) for a list of already-opened RGB images."""
+    if _CASCADE:
+        results = _run_cascade(images)
+    else:
+        pipe = _get_pipeline()
+        outputs = _forward(pipe, _PIPE_MODEL_NAME, images)
+        with timed(NORMALIZE_SECONDS, detector="image"):
+            results = [_build_result(out) for out in outputs]
+    for res in results:
+        DETECTIONS.inc(detector="image", model=res["model"], label=res["label"])
+    return results
+
+
+def _get_batcher() -> MicroBatcher:
+    global _BATCHER
+    if _BATCHER is None:
+        with _BATCHER_LOCK:
+            if _BATCHER is None:
+                _BATCHER = MicroBatcher(
+                    _run_batch,
+                    max_batch_size=_BATCH_MAX_SIZE,
+                    max_wait_ms=_BATCH_MAX_WAIT_MS,
+                    name="image-detector",
+                )
+    return _BATCHER
+
+
+def _batcher_stat(key: str, scale: float = 1.0) -> float:
+    # Scrape-time gauges; 0 until the first image is submitted
+    return _BATCHER.stats()[key] * scale if _BATCHER is not None else 0.0
+
+
+QUEUE_DEPTH.set_function(lambda: _batcher_stat("queue_depth"), queue="image")
+PIPELINE_WAIT_SECONDS.set_function(lambda: _batcher_stat("last_wait_ms", 0.001), detector="image")
+
+
+# ---------- Public API ----------
+
+def detect_image_ai(image_path: Union[str, Image.Image]) -> Dict[str, object]:
+    """
+    Detect if an image is AI-generated or Human-created.
+
+    Concurrent calls are merged into micro-batches, so this is safe and
+    efficient to call from many request threads at once.
+
+    Returns a dict:
+        {
+          "ai_percent": int,
+          "human_percent": int,
+          "label": "AI-generated" | "Human",
+          "confidence": float (0..1),
+          "model": str (model id),
+        }
+    Raises:
+        RuntimeError if the model cannot be loaded.
+        ValueError for invalid image input.
+    """
+    # Decode in the caller's thread so bad files fail fast and decoding
+    # runs in parallel across requests instead of inside the batch.
+    img = _open_image(image_path)
+    pool = worker_pool.client()
+    if pool is not None:
+        return pool.detect_images([img])[0]
+    return _get_batcher().submit(img)
+
+
+def detect_images_ai(images: Sequence[Union[str, Image.Image]]) -> List[Dict[str, object]]:
+    """
+    Score many images at once, in batches of up to IMAGE_BATCH_MAX_SIZE.
+
+    For bulk callers that already hold a list of inputs; results are in
+    input order and have the same shape as detect_image_ai(). The images go
+    through the same micro-batcher as detect_image_ai(), so only its worker
+    thread ever drives the pipeline.
+    """
+    opened = [_open_image(img) for img in images]
+    pool = worker_pool.client()
+    if pool is not None:
+        return pool.detect_images(opened)
+    batcher = _get_batcher()
+    futures = [batcher.submit_async(img) for img in opened]
+    return [fut.result() for fut in futures]
+
+
+def get_model_name() -> str:
+    """Id of the loaded model, plus "+onnx-..." on the ONNX backend (loads it if needed)."""
+    pool = worker_pool.client()
+    if pool is not None:
+        return pool.model_name()
+    _get_pipeline()
+    return _PIPE_MODEL_NAME
+
+
+def get_batch_stats() -> Dict[str, object]:
+    """Queue depth and batch-size statistics of the image micro-batcher."""
+    stats = _get_batcher().stats()
+    stats["model"] = _PIPE_MODEL_NAME
+    return stats
+
+
 # ---------- Optional: quick CLI test ----------
 if __name__ == "__main__":
     import sys, json
     if len(sys.argv) < 2:
         print("Usage: python -m detectors.detect_image /path/to/image.jpg")
+        print("Many files / whole directories: python -m detectors.scan DIR --out results.jsonl")
         sys.exit(1)
     result = detect_image_ai(sys.argv[1])
     print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,133 @@
+# detectors/ingest.py
+"""
+Bounded-memory image ingest.
+
+    save_stream()  copy an upload to disk in chunks while hashing it, and
+                   stop as soon as it exceeds the byte limit
+    check_image()  read only the header: reject unknown formats and images
+                   with more pixels than allowed (decompression bombs)
+                   before anything is decoded
+    load_image()   decode close to the size the model needs: JPEGs are
+                   decoded at a reduced DCT scale via draft(), other
+                   formats are reduced right after decoding, then
+                   converted to RGB at the small size
+
+The detector's preprocessor resizes to 224 px anyway, so nothing larger
+than IMAGE_DECODE_MAX_SIDE is ever kept in memory after decoding.
+
+Settings:
+    IMAGE_MAX_UPLOAD_MB     max upload size             (default 25)
+    IMAGE_MAX_PIXELS        max width * height          (default 40000000)
+    IMAGE_DECODE_MAX_SIDE   longest side after decoding (default 448)
+    IMAGE_ALLOWED_FORMATS   PIL format names            (default JPEG,PNG,WEBP,GIF,BMP,TIFF)
+
+Errors are IngestError (a ValueError) carrying the HTTP status to return:
+413 for too large, 415 for unsupported formats, 400 for unreadable files.
+"""
+
+import hashlib
+import os
+import warnings
+from typing import Optional, Tuple
+
+from PIL import Image
+
+MAX_UPLOAD_BYTES = int(float(os.environ.get("IMAGE_MAX_UPLOAD_MB", "25")) * 1024 * 1024)
+MAX_PIXELS = int(os.environ.get("IMAGE_MAX_PIXELS", "40000000"))
+DECODE_MAX_SIDE = int(os.environ.get("IMAGE_DECODE_MAX_SIDE", "448"))
+ALLOWED_FORMATS = frozenset(
+    f.strip().upper() for f in os.environ.get("IMAGE_ALLOWED_FORMATS", "JPEG,PNG,WEBP,GIF,BMP,TIFF").split(",")
+    if f.strip()
+)
+
+
+class IngestError(ValueError):
+    """Rejected upload; `status_code` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# ---------- Upload ----------
+
+def save_stream(stream, save_path: str, max_bytes: Optional[int] = MAX_UPLOAD_BYTES,
+                chunk_size: int = 1 << 20) -> Tuple[str, int]:
+    """
+    Copy `stream` to `save_path` in chunks, hashing as it goes.
+
+    Returns (sha256 hex digest, size). Raises IngestError(413) and removes
+    the partial file once more than `max_bytes` arrive. The file is written
+    under a temporary name and renamed, so a rejected or failed upload never
+    replaces an existing file.
+    """
+    h = hashlib.sha256()
+    size = 0
+    tmp_path = f"{save_path}.{os.getpid()}.part"
+    try:
+        with open(tmp_path, "wb") as out:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise IngestError(f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit", 413)
+                h.update(chunk)
+                out.write(chunk)
+        os.replace(tmp_path, save_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return h.hexdigest(), size
+
+
+# ---------- Decoding ----------
+
+def _open(path: str) -> Image.Image:
+    try:
+        with warnings.catch_warnings():
+            # DecompressionBombWarning -> error; our own limit is checked below
+            warnings.simplefilter("error", Image.DecompressionBombWarning)
+            img = Image.open(path)
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise IngestError("Image has too many pixels", 413)
+    except Exception:
+        raise IngestError("Unreadable or corrupt image file", 400)
+    if img.format not in ALLOWED_FORMATS:
+        fmt = img.format
+        img.close()
+        raise IngestError(f"Unsupported image format '{fmt}'", 415)
+    width, height = img.size
+    if width * height > MAX_PIXELS:
+        img.close()
+        raise IngestError(f"Image is {width}x{height}; the limit is {MAX_PIXELS} pixels", 413)
+    return img
+
+
+def check_image(path: str) -> Tuple[str, Tuple[int, int]]:
+    """Validate format and dimensions from the header only; returns (format, size)."""
+    img = _open(path)
+    try:
+        return img.format, img.size
+    finally:
+        img.close()
+
+
+def load_image(path: str, max_side: int = DECODE_MAX_SIDE) -> Image.Image:
+    """
+    Decode `path` to an RGB image no larger than `max_side` on its longest side.
+
+    JPEG is decoded at 1/2, 1/4 or 1/8 scale when that still covers
+    `max_side`, so a 24-megapixel photo never exists at full size in memory.
+    """
+    img = _open(path)
+    if img.format == "JPEG":
+        # Pick the smallest DCT scale whose output is still >= max_side
+        img.draft("RGB", (max_side, max_side))
+    try:
+        img.load()
+    except Exception:
+        img.close()
+        raise IngestError("Unreadable or corrupt image file", 400)
+    if max(img.size) > max_side:
+        # reducing_gap: cheap integer reduce() first, then a proper resample
+        img.thumbnail((max_side, max_side), Image.BICUBIC, reducing_gap=2.0)
+    return img if img.mode == "RGB" else img.convert("RGB")
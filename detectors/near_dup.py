@@ -0,0 +1,194 @@
+# detectors/near_dup.py
+"""
+Near-duplicate index of uploaded images (perceptual hashes, see phash.py).
+
+Every stored image verdict gets a row in `image_hashes` next to `history`
+(removed by a trigger when the history row is deleted). A lookup finds
+the same user's earlier verdicts of the same model whose pHash is within
+NEAR_DUP_MAX_DISTANCE bits and whose dHash is within twice that, so
+resized, recompressed or lightly cropped copies are recognised. Other
+users' uploads are never matched, so neither mode leaks their verdicts.
+
+Lookup uses multi-index hashing: the 64-bit pHash is split into four
+16-bit chunks, each with its own B-tree index. Two hashes within distance
+r share at least one chunk within floor(r / 4), so only chunk values in
+that small neighbourhood are probed and the full distance is checked on
+the few candidates. Cost grows with the bucket size (~N / 65536), not N.
+
+    NEAR_DUP_MODE=flag     run the model, report the closest earlier match (default)
+    NEAR_DUP_MODE=reuse    return the earlier verdict without running the model
+    NEAR_DUP_MODE=off      do not hash uploads
+    NEAR_DUP_MAX_DISTANCE  pHash bits (default 6, max 11)
+
+Backfill hashes for images uploaded before the index existed:
+    python -m detectors.near_dup backfill --model falconsai/image-detection-fake-vs-real
+"""
+
+import os
+from itertools import combinations
+from typing import Dict, List, Optional
+
+import db
+from detectors.phash import hamming
+
+MODE = os.environ.get("NEAR_DUP_MODE", "flag").strip().lower()
+MAX_DISTANCE = min(11, int(os.environ.get("NEAR_DUP_MAX_DISTANCE", "6")))
+
+_CHUNKS = 4
+_CHUNK_BITS = 16
+_CHUNK_MASK = (1 << _CHUNK_BITS) - 1
+
+
+def _schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS image_hashes (
+        history_id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        model TEXT NOT NULL,
+        phash INTEGER NOT NULL,
+        dhash INTEGER NOT NULL,
+        c0 INTEGER NOT NULL,
+        c1 INTEGER NOT NULL,
+        c2 INTEGER NOT NULL,
+        c3 INTEGER NOT NULL
+    )''')
+    for i in range(_CHUNKS):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_image_hashes_c{i} ON image_hashes (c{i})')
+    conn.execute('''CREATE TRIGGER IF NOT EXISTS trg_history_delete_image_hash
+        AFTER DELETE ON history BEGIN
+            DELETE FROM image_hashes WHERE history_id = OLD.id;
+        END''')
+
+
+db.register_schema(_schema)
+
+
+def enabled() -> bool:
+    return MODE in ("flag", "reuse")
+
+
+# ---------- Encoding ----------
+
+def _to_sql(value: int) -> int:
+    """Unsigned 64-bit -> SQLite's signed INTEGER."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _from_sql(value: int) -> int:
+    return value & 0xFFFFFFFFFFFFFFFF
+
+
+def _chunks(value: int) -> List[int]:
+    return [(value >> (_CHUNK_BITS * i)) & _CHUNK_MASK for i in range(_CHUNKS)]
+
+
+def _neighbours(chunk: int, radius: int) -> List[int]:
+    """All 16-bit values within `radius` bits of `chunk`."""
+    values = [chunk]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(_CHUNK_BITS), r):
+            flipped = chunk
+            for b in bits:
+                flipped ^= 1 << b
+            values.append(flipped)
+    return values
+
+
+# ---------- Index ----------
+
+def add(history_id: int, user_id: int, model: str, hashes: Dict[str, int]) -> None:
+    """Index the hashes of a stored image verdict."""
+    c = _chunks(hashes["phash"])
+    db.execute(
+        '''INSERT OR REPLACE INTO image_hashes (history_id, user_id, model, phash, dhash, c0, c1, c2, c3)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        (history_id, user_id, model, _to_sql(hashes["phash"]), _to_sql(hashes["dhash"]), *c)
+    )
+
+
+def add_many(user_id: int, entries: List[tuple]) -> None:
+    """Index many (history_id, hashes) pairs; hashes as for add() (with "model")."""
+    db.executemany(
+        '''INSERT OR REPLACE INTO image_hashes (history_id, user_id, model, phash, dhash, c0, c1, c2, c3)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        [(history_id, user_id, h["model"], _to_sql(h["phash"]), _to_sql(h["dhash"]), *_chunks(h["phash"]))
+         for history_id, h in entries]
+    )
+
+
+def find(hashes: Dict[str, int], model: str, user_id: int,
+         max_distance: int = MAX_DISTANCE) -> Optional[Dict[str, object]]:
+    """
+    Closest earlier verdict of `model` for `user_id` within `max_distance`, or None.
+
+    Returns {"history_id", "user_id", "distance", "dhash_distance",
+    "score", "confidence", "analysis"} from the matching history row.
+    """
+    max_distance = min(max_distance, 11)
+    radius = max_distance // _CHUNKS
+    selects, args = [], []
+    for i, chunk in enumerate(_chunks(hashes["phash"])):
+        values = _neighbours(chunk, radius)
+        selects.append(f"SELECT history_id FROM image_hashes WHERE c{i} IN ({', '.join('?' * len(values))})")
+        args.extend(values)
+    rows = db.query_all(
+        f'''SELECT h.history_id, h.user_id, h.phash, h.dhash, hi.score, hi.confidence, hi.analysis
+            FROM image_hashes h JOIN history hi ON hi.id = h.history_id
+            WHERE h.model = ? AND h.user_id = ? AND h.history_id IN ({' UNION '.join(selects)})''',
+        [model, user_id] + args
+    )
+    best = None
+    for history_id, user_id, p, d, score, confidence, analysis in rows:
+        distance = hamming(_from_sql(p), hashes["phash"])
+        d_distance = hamming(_from_sql(d), hashes["dhash"])
+        if distance > max_distance or d_distance > 2 * max_distance:
+            continue
+        key = (distance, d_distance, -history_id)
+        if best is None or key < best[0]:
+            best = (key, {
+                "history_id": history_id,
+                "user_id": user_id,
+                "distance": distance,
+                "dhash_distance": d_distance,
+                "score": score,
+                "confidence": confidence,
+                "analysis": analysis,
+            })
+    return best[1] if best else None
+
+
+def verdict_from_match(match: Dict[str, object], model: str) -> Dict[str, object]:
+    """Rebuild a detect_image_ai()-shaped result from a matched history row."""
+    return {
+        "ai_percent": int(match["score"]),
+        "human_percent": 100 - int(match["score"]),
+        "label": match["analysis"],
+        "confidence": float(match["confidence"]) / 100.0,
+        "model": model,
+    }
+
+
+# ---------- Backfill CLI ----------
+if __name__ == "__main__":
+    import argparse
+
+    from detectors.phash import image_hashes
+
+    parser = argparse.ArgumentParser(description="Near-duplicate index maintenance.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_backfill = sub.add_parser("backfill", help="hash image history rows that are not indexed yet")
+    p_backfill.add_argument("--model", required=True, help="model id that produced the stored verdicts")
+    p_backfill.add_argument("--root", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            help="directory that history paths (static/uploads/...) are relative to")
+    args = parser.parse_args()
+
+    rows = db.query_all(
+        '''SELECT id, user_id, full_content FROM history
+           WHERE type = 'image' AND id NOT IN (SELECT history_id FROM image_hashes)'''
+    )
+    indexed = 0
+    for history_id, user_id, path in rows:
+        hashes = image_hashes(os.path.join(args.root, path or ""))
+        if hashes:
+            add(history_id, user_id, args.model, hashes)
+            indexed += 1
+    print(f"Indexed {indexed} of {len(rows)} unindexed image entries")
@@ -0,0 +1,270 @@
+# detectors/onnx_backend.py
+"""
+ONNX Runtime (optionally int8-quantized) backend for the image classifiers.
+
+Enable it with IMAGE_BACKEND=onnx (see detectors/detect_image.py). The first
+time a model is used it is exported from PyTorch to ONNX, dynamically
+quantized to int8 and cached on disk; later loads (and other worker
+processes) only open the cached file and need no torch at all.
+
+Settings:
+    IMAGE_ONNX_CACHE_DIR         where artifacts live       (default onnx_cache)
+    IMAGE_ONNX_QUANTIZE          1 = int8 weights, 0 = fp32  (default 1)
+    IMAGE_ONNX_INTRA_OP_THREADS  threads inside one operator (default 0 = ORT default)
+    IMAGE_ONNX_INTER_OP_THREADS  threads across operators    (default 0 = ORT default)
+
+Install (only needed for this backend):
+    pip install onnxruntime onnx
+
+Build artifacts ahead of time (e.g. in the image build):
+    python -m detectors.onnx_backend export falconsai/image-detection-fake-vs-real
+
+Parity with the PyTorch pipeline:
+    python -m detectors.onnx_backend parity img1.jpg img2.png ...
+    # exits 1 if any class probability differs by more than PARITY_TOLERANCE
+    # or the AI/Human decision flips
+
+Int8 dynamic quantization usually moves probabilities by < 0.01; the
+documented bound is PARITY_TOLERANCE = 0.03 (absolute, per class).
+"""
+
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+CACHE_DIR = os.environ.get("IMAGE_ONNX_CACHE_DIR", "onnx_cache")
+QUANTIZE = os.environ.get("IMAGE_ONNX_QUANTIZE", "1") == "1"
+INTRA_OP_THREADS = int(os.environ.get("IMAGE_ONNX_INTRA_OP_THREADS", "0"))
+INTER_OP_THREADS = int(os.environ.get("IMAGE_ONNX_INTER_OP_THREADS", "0"))
+
+PARITY_TOLERANCE = 0.03
+_OPSET = 17
+_TOP_K = 5   # same default as the transformers image-classification pipeline
+
+_EXPORT_LOCK = threading.Lock()
+
+
+# ---------- Artifacts ----------
+
+def model_tag(model_name: str, quantize: bool = QUANTIZE) -> str:
+    """Model id plus backend, e.g. "falconsai/...+onnx-int8" (used in results and cache keys)."""
+    return f"{model_name}+onnx-{'int8' if quantize else 'fp32'}"
+
+
+def artifact_paths(model_name: str, quantize: bool = QUANTIZE, cache_dir: str = CACHE_DIR):
+    """(model.onnx path, metadata.json path) for a model id."""
+    base = os.path.join(cache_dir, model_name.replace("/", "--"))
+    suffix = "int8" if quantize else "fp32"
+    return f"{base}.{suffix}.onnx", f"{base}.{suffix}.json"
+
+
+def export_model(model_name: str, quantize: bool = QUANTIZE, cache_dir: str = CACHE_DIR) -> str:
+    """
+    Export a Hugging Face image classifier to ONNX (int8 if `quantize`).
+
+    Files are written under temporary names and renamed into place, so
+    concurrent workers never load a half-written model. Returns the path.
+    """
+    import torch
+    from transformers import AutoImageProcessor, AutoModelForImageClassification
+
+    onnx_path, meta_path = artifact_paths(model_name, quantize, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_fp32 = f"{onnx_path}.{os.getpid()}.fp32.tmp"
+    tmp_final = f"{onnx_path}.{os.getpid()}.tmp"
+
+    processor = AutoImageProcessor.from_pretrained(model_name)
+    model = AutoModelForImageClassification.from_pretrained(model_name).eval()
+    pixel_values = processor(images=[_blank_image()], return_tensors="pt")["pixel_values"]
+
+    class _LogitsOnly(torch.nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, pixel_values):
+            return self.inner(pixel_values=pixel_values).logits
+
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                _LogitsOnly(model), (pixel_values,), tmp_fp32,
+                input_names=["pixel_values"], output_names=["logits"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+                opset_version=_OPSET,
+            )
+        if quantize:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(tmp_fp32, tmp_final, weight_type=QuantType.QInt8)
+            os.remove(tmp_fp32)
+        else:
+            os.replace(tmp_fp32, tmp_final)
+
+        meta = {
+            "model": model_name,
+            "quantized": quantize,
+            "opset": _OPSET,
+            "id2label": {str(k): v for k, v in model.config.id2label.items()},
+            "problem_type": model.config.problem_type,
+        }
+        with open(f"{meta_path}.{os.getpid()}.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp_final, onnx_path)
+        os.replace(f"{meta_path}.{os.getpid()}.tmp", meta_path)
+    finally:
+        for leftover in (tmp_fp32, tmp_final, f"{meta_path}.{os.getpid()}.tmp"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    return onnx_path
+
+
+def _blank_image():
+    from PIL import Image
+    return Image.new("RGB", (224, 224), (127, 127, 127))
+
+
+# ---------- Runtime ----------
+
+def _softmax(x: np.ndarray) -> np.ndarray:
+    x = x - x.max(axis=-1, keepdims=True)
+    e = np.exp(x)
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class OnnxImageClassifier:
+    """
+    Drop-in for a transformers image-classification pipeline:
+    `clf(images, batch_size=n)` returns, per image, a list of
+    {"label", "score"} dicts sorted by score.
+    """
+
+    def __init__(self, model_name: str, onnx_path: str, meta: dict, processor=None,
+                 intra_op_threads: int = INTRA_OP_THREADS, inter_op_threads: int = INTER_OP_THREADS):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            opts.intra_op_num_threads = intra_op_threads
+        if inter_op_threads > 0:
+            opts.inter_op_num_threads = inter_op_threads
+            opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        self.session = ort.InferenceSession(onnx_path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.model_name = model_name
+        self.processor = processor
+        self.id2label = {int(k): v for k, v in meta["id2label"].items()}
+        num_labels = len(self.id2label)
+        self.multi_label = meta.get("problem_type") == "multi_label_classification" or num_labels == 1
+        self.top_k = min(_TOP_K, num_labels)
+
+    def _preprocess(self, images) -> np.ndarray:
+        if self.processor is None:
+            from transformers import AutoImageProcessor
+            self.processor = AutoImageProcessor.from_pretrained(self.model_name)
+        return self.processor(images=images, return_tensors="np")["pixel_values"].astype(np.float32)
+
+    def logits(self, images: list) -> np.ndarray:
+        return self.session.run(None, {self.input_name: self._preprocess(images)})[0]
+
+    def probabilities(self, images: list) -> np.ndarray:
+        logits = self.logits(images)
+        return _sigmoid(logits) if self.multi_label else _softmax(logits)
+
+    def __call__(self, images, batch_size: Optional[int] = None) -> List[List[Dict[str, float]]]:
+        single = not isinstance(images, list)
+        batch = [images] if single else images
+        step = batch_size or len(batch)
+        outputs = []
+        for i in range(0, len(batch), step):
+            for probs in self.probabilities(batch[i:i + step]):
+                order = np.argsort(probs)[::-1][:self.top_k]
+                outputs.append([{"label": self.id2label[int(j)], "score": float(probs[j])} for j in order])
+        return outputs[0] if single else outputs
+
+
+def load_classifier(model_name: str, quantize: bool = QUANTIZE, cache_dir: str = CACHE_DIR) -> OnnxImageClassifier:
+    """Open the cached ONNX model for `model_name`, exporting it first if needed."""
+    onnx_path, meta_path = artifact_paths(model_name, quantize, cache_dir)
+    if not (os.path.exists(onnx_path) and os.path.exists(meta_path)):
+        with _EXPORT_LOCK:
+            if not (os.path.exists(onnx_path) and os.path.exists(meta_path)):
+                export_model(model_name, quantize, cache_dir)
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    return OnnxImageClassifier(model_name, onnx_path, meta)
+
+
+# ---------- Parity check ----------
+
+def parity_check(model_name: str, image_paths: List[str], tolerance: float = PARITY_TOLERANCE,
+                 quantize: bool = QUANTIZE) -> Dict[str, object]:
+    """
+    Score `image_paths` with the PyTorch pipeline and the ONNX backend.
+
+    Returns {"max_abs_diff", "decision_flips", "images", "tolerance", "ok"};
+    ok is False if any class probability differs by more than `tolerance`
+    or the AI/Human decision differs for any image.
+    """
+    from PIL import Image
+    from transformers import pipeline
+
+    from detectors.detect_image import _normalize_results
+
+    images = [Image.open(p).convert("RGB") for p in image_paths]
+    reference = pipeline(task="image-classification", model=model_name, device=-1, top_k=None)
+    onnx_clf = load_classifier(model_name, quantize)
+
+    max_diff = 0.0
+    flips = 0
+    for ref, got in zip(reference(images, batch_size=len(images)), onnx_clf(images, batch_size=len(images))):
+        ref_scores = {r["label"]: float(r["score"]) for r in ref}
+        got_scores = {g["label"]: float(g["score"]) for g in got}
+        for label, score in ref_scores.items():
+            max_diff = max(max_diff, abs(score - got_scores.get(label, 0.0)))
+        ref_ai = _normalize_results(ref)["ai"] >= 0.5
+        got_ai = _normalize_results(got)["ai"] >= 0.5
+        flips += ref_ai != got_ai
+
+    return {
+        "model": model_name,
+        "backend": model_tag(model_name, quantize),
+        "images": len(images),
+        "max_abs_diff": round(max_diff, 6),
+        "decision_flips": flips,
+        "tolerance": tolerance,
+        "ok": max_diff <= tolerance and flips == 0,
+    }
+
+
+# ---------- CLI ----------
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Export image models to ONNX and check parity.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_export = sub.add_parser("export", help="build the cached ONNX artifact(s)")
+    p_export.add_argument("models", nargs="+")
+    p_export.add_argument("--fp32", action="store_true", help="skip int8 quantization")
+    p_parity = sub.add_parser("parity", help="compare ONNX and PyTorch outputs on sample images")
+    p_parity.add_argument("images", nargs="+")
+    p_parity.add_argument("--model", default="falconsai/image-detection-fake-vs-real")
+    p_parity.add_argument("--tolerance", type=float, default=PARITY_TOLERANCE)
+    p_parity.add_argument("--fp32", action="store_true", help="check the unquantized export")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        for name in args.models:
+            print(export_model(name, quantize=not args.fp32))
+        sys.exit(0)
+    report = parity_check(args.model, args.images, args.tolerance, quantize=not args.fp32)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["ok"] else 1)
@@ -0,0 +1,89 @@
+# detectors/phash.py
+"""
+Perceptual image hashes (64-bit) for near-duplicate detection.
+
+    phash  DCT of a 32x32 grayscale thumbnail; bit = low-frequency
+           coefficient above the median. Robust to resizing,
+           recompression and small colour/brightness changes.
+    dhash  sign of horizontal gradients on a 9x8 thumbnail. Cheap and a
+           good second opinion against pHash collisions.
+
+Similar images have hashes with a small Hamming distance (0 = identical
+after normalization; unrelated images average ~32 of 64 bits).
+
+Usage:
+    from detectors.phash import image_hashes, hamming
+    h = image_hashes("/path/to/image.jpg")   # {"phash": int, "dhash": int} or None
+    hamming(h["phash"], other["phash"])
+"""
+
+from typing import Dict, Optional, Union
+
+import numpy as np
+from PIL import Image
+
+_DCT_SIZE = 32
+_HASH_SIDE = 8
+
+# Images this flat (grayscale std-dev) have no structure to hash; every
+# solid colour would collide with every other one.
+_MIN_STDDEV = 2.0
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def phash(gray: Image.Image) -> int:
+    """64-bit DCT hash of a grayscale ("L") image."""
+    pixels = np.asarray(gray.resize((_DCT_SIZE, _DCT_SIZE), Image.BILINEAR), dtype=np.float64)
+    coeffs = _DCT @ pixels @ _DCT.T
+    low = coeffs[:_HASH_SIDE, :_HASH_SIDE].ravel()
+    # The DC term only encodes mean brightness; leave it out of the median
+    median = np.median(low[1:])
+    return _bits_to_int(low > median)
+
+
+def dhash(gray: Image.Image) -> int:
+    """64-bit horizontal-gradient hash of a grayscale ("L") image."""
+    pixels = np.asarray(gray.resize((_HASH_SIDE + 1, _HASH_SIDE), Image.BILINEAR), dtype=np.int16)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def image_hashes(image: Union[str, Image.Image]) -> Optional[Dict[str, int]]:
+    """
+    {"phash", "dhash"} for a path or PIL image, or None if the image cannot
+    be decoded or is too flat to hash meaningfully.
+    """
+    try:
+        if isinstance(image, Image.Image):
+            img = image
+        else:
+            img = Image.open(image)
+            # JPEG: let libjpeg decode at reduced scale, we only need 32x32
+            img.draft("L", (_DCT_SIZE * 2, _DCT_SIZE * 2))
+        gray = img.convert("L")
+    except Exception:
+        return None
+    if float(np.asarray(gray.resize((_DCT_SIZE, _DCT_SIZE)), dtype=np.float64).std()) < _MIN_STDDEV:
+        return None
+    return {"phash": phash(gray), "dhash": dhash(gray)}
+
+
+def hamming(a: int, b: int) -> int:
+    """Number of differing bits between two 64-bit hashes."""
+    return ((a ^ b) & 0xFFFFFFFFFFFFFFFF).bit_count()
@@ -0,0 +1,184 @@
+# detectors/result_cache.py
+"""
+Content-addressed cache for detector results.
+
+Key:   SHA-256 of the uploaded bytes + the model id that produced the result.
+Tiers: in-memory LRU (per process)  ->  SQLite table `result_cache` (shared).
+
+Entries expire after RESULT_CACHE_MAX_AGE_DAYS and the table is trimmed to
+RESULT_CACHE_MAX_ENTRIES (least recently used first). The model id is part
+of the key, so processes running different models (torch and ONNX
+backends, the fallback model, the offline scanner) share the table without
+seeing each other's verdicts. Rows of a model that is no longer used stop
+being read and age out through the same pruning.
+
+Usage:
+    from detectors.result_cache import get_result_cache, sha256_file
+    cache = get_result_cache(model_name)
+    hit = cache.get(digest)          # dict or None
+    cache.put(digest, result_dict)
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import db
+
+_DB_PATH = os.environ.get("RESULT_CACHE_DB", db.DB_PATH)
+_MEMORY_ENTRIES = int(os.environ.get("RESULT_CACHE_MEMORY_ENTRIES", "1024"))
+_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "100000"))
+_MAX_AGE = float(os.environ.get("RESULT_CACHE_MAX_AGE_DAYS", "30")) * 86400
+_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "1") != "0"
+
+# Run the size/age sweep once every N writes rather than on every put
+_PRUNE_EVERY = 256
+
+_CACHES: Dict[str, "ResultCache"] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def _result_cache_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS result_cache (
+        digest TEXT NOT NULL,
+        model TEXT NOT NULL,
+        result TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL,
+        PRIMARY KEY (digest, model)
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_result_cache_accessed ON result_cache (accessed_at)')
+
+
+db.register_schema(_result_cache_schema, _DB_PATH)
+
+
+def sha256_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hex SHA-256 of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Two-tier (LRU + SQLite) result cache bound to one model id."""
+
+    def __init__(
+        self,
+        model_name: str,
+        db_path: str = _DB_PATH,
+        memory_entries: int = _MEMORY_ENTRIES,
+        max_entries: int = _MAX_ENTRIES,
+        max_age: float = _MAX_AGE,
+    ):
+        self.model_name = model_name
+        self.db_path = db_path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.max_age = max_age
+
+        self._lru: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lru_lock = threading.Lock()
+        self._writes = 0
+
+        if db_path != _DB_PATH:
+            db.register_schema(_result_cache_schema, db_path)
+
+    # ---------- SQLite tier ----------
+
+    def _prune(self):
+        now = time.time()
+        with db.transaction(self.db_path) as conn:
+            conn.execute('DELETE FROM result_cache WHERE created_at < ?', (now - self.max_age,))
+            conn.execute(
+                '''DELETE FROM result_cache WHERE rowid IN (
+                       SELECT rowid FROM result_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                   )''',
+                (self.max_entries,),
+            )
+
+    # ---------- Memory tier ----------
+
+    def _lru_get(self, digest: str) -> Optional[dict]:
+        with self._lru_lock:
+            entry = self._lru.get(digest)
+            if entry is None:
+                return None
+            created_at, result = entry
+            if time.time() - created_at > self.max_age:
+                del self._lru[digest]
+                return None
+            self._lru.move_to_end(digest)
+            return dict(result)
+
+    def _lru_put(self, digest: str, created_at: float, result: dict):
+        if self.memory_entries <= 0:
+            return
+        with self._lru_lock:
+            self._lru[digest] = (created_at, dict(result))
+            self._lru.move_to_end(digest)
+            while len(self._lru) > self.memory_entries:
+                self._lru.popitem(last=False)
+
+    # ---------- Public API ----------
+
+    def get(self, digest: str) -> Optional[dict]:
+        """Cached result for `digest` under this model, or None."""
+        hit = self._lru_get(digest)
+        if hit is not None:
+            return hit
+
+        row = db.query_one(
+            'SELECT result, created_at FROM result_cache WHERE digest = ? AND model = ?',
+            (digest, self.model_name), self.db_path,
+        )
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > self.max_age:
+            db.execute('DELETE FROM result_cache WHERE digest = ? AND model = ?',
+                       (digest, self.model_name), self.db_path)
+            return None
+        db.execute(
+            'UPDATE result_cache SET accessed_at = ? WHERE digest = ? AND model = ?',
+            (now, digest, self.model_name), self.db_path,
+        )
+        result = json.loads(row[0])
+        self._lru_put(digest, row[1], result)
+        return dict(result)
+
+    def put(self, digest: str, result: dict):
+        """Store `result` for `digest` in both tiers."""
+        now = time.time()
+        self._lru_put(digest, now, result)
+        db.execute(
+            '''INSERT OR REPLACE INTO result_cache (digest, model, result, created_at, accessed_at)
+               VALUES (?, ?, ?, ?, ?)''',
+            (digest, self.model_name, json.dumps(result), now, now), self.db_path,
+        )
+        self._writes += 1
+        if self._writes % _PRUNE_EVERY == 0:
+            self._prune()
+
+
+def get_result_cache(model_name: str) -> Optional[ResultCache]:
+    """
+    Process-wide cache for `model_name`, or None if caching is disabled
+    (RESULT_CACHE_ENABLED=0).
+    """
+    if not _ENABLED:
+        return None
+    cache = _CACHES.get(model_name)
+    if cache is None:
+        with _CACHES_LOCK:
+            cache = _CACHES.get(model_name)
+            if cache is None:
+                cache = ResultCache(model_name)
+                _CACHES[model_name] = cache
+    return cache
@@ -0,0 +1,419 @@
+# detectors/scan.py
+"""
+Offline scanner: score every image (and optionally text and video file)
+under one or more directories, or in a list of paths, outside the web tier.
+
+    python -m detectors.scan /archive/photos --out results.jsonl
+    python -m detectors.scan /archive --types image,video --out results.sqlite
+    find /archive -name '*.jpg' | python -m detectors.scan --files-from - --out results.jsonl
+
+Images are hashed, looked up and decoded by --workers threads and scored
+in batches of --batch-size with one model call per batch. Model calls run
+one at a time in this process (the model already uses every core), or in
+parallel when DETECTOR_POOL_SOCKET points at the shared worker pool
+(detectors/worker_pool.py). Images go through the same content-hash result
+cache as web uploads (detectors/result_cache.py), so work done by either
+side is never repeated; run from the app directory, or set DATABASE_PATH /
+RESULT_CACHE_DB to the web app's database.
+
+Progress is checkpointed in SQLite (the output file itself for SQLite
+output, else "<out>.checkpoint"): one row per finished path with its size
+and mtime. Rerunning the same command skips every path that is unchanged
+since it was scored, so an interrupted scan over millions of files resumes
+where it stopped. Results are written exactly once: SQLite output is
+committed in the same transaction as the checkpoint, and JSONL output is
+truncated back to the last checkpointed offset on resume.
+
+Output rows (JSONL lines, or rows of the `scan_results` table):
+    {"path", "type", "size", "sha256", "status": "success", "score",
+     "confidence", "analysis", "label", "model", "cached"}
+    {"path", "type", "size", "status": "error", "error"}
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import db
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff")
+TEXT_EXTENSIONS = (".txt", ".md")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm", ".m4v")
+TYPES = {"image": IMAGE_EXTENSIONS, "text": TEXT_EXTENSIONS, "video": VIDEO_EXTENSIONS}
+
+# Paths looked up in the checkpoint per query
+_LOOKUP_CHUNK = 500
+
+_RESULT_COLUMNS = ("path", "type", "size", "sha256", "status", "score", "confidence",
+                   "analysis", "label", "model", "cached", "error", "scanned_at")
+
+# In-process model calls are serialized; decoding and hashing still overlap
+_INFER_LOCK = threading.Lock()
+
+
+# ---------- Inputs ----------
+
+def file_type(path: str, types: Iterable[str]) -> Optional[str]:
+    name = path.lower()
+    for kind in types:
+        if name.endswith(TYPES[kind]):
+            return kind
+    return None
+
+
+def walk(root: str) -> Iterator[str]:
+    """Files under `root` in a stable (sorted) order, skipping hidden entries."""
+    try:
+        entries = sorted(os.scandir(root), key=lambda e: e.name)
+    except OSError as e:
+        logging.warning(f"Cannot list {root}: {e}")
+        return
+    for entry in entries:
+        if entry.name.startswith("."):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk(entry.path)
+        elif entry.is_file():
+            yield entry.path
+
+
+def read_file_list(source: str) -> Iterator[str]:
+    """Paths from a file (one per line), or from stdin for "-"."""
+    stream = sys.stdin if source == "-" else open(source, encoding="utf-8")
+    try:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield line
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def candidates(roots: List[str], files_from: Optional[str], types: List[str]) -> Iterator[Tuple[str, str]]:
+    """(absolute path, type) for every input file of a selected type."""
+    sources = [read_file_list(files_from)] if files_from else []
+    sources += [walk(root) if os.path.isdir(root) else iter([root]) for root in roots]
+    for source in sources:
+        for path in source:
+            kind = file_type(path, types)
+            if kind:
+                yield os.path.abspath(path), kind
+
+
+def _stat(path: str) -> Tuple[int, int]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return -1, -1
+    return st.st_size, st.st_mtime_ns
+
+
+# ---------- Checkpoint ----------
+
+def _checkpoint_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS scan_checkpoint (
+        path TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        status TEXT NOT NULL,
+        finished_at REAL NOT NULL
+    )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS scan_state (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )''')
+
+
+def _results_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS scan_results (
+        path TEXT PRIMARY KEY,
+        type TEXT NOT NULL,
+        size INTEGER,
+        sha256 TEXT,
+        status TEXT NOT NULL,
+        score INTEGER,
+        confidence INTEGER,
+        analysis TEXT,
+        label TEXT,
+        model TEXT,
+        cached INTEGER,
+        error TEXT,
+        scanned_at REAL NOT NULL
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_scan_results_score ON scan_results (type, score)')
+
+
+def pending(items: Iterable[Tuple[str, str]], checkpoint: str, retry_errors: bool = False
+            ) -> Iterator[Tuple[str, str, int, int]]:
+    """(path, type, size, mtime_ns) for items not yet finished at their current size and mtime."""
+    batch: List[Tuple[str, str, int, int]] = []
+
+    def flush():
+        args = [b[0] for b in batch]
+        done = {
+            path: (size, mtime_ns, status)
+            for path, size, mtime_ns, status in db.query_all(
+                f"SELECT path, size, mtime_ns, status FROM scan_checkpoint WHERE path IN ({', '.join('?' * len(args))})",
+                args, checkpoint,
+            )
+        }
+        for item in batch:
+            prev = done.get(item[0])
+            if prev and prev[:2] == item[2:] and not (retry_errors and prev[2] == "error"):
+                continue
+            yield item
+        batch.clear()
+
+    for path, kind in items:
+        batch.append((path, kind, *_stat(path)))
+        if len(batch) >= _LOOKUP_CHUNK:
+            yield from flush()
+    if batch:
+        yield from flush()
+
+
+# ---------- Scoring ----------
+
+def _error_row(path: str, kind: str, size: int, message: str) -> Dict[str, object]:
+    return {"path": path, "type": kind, "size": size, "status": "error", "error": message}
+
+
+def _success_row(path: str, kind: str, size: int, digest: str, result: Dict[str, object],
+                 cached: bool = False) -> Dict[str, object]:
+    if kind == "image":
+        score, confidence = int(round(float(result["ai_percent"]))), int(round(float(result["confidence"]) * 100))
+        analysis = result["label"]
+    else:
+        score, confidence, analysis = result["score"], result["confidence"], result["analysis"]
+    return {"path": path, "type": kind, "size": size, "sha256": digest, "status": "success",
+            "score": score, "confidence": confidence, "analysis": analysis, "label": result["label"],
+            "model": result.get("model"), "cached": cached}
+
+
+def _infer(fn, *args):
+    from detectors import worker_pool
+    if worker_pool.client() is not None:
+        return fn(*args)
+    with _INFER_LOCK:
+        return fn(*args)
+
+
+def _score_images(items: List[Tuple[str, str, int, int]]) -> List[Dict[str, object]]:
+    from detectors.detect_image import _open_image, detect_images_ai, get_model_name
+    from detectors.result_cache import get_result_cache, sha256_file
+
+    cache = get_result_cache(get_model_name())
+    rows: List[Optional[Dict[str, object]]] = []
+    misses = []     # (row index, path, size, digest, decoded image)
+    for path, kind, size, _ in items:
+        try:
+            digest = sha256_file(path)
+            hit = cache.get(digest) if cache else None
+            if hit is not None:
+                rows.append(_success_row(path, kind, size, digest, hit, cached=True))
+                continue
+            misses.append((len(rows), path, size, digest, _open_image(path)))
+            rows.append(None)
+        except (ValueError, OSError) as e:
+            rows.append(_error_row(path, kind, size, str(e)))
+    if misses:
+        results = _infer(detect_images_ai, [m[4] for m in misses])
+        for (index, path, size, digest, _), result in zip(misses, results):
+            if cache:
+                cache.put(digest, result)
+            rows[index] = _success_row(path, "image", size, digest, result)
+    return rows
+
+
+def _score_one(path: str, kind: str, size: int) -> Dict[str, object]:
+    from detectors.result_cache import sha256_file
+
+    try:
+        digest = sha256_file(path)
+        if kind == "text":
+            from detectors.detect_text import detect_text
+            with open(path, encoding="utf-8", errors="replace") as f:
+                content = f.read()
+            result = _infer(detect_text, content)
+        else:
+            from detectors.detect_video import detect_video
+            result = detect_video(path)
+    except (ValueError, OSError) as e:
+        return _error_row(path, kind, size, str(e))
+    return _success_row(path, kind, size, digest, result)
+
+
+def score_chunk(items: List[Tuple[str, str, int, int]]) -> List[Tuple[Tuple[str, str, int, int], Dict[str, object]]]:
+    """Score a chunk of pending items; returns (item, row) pairs."""
+    images = [i for i in items if i[1] == "image" and i[2] >= 0]
+    rows = dict(zip((i[0] for i in images), _score_images(images))) if images else {}
+    out = []
+    for item in items:
+        path, kind, size, _ = item
+        if size < 0:
+            row = _error_row(path, kind, size, "File not found")
+        elif kind == "image":
+            row = rows[path]
+        else:
+            row = _score_one(path, kind, size)
+        row["scanned_at"] = time.time()
+        out.append((item, row))
+    return out
+
+
+# ---------- Output ----------
+
+class Writer:
+    """Writes result rows and their checkpoint entries together."""
+
+    def __init__(self, out: str, checkpoint: str):
+        self.out = out
+        self.checkpoint = checkpoint
+        self.sqlite = out == checkpoint
+        self.jsonl = None
+        if not self.sqlite:
+            self._open_jsonl()
+
+    def _open_jsonl(self):
+        row = db.query_one("SELECT value FROM scan_state WHERE key = ?", (f"offset:{self.out}",), self.checkpoint)
+        self.jsonl = open(self.out, "ab")
+        if row is not None and int(row[0]) < self.jsonl.tell():
+            # Lines written after the last checkpoint: those files are scanned again
+            self.jsonl.truncate(int(row[0]))
+            self.jsonl.seek(int(row[0]))
+
+    def write(self, pairs: List[Tuple[Tuple[str, str, int, int], Dict[str, object]]]):
+        if self.jsonl is not None:
+            self.jsonl.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for _, row in pairs).encode("utf-8"))
+            self.jsonl.flush()
+            os.fsync(self.jsonl.fileno())
+        with db.transaction(self.checkpoint) as conn:
+            if self.sqlite:
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO scan_results ({', '.join(_RESULT_COLUMNS)}) "
+                    f"VALUES ({', '.join('?' * len(_RESULT_COLUMNS))})",
+                    [tuple(row.get(c) for c in _RESULT_COLUMNS) for _, row in pairs],
+                )
+            else:
+                conn.execute("INSERT OR REPLACE INTO scan_state (key, value) VALUES (?, ?)",
+                             (f"offset:{self.out}", str(self.jsonl.tell())))
+            conn.executemany(
+                "INSERT OR REPLACE INTO scan_checkpoint (path, size, mtime_ns, status, finished_at) VALUES (?, ?, ?, ?, ?)",
+                [(path, size, mtime_ns, row["status"], row["scanned_at"]) for (path, _, size, mtime_ns), row in pairs],
+            )
+
+    def close(self):
+        if self.jsonl is not None:
+            self.jsonl.close()
+
+
+# ---------- Runner ----------
+
+def _chunks(items: Iterator, size: int) -> Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def scan(roots: List[str], out: str, files_from: Optional[str] = None, types: Iterable[str] = ("image",),
+         checkpoint: Optional[str] = None, workers: int = 4, batch_size: int = 32,
+         retry_errors: bool = False) -> Dict[str, object]:
+    """Run a scan; returns counts. Safe to rerun: finished files are skipped."""
+    types = list(types)
+    sqlite_out = out.endswith((".sqlite", ".sqlite3", ".db"))
+    checkpoint = out if sqlite_out else (checkpoint or f"{out}.checkpoint")
+    db.register_schema(_checkpoint_schema, checkpoint)
+    if sqlite_out:
+        db.register_schema(_results_schema, checkpoint)
+
+    writer = Writer(out, checkpoint)
+    stats = {"scored": 0, "cached": 0, "errors": 0}
+    started = time.monotonic()
+    last_log = started
+
+    def collect(futures):
+        nonlocal last_log
+        for fut in futures:
+            pairs = fut.result()
+            writer.write(pairs)
+            for _, row in pairs:
+                if row["status"] != "success":
+                    stats["errors"] += 1
+                elif row["cached"]:
+                    stats["cached"] += 1
+                else:
+                    stats["scored"] += 1
+        if time.monotonic() - last_log > 10:
+            last_log = time.monotonic()
+            done = sum(stats.values())
+            logging.info(f"{done} files ({done / (last_log - started):.1f}/s): {stats}")
+
+    in_flight = set()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            try:
+                items = pending(candidates(roots, files_from, types), checkpoint, retry_errors)
+                for chunk in _chunks(items, max(1, batch_size)):
+                    in_flight.add(pool.submit(score_chunk, chunk))
+                    if len(in_flight) >= 2 * max(1, workers):
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        collect(finished)
+                collect(in_flight)
+                in_flight = set()
+            except KeyboardInterrupt:
+                # Keep the chunks already in progress, drop the rest
+                for fut in in_flight:
+                    fut.cancel()
+                collect(f for f in in_flight if not f.cancelled())
+                raise
+    finally:
+        writer.close()
+    stats["seconds"] = round(time.monotonic() - started, 1)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score files in bulk with resumable checkpoints.")
+    parser.add_argument("roots", nargs="*", help="directories (walked recursively) or files")
+    parser.add_argument("--files-from", help="file with one path per line ('-' for stdin)")
+    parser.add_argument("--out", required=True, help="results: *.jsonl, or *.sqlite / *.db for a SQLite table")
+    parser.add_argument("--types", default="image", help="comma-separated: image,text,video (default: image)")
+    parser.add_argument("--checkpoint", help="checkpoint database for JSONL output (default: <out>.checkpoint)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SCAN_WORKERS", "4")),
+                        help="chunks prepared / scored concurrently")
+    parser.add_argument("--batch-size", type=int, default=int(os.environ.get("SCAN_BATCH_SIZE", "32")),
+                        help="files per chunk (one model call per chunk of images)")
+    parser.add_argument("--retry-errors", action="store_true", help="scan files that failed last time again")
+    args = parser.parse_args(argv)
+
+    types = [t.strip() for t in args.types.split(",") if t.strip()]
+    unknown = [t for t in types if t not in TYPES]
+    if unknown or not types:
+        parser.error(f"unknown --types {','.join(unknown)} (expected image, text, video)")
+    if not args.roots and not args.files_from:
+        parser.error("give at least one directory or --files-from")
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        stats = scan(args.roots, args.out, files_from=args.files_from, types=types, checkpoint=args.checkpoint,
+                     workers=args.workers, batch_size=args.batch_size, retry_errors=args.retry_errors)
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command to resume.", file=sys.stderr)
+        sys.exit(130)
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# detectors/video_frames.py
+"""
+Streaming frame sampling for video detection.
+
+Kept free of any ML imports so decode workers (separate processes) start
+quickly and stay small. Frames are downscaled to `frame_size` on the
+longest side as soon as they are decoded, so memory per sampled frame is
+fixed no matter the source resolution.
+
+Strategies:
+    uniform   one frame every `every_seconds`, spread out further if the
+              video would yield more than the frame budget
+    keyframe  only keyframes (I-frames); needs PyAV (`pip install av`),
+              falls back to uniform sampling without it
+    scene     frames where the picture changed noticeably from the last
+              probe (mean abs difference of a small grayscale thumbnail)
+
+Every sampler takes an optional `deadline` (time.time() value, so it means
+the same in the decode processes) and stops at the next frame once it has
+passed, keeping the frames sampled so far.
+"""
+
+import logging
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+STRATEGIES = ("uniform", "keyframe", "scene")
+
+# Seeking costs roughly one GOP decode; for short gaps reading forward is cheaper
+_SEEK_MIN_GAP_SECONDS = 2.0
+# Scene strategy: how often to look at the picture, and thumbnail size for diffs
+_SCENE_PROBE_SECONDS = 0.5
+_SCENE_THUMB = 32
+# Stand-in end index when the container does not report a frame count
+_UNKNOWN_END = 1 << 40
+
+try:  # optional, only needed for the keyframe strategy
+    import av  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    av = None
+
+
+def probe(path: str) -> Dict[str, float]:
+    """Basic stream info: fps, frame_count, duration (seconds)."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f"Failed to open video '{path}'")
+    try:
+        fps = float(cap.get(cv2.CAP_PROP_FPS) or 0.0)
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    finally:
+        cap.release()
+    if fps <= 0:
+        fps = 25.0  # container did not say; a common default keeps sampling sane
+    return {"fps": fps, "frame_count": frames, "duration": frames / fps if frames else 0.0}
+
+
+def _to_pil(frame_bgr: np.ndarray, frame_size: int) -> Image.Image:
+    """BGR ndarray -> RGB PIL image, longest side <= frame_size."""
+    h, w = frame_bgr.shape[:2]
+    scale = frame_size / float(max(h, w))
+    if scale < 1.0:
+        frame_bgr = cv2.resize(
+            frame_bgr, (max(1, int(w * scale)), max(1, int(h * scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+    return Image.fromarray(cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB))
+
+
+def _read_at(cap: cv2.VideoCapture, pos: int, target: int, fps: float) -> Tuple[int, Optional[np.ndarray]]:
+    """Advance from frame `pos` to frame `target` and decode it."""
+    if target - pos > _SEEK_MIN_GAP_SECONDS * fps or target < pos:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+    else:
+        while pos < target:
+            if not cap.grab():
+                return pos, None
+            pos += 1
+    ok, frame = cap.read()
+    return target + 1, (frame if ok else None)
+
+
+# ---------- Samplers (generators) ----------
+
+def _expired(deadline: Optional[float]) -> bool:
+    return deadline is not None and time.time() >= deadline
+
+
+def _iter_uniform(path, start, end, fps, every_seconds, budget, frame_size, deadline):
+    step = max(1, int(round(every_seconds * fps)))
+    if budget > 0 and end != _UNKNOWN_END and (end - start) / step > budget:
+        step = max(1, (end - start) // budget)
+    cap = cv2.VideoCapture(path)
+    try:
+        pos = start
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        count = 0
+        for target in range(start, end, step):
+            if _expired(deadline):
+                break
+            pos, frame = _read_at(cap, pos, target, fps)
+            if frame is None:
+                break
+            yield target / fps, _to_pil(frame, frame_size)
+            count += 1
+            if budget and count >= budget:
+                break
+    finally:
+        cap.release()
+
+
+def _iter_scene(path, start, end, fps, threshold, budget, frame_size, deadline):
+    step = max(1, int(round(_SCENE_PROBE_SECONDS * fps)))
+    cap = cv2.VideoCapture(path)
+    try:
+        pos = start
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        prev = None
+        count = 0
+        for target in range(start, end, step):
+            if _expired(deadline):
+                break
+            pos, frame = _read_at(cap, pos, target, fps)
+            if frame is None:
+                break
+            thumb = cv2.resize(
+                cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (_SCENE_THUMB, _SCENE_THUMB),
+                interpolation=cv2.INTER_AREA,
+            ).astype(np.float32)
+            changed = prev is None or float(np.mean(np.abs(thumb - prev))) / 255.0 >= threshold
+            prev = thumb
+            if changed:
+                yield target / fps, _to_pil(frame, frame_size)
+                count += 1
+                if budget and count >= budget:
+                    break
+    finally:
+        cap.release()
+
+
+def _iter_keyframes(path, start, end, fps, budget, frame_size, deadline):
+    container = av.open(path)
+    try:
+        stream = container.streams.video[0]
+        stream.codec_context.skip_frame = "NONKEY"
+        start_t, end_t = start / fps, end / fps
+        if start_t > 0 and stream.time_base:
+            container.seek(int(start_t / stream.time_base), stream=stream, backward=True)
+        # Keep at most `budget` keyframes, evenly spaced in time
+        min_gap = (end_t - start_t) / budget if budget and end != _UNKNOWN_END else 0.0
+        last_t = None
+        count = 0
+        for frame in container.decode(stream):
+            if _expired(deadline):
+                break
+            t = float(frame.time or 0.0)
+            if t < start_t:
+                continue
+            if t >= end_t:
+                break
+            if last_t is not None and t - last_t < min_gap:
+                continue
+            last_t = t
+            img = frame.to_image()
+            img.thumbnail((frame_size, frame_size))
+            yield t, img
+            count += 1
+            if budget and count >= budget:
+                break
+    finally:
+        container.close()
+
+
+def iter_frames(
+    path: str,
+    strategy: str = "uniform",
+    start: int = 0,
+    end: Optional[int] = None,
+    budget: int = 64,
+    every_seconds: float = 1.0,
+    scene_threshold: float = 0.12,
+    frame_size: int = 224,
+    fps: Optional[float] = None,
+    deadline: Optional[float] = None,
+) -> Iterator[Tuple[float, Image.Image]]:
+    """
+    Yield (timestamp_seconds, RGB PIL image) for sampled frames in
+    [start, end) frame indices, at most `budget` frames and none once
+    time.time() passes `deadline`. Only one decoded frame is held at a time.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown sampling strategy '{strategy}', expected one of {STRATEGIES}")
+    if fps is None or end is None:
+        info = probe(path)
+        fps = fps or info["fps"]
+        if end is None:
+            # Unknown length: read until the stream ends
+            end = info["frame_count"] or _UNKNOWN_END
+
+    if strategy == "keyframe":
+        if av is not None:
+            return _iter_keyframes(path, start, end, fps, budget, frame_size, deadline)
+        logging.warning("PyAV not installed; keyframe sampling falls back to uniform")
+        strategy = "uniform"
+    if strategy == "scene":
+        return _iter_scene(path, start, end, fps, scene_threshold, budget, frame_size, deadline)
+    return _iter_uniform(path, start, end, fps, every_seconds, budget, frame_size, deadline)
+
+
+def sample_segment(path: str, strategy: str, start: int, end: int, budget: int,
+                   every_seconds: float, scene_threshold: float, frame_size: int,
+                   fps: float, deadline: Optional[float] = None
+                   ) -> Tuple[List[Tuple[float, Image.Image]], bool]:
+    """
+    Process-pool entry point: sample one segment of the video.
+
+    Returns (frames, complete); complete is False when the deadline cut the
+    segment short.
+    """
+    frames = list(iter_frames(
+        path, strategy, start=start, end=end, budget=budget, every_seconds=every_seconds,
+        scene_threshold=scene_threshold, frame_size=frame_size, fps=fps, deadline=deadline,
+    ))
+    return frames, not _expired(deadline)
@@ -0,0 +1,317 @@
+# detectors/worker_pool.py
+"""
+Pre-forked detector worker pool shared by all web workers on a host.
+
+Without it every gunicorn worker loads its own copy of each model. The
+pool loads the models once in a master process, freezes the GC (so
+reference counting does not dirty the shared pages) and forks N inference
+workers that share the weights copy-on-write. Each worker is pinned to its
+own slice of CPU cores and sizes its intra-op threads to match, so
+throughput scales with cores while memory stays ~one model copy.
+
+Start it next to the web server:
+    python -m detectors.worker_pool --workers 4 --socket /tmp/aidetector-pool.sock
+
+and point the web tier (and job workers) at it:
+    DETECTOR_POOL_SOCKET=/tmp/aidetector-pool.sock
+
+With DETECTOR_POOL_SOCKET set, detect_image_ai(), detect_images_ai(),
+detect_text() and get_model_name() send their work to the pool over the
+Unix socket instead of loading models in-process. Connections are
+authenticated with DETECTOR_POOL_AUTHKEY, or with a random key the pool
+writes to "<socket>.key" (mode 0600) when that is unset. The handshake runs
+in each connection's own thread, so a client that connects and stalls
+never holds up a worker's accept loop.
+
+Notes:
+    - Models are loaded but not run before forking: OpenMP thread pools
+      do not survive fork(), so each worker warms up after it starts.
+    - With IMAGE_BACKEND=onnx (or an ONNX cascade stage) each worker opens
+      its own (small, int8) sessions after forking, because ONNX Runtime
+      sessions are not fork-safe.
+    - A worker that dies is re-forked from the master, which still holds
+      the loaded models.
+"""
+
+import argparse
+import gc
+import logging
+import os
+import secrets
+import signal
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+SOCKET_PATH = os.environ.get("DETECTOR_POOL_SOCKET", "")
+_AUTHKEY_ENV = os.environ.get("DETECTOR_POOL_AUTHKEY", "")
+
+_IN_WORKER = False
+_local = threading.local()
+_model_name_cache: Dict[str, str] = {}
+
+
+# ---------- Wire format ----------
+
+def _pack_image(image):
+    """Paths travel as-is; PIL images as raw RGB bytes."""
+    if isinstance(image, Image.Image):
+        rgb = image if image.mode == "RGB" else image.convert("RGB")
+        return ("raw", rgb.size, rgb.tobytes())
+    return ("path", os.path.abspath(image))
+
+
+def _unpack_image(packed):
+    if packed[0] == "raw":
+        return Image.frombytes("RGB", packed[1], packed[2])
+    return packed[1]
+
+
+def _authkey(socket_path: str, create: bool = False) -> bytes:
+    if _AUTHKEY_ENV:
+        return _AUTHKEY_ENV.encode()
+    key_path = f"{socket_path}.key"
+    if create:
+        key = secrets.token_hex(32).encode()
+        fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(key)
+        return key
+    with open(key_path, "rb") as f:
+        return f.read().strip()
+
+
+# ---------- Client (web tier) ----------
+
+class PoolClient:
+    """One connection per thread and process; reconnects once on failure."""
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+
+    def _conn(self):
+        conn = getattr(_local, "conn", None)
+        if conn is None or getattr(_local, "pid", None) != os.getpid():
+            conn = Client(self.socket_path, family="AF_UNIX", authkey=_authkey(self.socket_path))
+            _local.conn = conn
+            _local.pid = os.getpid()
+        return conn
+
+    def _drop(self):
+        conn = getattr(_local, "conn", None)
+        _local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def call(self, kind: str, *args):
+        for attempt in (0, 1):
+            try:
+                conn = self._conn()
+                conn.send((kind, args))
+                status, payload = conn.recv()
+                break
+            except (EOFError, OSError) as e:
+                self._drop()
+                if attempt:
+                    raise RuntimeError(f"Detector pool at {self.socket_path} is unavailable: {e}")
+        if status == "ok":
+            return payload
+        error_type, message = payload
+        raise (ValueError if error_type == "ValueError" else RuntimeError)(message)
+
+    def detect_images(self, images: list) -> List[Dict[str, object]]:
+        return self.call("images", [_pack_image(img) for img in images])
+
+    def detect_text(self, content: str) -> Dict[str, object]:
+        return self.call("text", content)
+
+    def model_name(self) -> str:
+        if self.socket_path not in _model_name_cache:
+            _model_name_cache[self.socket_path] = self.call("model_name")
+        return _model_name_cache[self.socket_path]
+
+
+def client() -> Optional[PoolClient]:
+    """The pool client if DETECTOR_POOL_SOCKET is set (and we are not a pool worker)."""
+    if not SOCKET_PATH or _IN_WORKER:
+        return None
+    return PoolClient(SOCKET_PATH)
+
+
+# ---------- Server (pool workers) ----------
+
+def _dispatch(kind: str, args: tuple):
+    from detectors.detect_image import detect_image_ai, detect_images_ai, get_model_name
+
+    if kind == "images":
+        images = [_unpack_image(p) for p in args[0]]
+        if len(images) == 1:
+            # Single requests from many connections meet in the micro-batcher
+            return [detect_image_ai(images[0])]
+        return detect_images_ai(images)
+    if kind == "text":
+        from detectors.detect_text import detect_text
+        return detect_text(args[0])
+    if kind == "model_name":
+        return get_model_name()
+    if kind == "ping":
+        return {"pid": os.getpid(), "cores": sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None}
+    raise ValueError(f"Unknown request '{kind}'")
+
+
+def _handle(conn, authkey: bytes):
+    with conn:
+        # Same mutual challenge as Listener(authkey=...), but in this thread
+        try:
+            deliver_challenge(conn, authkey)
+            answer_challenge(conn, authkey)
+        except (AuthenticationError, EOFError, OSError):
+            return
+        while True:
+            try:
+                kind, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = ("ok", _dispatch(kind, args))
+            except Exception as e:
+                reply = ("error", (type(e).__name__ if isinstance(e, ValueError) else "RuntimeError", str(e)))
+            try:
+                conn.send(reply)
+            except OSError:
+                return
+
+
+def _pin(cores: List[int]):
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(max(1, len(cores)))
+
+
+def _worker_main(listener: Listener, authkey: bytes, cores: List[int], text: bool):
+    global _IN_WORKER
+    _IN_WORKER = True
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _pin(cores)
+    import warmup
+    warmup.warm_up(("image", "text") if text else ("image",))
+    logging.info(f"Detector worker {os.getpid()} ready on cores {cores}")
+    while True:
+        try:
+            conn = listener.accept()
+        except OSError:
+            continue
+        threading.Thread(target=_handle, args=(conn, authkey), daemon=True).start()
+
+
+def _core_slices(workers: int) -> List[List[int]]:
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    workers = max(1, workers)
+    size = max(1, len(cores) // workers)
+    return [cores[(i * size) % len(cores):(i * size) % len(cores) + size] for i in range(workers)]
+
+
+def _preload(text: bool):
+    """Load model weights in the master so workers share them copy-on-write."""
+    from detectors import detect_image
+    if "onnx" not in detect_image._stage_backends():
+        detect_image._get_pipeline()
+    if text:
+        from detectors import detect_text
+        detect_text._get_model()
+    # Move everything allocated so far out of the GC's reach: collections in
+    # the workers then never write to (and un-share) these pages
+    gc.collect()
+    gc.freeze()
+
+
+def serve(socket_path: str, workers: int, text: bool = True):
+    """Run the pool until SIGTERM/SIGINT."""
+    global _IN_WORKER
+    _IN_WORKER = True   # the master must never call itself through the pool
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    authkey = _authkey(socket_path, create=not _AUTHKEY_ENV)
+    _preload(text)
+
+    old_umask = os.umask(0o077)   # socket readable by this user only
+    try:
+        # No authkey here: accept() would run the handshake in the accept loop
+        listener = Listener(socket_path, family="AF_UNIX", backlog=128)
+    finally:
+        os.umask(old_umask)
+
+    slices = _core_slices(workers)
+    children: Dict[int, int] = {}   # pid -> slot
+
+    def spawn(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _worker_main(listener, authkey, slices[slot], text)
+            finally:
+                os._exit(1)
+        children[pid] = slot
+
+    for slot in range(len(slices)):
+        spawn(slot)
+    logging.info(f"Detector pool listening on {socket_path} with {len(slices)} workers")
+
+    stopping = False
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    try:
+        while not stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid and pid in children:
+                slot = children.pop(pid)
+                logging.warning(f"Detector worker {pid} exited ({status}); restarting")
+                spawn(slot)
+            time.sleep(0.5)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        listener.close()
+        for path in (socket_path, f"{socket_path}.key"):
+            if os.path.exists(path) and (path == socket_path or not _AUTHKEY_ENV):
+                os.remove(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the shared detector worker pool.")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("DETECTOR_POOL_WORKERS", "2")))
+    parser.add_argument("--socket", default=SOCKET_PATH or "/tmp/aidetector-pool.sock")
+    parser.add_argument("--no-text", action="store_true", help="serve the image model only")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    serve(args.socket, args.workers, text=not args.no_text)
+
+
+if __name__ == "__main__":
+    main()
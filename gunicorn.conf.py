@@ -0,0 +1,29 @@
+"""
+Gunicorn hooks; gunicorn loads ./gunicorn.conf.py automatically.
+"""
+
+
+def on_starting(server):
+    # Create / migrate the SQLite schema once in the master, before workers
+    # fork, instead of at import time in every worker
+    import admission
+    import db
+    import history_store  # noqa: F401  (registers the rollup and blob store schema)
+    import jobs
+
+    db.init_schema()
+    db.init_schema(jobs.DB_PATH)
+    db.init_schema(admission.DB_PATH)
+    db.close_all()
+
+
+def post_fork(server, worker):
+    # Preload the detectors in each worker (WARMUP_MODE, see warmup.py);
+    # /readyz stays 503 until they are loaded
+    import blob_store
+    import warmup
+
+    warmup.start()
+    # Unreferenced / expired upload blobs (BLOB_GC_INTERVAL_SECONDS, see blob_store.py);
+    # every worker keeps a timer, but only the one holding the lease row collects
+    blob_store.start_gc()
@@ -0,0 +1,133 @@
+"""
+Streaming export of a user's history as CSV, JSON Lines or Parquet.
+
+Rows come from history_store.iter_history_rows() (or, for a search,
+history_search.iter_search_rows()) in keyset batches and are serialized
+chunk by chunk, so the response is sent with chunked transfer
+encoding and memory stays flat however long the history is. Parquet needs
+the optional `pyarrow` package.
+"""
+import csv
+import io
+import json
+
+from history_search import iter_search_rows
+from history_store import LIST_COLUMNS, iter_history_rows
+
+EXPORT_COLUMNS = LIST_COLUMNS + ('created_at',)
+EXPORT_COLUMNS_FULL = EXPORT_COLUMNS + ('full_content',)
+
+# Rows per serialized chunk (and per Parquet row group)
+CHUNK_ROWS = 1000
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def _chunks(rows, size=CHUNK_ROWS):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _csv_stream(rows, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for chunk in _chunks(rows):
+        writer.writerows(chunk)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def _jsonl_stream(rows, columns):
+    for chunk in _chunks(rows):
+        yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in chunk)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that collects bytes until drained."""
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._parts.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _parquet_schema(pa, columns):
+    types = {'id': pa.int64(), 'score': pa.int64(), 'confidence': pa.int64()}
+    return pa.schema([(name, types.get(name, pa.string())) for name in columns])
+
+
+def _parquet_stream(rows, columns):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema(pa, columns)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    try:
+        for chunk in _chunks(rows):
+            # One row group per chunk; flushed to the client right away
+            arrays = [list(col) for col in zip(*chunk)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def export_stream(user_id, fmt, include_full=False, query=None, **filters):
+    """
+    Generator of response chunks for `fmt` ('csv' | 'jsonl' | 'parquet').
+    With `query`, only entries matching that full-text search are exported.
+    """
+    columns = EXPORT_COLUMNS_FULL if include_full else EXPORT_COLUMNS
+    if query:
+        rows = iter_search_rows(user_id, query, columns, batch_size=CHUNK_ROWS, **filters)
+    else:
+        rows = iter_history_rows(user_id, columns, batch_size=CHUNK_ROWS, **filters)
+    if fmt == 'csv':
+        return _csv_stream(rows, columns)
+    if fmt == 'jsonl':
+        return _jsonl_stream(rows, columns)
+    if fmt == 'parquet':
+        return _parquet_stream(rows, columns)
+    raise ValueError(f"Unknown export format '{fmt}'")
@@ -0,0 +1,283 @@
+"""
+Full-text search over `history` with SQLite FTS5.
+
+`history_fts` is an external-content FTS5 table: it stores only the index,
+the text itself stays in `history`. Triggers on `history` keep it in sync
+on insert, delete and edits of the indexed columns; the index is built from
+existing rows once, when the table is created.
+
+Indexed columns: content (file name / text preview), full_content (the
+whole text; left out for image and video rows, where it is the upload's
+path on the server) and analysis (the verdict), plus user_id. Every search is restricted to the user's token in that column, so
+FTS5 intersects posting lists inside the index instead of matching every
+user's rows and filtering them afterwards.
+
+Search text is split into terms that are all required; "double quotes"
+keep a phrase together and a trailing * matches a prefix (2- and
+3-character prefixes are indexed, so short prefixes do not expand into
+thousands of terms). Terms are quoted before they reach MATCH, so FTS5
+syntax in user input has no effect.
+
+Results are listed newest first, or ranked by bm25 (matches in content and
+analysis weigh more than matches deep in a long text). Ranking covers the
+newest HISTORY_SEARCH_RANK_WINDOW (default 2000) matches, which keeps a
+page in the milliseconds however common the term is; search_history says
+when older matches were left out (`truncated`), so the caller can fall
+back to sort='newest'. Both orders page with keyset cursors, and snippets
+are only built for the returned page.
+
+Without FTS5 in the SQLite build, AVAILABLE is False and nothing is indexed.
+"""
+import html
+import logging
+import os
+import re
+import sqlite3
+
+import db
+import history_store
+
+AVAILABLE = True
+
+SORTS = ('rank', 'newest')
+MAX_TERMS = 16
+RANK_WINDOW = int(os.environ.get('HISTORY_SEARCH_RANK_WINDOW', '2000'))
+
+# bm25 weights in column order; user_id only scopes the search
+_WEIGHTS = {'content': 10.0, 'full_content': 1.0, 'analysis': 5.0, 'user_id': 0.0}
+_COLUMNS = tuple(_WEIGHTS)
+_TEXT_COLUMNS = '{content full_content analysis}'
+_RANK = f"bm25(history_fts, {', '.join(str(w) for w in _WEIGHTS.values())})"
+# Snippet markers, replaced by <mark> once the snippet text has been escaped
+_OPEN, _CLOSE = '\x02', '\x03'
+# Uploads keep their server path in full_content; it is not searchable text
+_UPLOAD_TYPES = "('image', 'video')"
+# Excerpt of the text for text rows, of the file name otherwise (never a server path)
+_SNIPPET = (f"snippet(history_fts, CASE WHEN h.type IN {_UPLOAD_TYPES} THEN 0 ELSE 1 END, "
+            f"'{_OPEN}', '{_CLOSE}', '…', 16)")
+
+_TERM_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def _indexed(row):
+    """Values indexed for one history row, in _COLUMNS order."""
+    values = {c: f'{row}.{c}' for c in _COLUMNS}
+    values['full_content'] = f'CASE WHEN {row}.type IN {_UPLOAD_TYPES} THEN NULL ELSE {row}.full_content END'
+    return ', '.join(values[c] for c in _COLUMNS)
+
+
+@db.register_schema
+def _search_schema(conn):
+    global AVAILABLE
+    trigger = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_history_fts_insert'"
+    ).fetchone()
+    if trigger and _UPLOAD_TYPES not in trigger[0]:
+        # Built by an earlier version that indexed upload paths: index again
+        for name in ('trg_history_fts_insert', 'trg_history_fts_delete', 'trg_history_fts_update'):
+            conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        conn.execute('DROP TABLE IF EXISTS history_fts')
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_fts'").fetchone()
+    try:
+        conn.execute(f'''CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+            {', '.join(_COLUMNS)},
+            content = 'history', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )''')
+    except sqlite3.OperationalError as e:
+        AVAILABLE = False
+        logging.warning(f"History search disabled, SQLite FTS5 is not available: {e}")
+        return
+    columns = ', '.join(_COLUMNS)
+    # 'delete' must be given exactly the values that were indexed
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_history_fts_insert AFTER INSERT ON history BEGIN
+            INSERT INTO history_fts (rowid, {columns}) VALUES (NEW.id, {_indexed('NEW')});
+        END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_history_fts_delete AFTER DELETE ON history BEGIN
+            INSERT INTO history_fts (history_fts, rowid, {columns}) VALUES ('delete', OLD.id, {_indexed('OLD')});
+        END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_history_fts_update
+        AFTER UPDATE OF {columns}, type ON history BEGIN
+            INSERT INTO history_fts (history_fts, rowid, {columns}) VALUES ('delete', OLD.id, {_indexed('OLD')});
+            INSERT INTO history_fts (rowid, {columns}) VALUES (NEW.id, {_indexed('NEW')});
+        END''')
+    if not exists:
+        # Not 'rebuild', which would index full_content as stored
+        conn.execute(f'INSERT INTO history_fts (rowid, {columns}) SELECT id, {_indexed("history")} FROM history')
+
+
+def match_expression(user_id, text):
+    """
+    FTS5 MATCH expression for a user's search text, or None if it has no
+    terms. Every term is quoted, so operators and column names in `text`
+    are searched for literally.
+    """
+    terms = []
+    for phrase, word in _TERM_RE.findall(text or ''):
+        term = phrase if phrase else word
+        prefix = not phrase and term.endswith('*')
+        term = term.rstrip('*').strip() if prefix else term.strip()
+        if term:
+            terms.append('"' + term.replace('"', '""') + '"' + ('*' if prefix else ''))
+    if not terms:
+        return None
+    return f'user_id : "{int(user_id)}" AND {_TEXT_COLUMNS} : ({" ".join(terms[:MAX_TERMS])})'
+
+
+def _snippet_html(snippet):
+    return html.escape(snippet or '').replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>')
+
+
+def _parse_cursor(cursor, sort):
+    """'<id>' when sorted by newest, '<rank>:<id>:<floor>' when sorted by rank."""
+    if sort == 'newest':
+        return (int(cursor),)
+    rank, entry_id, floor = str(cursor).split(':')
+    return float(rank), int(entry_id), int(floor)
+
+
+def _match_sql(expression, user_id, filters):
+    """FROM / WHERE (and args) selecting the user's matching entries."""
+    if any(value not in (None, '', []) for value in filters.values()):
+        where, args = history_store.history_filters(user_id, alias='h', **filters)
+        # CROSS JOIN keeps the index as the outer loop; SQLite may otherwise walk
+        # the user's history rows and run the MATCH once per row
+        sql = 'FROM history_fts CROSS JOIN history h ON h.id = history_fts.rowid WHERE history_fts MATCH ?'
+        return sql, [expression] + args, where
+    # The MATCH expression already restricts the search to the user
+    return 'FROM history_fts WHERE history_fts MATCH ?', [expression], []
+
+
+def _rank_floor(from_sql, args, where):
+    """Lowest id among the newest RANK_WINDOW matches, or 0 when there are fewer."""
+    row = db.query_one(
+        f"SELECT history_fts.rowid {' AND '.join([from_sql] + where)} "
+        f"ORDER BY history_fts.rowid DESC LIMIT 1 OFFSET ?",
+        args + [RANK_WINDOW - 1]
+    )
+    return row[0] if row else 0
+
+
+def _older_matches(from_sql, args, where, floor):
+    """True if some match is older than the rank window starting at id `floor`."""
+    return db.query_one(
+        f"SELECT 1 {' AND '.join([from_sql] + where + ['history_fts.rowid < ?'])} LIMIT 1",
+        args + [floor]
+    ) is not None
+
+
+def _page_ids(from_sql, args, where, limit, cursor, sort):
+    """(id, rank, floor) of the page's entries in order, one past `limit` if there are more."""
+    where, args = list(where), list(args)
+    if sort == 'newest':
+        if cursor is not None:
+            where.append('history_fts.rowid < ?')
+            args.extend(cursor)
+        rows = db.query_all(
+            f"SELECT history_fts.rowid {' AND '.join([from_sql] + where)} "
+            f"ORDER BY history_fts.rowid DESC LIMIT ?",
+            args + [limit + 1]
+        )
+        return [(row[0], None, None) for row in rows]
+
+    # Relevance is ranked within a fixed window of the newest matches, so the
+    # cost of a page does not grow with the number of matching entries
+    floor = cursor[2] if cursor is not None else _rank_floor(from_sql, args, where)
+    where.append('history_fts.rowid >= ?')
+    args.append(floor)
+    if cursor is not None:
+        where.append(f'({_RANK} > ? OR ({_RANK} = ? AND history_fts.rowid < ?))')
+        args.extend((cursor[0], cursor[0], cursor[1]))
+    rows = db.query_all(
+        f"SELECT history_fts.rowid, {_RANK} {' AND '.join([from_sql] + where)} "
+        f"ORDER BY {_RANK}, history_fts.rowid DESC LIMIT ?",
+        args + [limit + 1]
+    )
+    return [(row[0], row[1], floor) for row in rows]
+
+
+def _expression(user_id, text):
+    if not AVAILABLE:
+        raise RuntimeError('Full-text search is not available (SQLite built without FTS5)')
+    expression = match_expression(user_id, text)
+    if expression is None:
+        raise ValueError('q must contain at least one search term')
+    return expression
+
+
+def iter_search_rows(user_id, text, columns, batch_size=1000, **filters):
+    """
+    Yield raw rows (tuples of `columns`) of every entry matching `text`,
+    newest first, in keyset batches like history_store.iter_history_rows.
+    """
+    from_sql, args, where = _match_sql(_expression(user_id, text), user_id, filters)
+    cursor = None
+    while True:
+        page = _page_ids(from_sql, args, where, batch_size, cursor, 'newest')
+        ids = [entry_id for entry_id, _, _ in page[:batch_size]]
+        if ids:
+            rows = db.query_all(
+                f"SELECT {', '.join(columns)} FROM history WHERE user_id = ? "
+                f"AND id IN ({', '.join('?' * len(ids))}) ORDER BY id DESC",
+                [user_id] + ids
+            )
+            yield from rows
+        if len(page) <= batch_size:
+            return
+        cursor = (ids[-1],)
+
+
+def search_history(user_id, text, limit=None, cursor=None, sort='rank', **filters):
+    """
+    One page of the user's entries matching `text`, each with an HTML
+    `snippet` (matches wrapped in <mark>). Accepts the filters of
+    list_history. sort='rank' orders the newest RANK_WINDOW matches by
+    relevance; sort='newest' lists every match. Returns (entries,
+    next_cursor, truncated); next_cursor is None on the last page and
+    truncated is True when sort='rank' left older matches out. Raises
+    ValueError for empty searches, an unknown sort or a malformed cursor.
+    """
+    if sort not in SORTS:
+        raise ValueError(f'sort must be one of {", ".join(SORTS)}')
+    expression = _expression(user_id, text)
+    if cursor is not None:
+        try:
+            cursor = _parse_cursor(cursor, sort)
+        except ValueError:
+            raise ValueError('cursor is not valid for this search')
+    limit = max(1, min(int(limit or history_store.DEFAULT_PAGE_SIZE), history_store.MAX_PAGE_SIZE))
+
+    from_sql, args, where = _match_sql(expression, user_id, filters)
+    page = _page_ids(from_sql, args, where, limit, cursor, sort)
+    if not page:
+        return [], None, False
+    floor = page[0][2]
+    truncated = bool(floor) and _older_matches(from_sql, args, where, floor)
+
+    # Snippets are built for the returned page only, not for every match. One
+    # pass over the page's id range: a `rowid IN (...)` that reached FTS5
+    # would re-run the MATCH for every id, hence the unary + on it
+    columns = history_store.LIST_COLUMNS
+    ids = [entry_id for entry_id, _, _ in page[:limit]]
+    rows = db.query_all(
+        f"SELECT {', '.join(f'h.{c}' for c in columns)}, {_SNIPPET} "
+        f"FROM history_fts CROSS JOIN history h ON h.id = history_fts.rowid "
+        f"WHERE history_fts MATCH ? AND history_fts.rowid BETWEEN ? AND ? "
+        f"AND +history_fts.rowid IN ({', '.join('?' * len(ids))})",
+        [expression, min(ids), max(ids)] + ids
+    )
+    by_id = {row[0]: row for row in rows}
+    entries = []
+    for entry_id in ids:
+        row = by_id.get(entry_id)
+        if row is None:
+            continue    # deleted between the two queries
+        entry = history_store.row_to_entry(row[:len(columns)], columns)
+        entry['snippet'] = _snippet_html(row[-1])
+        entries.append(entry)
+
+    next_cursor = None
+    if len(page) > limit:
+        entry_id, rank, floor = page[limit - 1]
+        next_cursor = str(entry_id) if sort == 'newest' else f'{rank!r}:{entry_id}:{floor}'
+    return entries, next_cursor, truncated
@@ -0,0 +1,152 @@
+"""
+Per-user analytics rollups of the `history` table.
+
+Two small tables are kept up to date by triggers on `history`, so every
+write path (the API endpoints, bulk inserts, job workers, deletes and
+clears) maintains them in the same transaction as the row itself:
+
+    history_rollup_totals  (user_id, type)       all-time counts
+    history_rollup_daily   (user_id, day, type)  counts per UTC day
+
+Each row holds the entry count, how many entries have a score, the score
+sum and a 10-bucket score histogram (0-9, 10-19, ..., 90-100). Reading a
+user's stats touches one totals row per type plus one daily row per type
+and active day in the requested window, however long the history is.
+
+The tables are filled from existing history once, when they are created.
+"""
+from datetime import datetime, timedelta
+
+import db
+
+BUCKETS = 10
+DEFAULT_DAYS = 30
+MAX_DAYS = 366
+
+_COUNT_COLUMNS = ('count', 'scored', 'score_sum') + tuple(f'b{i}' for i in range(BUCKETS))
+
+
+def _score(row):
+    return f'MIN(MAX(CAST({row}.score AS INTEGER), 0), 100)'
+
+
+def _day(row):
+    return f"COALESCE(substr({row}.created_at, 1, 10), '')"
+
+
+def _values(row, sign):
+    """count / scored / score_sum / bucket columns contributed by one history row."""
+    values = [f'{sign}', f'{sign} * ({row}.score IS NOT NULL)', f'{sign} * COALESCE({_score(row)}, 0)']
+    values += [f'{sign} * COALESCE(MIN({_score(row)} / 10, {BUCKETS - 1}) = {i}, 0)' for i in range(BUCKETS)]
+    return values
+
+
+def _upsert(table, keys, row, sign):
+    key_values = {'user_id': f'{row}.user_id', 'day': _day(row), 'type': f"COALESCE({row}.type, '')"}
+    updates = ', '.join(f'{c} = {c} + excluded.{c}' for c in _COUNT_COLUMNS)
+    statements = [
+        f'''INSERT INTO {table} ({', '.join(keys + _COUNT_COLUMNS)})
+            VALUES ({', '.join([key_values[k] for k in keys] + _values(row, sign))})
+            ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates};'''
+    ]
+    if sign == '-1':
+        # Drop buckets that became empty so reads only see active days
+        where = ' AND '.join(f'{k} = {key_values[k]}' for k in keys)
+        statements.append(f'DELETE FROM {table} WHERE {where} AND count <= 0;')
+    return '\n'.join(statements)
+
+
+def _apply(row, sign):
+    return '\n'.join((_upsert('history_rollup_totals', ('user_id', 'type'), row, sign),
+                      _upsert('history_rollup_daily', ('user_id', 'day', 'type'), row, sign)))
+
+
+def _backfill(conn):
+    for table, keys in (('history_rollup_totals', ('user_id', 'type')),
+                        ('history_rollup_daily', ('user_id', 'day', 'type'))):
+        exprs = {'user_id': 'h.user_id', 'day': _day('h'), 'type': "COALESCE(h.type, '')"}
+        sums = ', '.join(f'SUM({v})' for v in _values('h', '1'))
+        conn.execute(
+            f'''INSERT INTO {table} ({', '.join(keys + _COUNT_COLUMNS)})
+                SELECT {', '.join(exprs[k] for k in keys)}, {sums}
+                FROM history h WHERE h.user_id IS NOT NULL
+                GROUP BY {', '.join(exprs[k] for k in keys)}'''
+        )
+
+
+@db.register_schema
+def _rollup_schema(conn):
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_rollup_totals'"
+    ).fetchone()
+    counts = ', '.join(f'{c} INTEGER NOT NULL DEFAULT 0' for c in _COUNT_COLUMNS)
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS history_rollup_totals (
+        user_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        {counts},
+        PRIMARY KEY (user_id, type)
+    ) WITHOUT ROWID''')
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS history_rollup_daily (
+        user_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        type TEXT NOT NULL,
+        {counts},
+        PRIMARY KEY (user_id, day, type)
+    ) WITHOUT ROWID''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_history_rollup_insert
+        AFTER INSERT ON history WHEN NEW.user_id IS NOT NULL BEGIN
+            {_apply('NEW', '1')}
+        END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_history_rollup_delete
+        AFTER DELETE ON history WHEN OLD.user_id IS NOT NULL BEGIN
+            {_apply('OLD', '-1')}
+        END''')
+    conn.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_history_rollup_update
+        AFTER UPDATE OF user_id, type, score, created_at ON history BEGIN
+            {_apply('OLD', '-1')}
+            {_apply('NEW', '1')}
+        END''')
+    if not exists:
+        _backfill(conn)
+
+
+def _summary(counts):
+    """Public shape of one rollup row's (count, scored, score_sum, b0..b9)."""
+    count, scored, score_sum = counts[:3]
+    return {
+        'count': count,
+        'average_score': round(score_sum / scored, 1) if scored else None,
+        'histogram': list(counts[3:]),
+    }
+
+
+def get_user_stats(user_id, days=DEFAULT_DAYS):
+    """
+    Totals per type and overall, plus daily volume for the last `days`
+    UTC days (only days with entries are listed, oldest first).
+    """
+    days = max(1, min(int(days), MAX_DAYS))
+    columns = ', '.join(_COUNT_COLUMNS)
+    totals = db.query_all(
+        f'SELECT type, {columns} FROM history_rollup_totals WHERE user_id = ? ORDER BY type', (user_id,)
+    )
+    overall = [0] * len(_COUNT_COLUMNS)
+    by_type = {}
+    for row in totals:
+        by_type[row[0]] = _summary(row[1:])
+        overall = [a + b for a, b in zip(overall, row[1:])]
+
+    since = (datetime.utcnow() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    daily = []
+    for day, entry_type, count in db.query_all(
+        'SELECT day, type, count FROM history_rollup_daily WHERE user_id = ? AND day >= ? ORDER BY day, type',
+        (user_id, since)
+    ):
+        if not daily or daily[-1]['date'] != day:
+            daily.append({'date': day, 'total': 0, 'by_type': {}})
+        daily[-1]['total'] += count
+        daily[-1]['by_type'][entry_type] = count
+
+    stats = _summary(overall)
+    stats.update({'by_type': by_type, 'days': days, 'daily': daily})
+    return stats
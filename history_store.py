@@ -0,0 +1,216 @@
+"""
+Shared helpers for the `history` table.
+
+Writes are used by the synchronous detection endpoints in app.py and by
+the job workers in jobs.py, so a result is stored the same way whichever
+path produced it. Reads use keyset pagination on (user_id, id), newest
+first, backed by idx_history_user_id. Rows written by a job carry its
+`job_id` (unique), so a job that is retried still stores one row.
+"""
+from datetime import datetime
+
+import blob_store  # noqa: F401  (history.blob_hash and blob refcount triggers)
+import db
+import history_search  # noqa: F401  (full-text index and triggers on `history`)
+import history_stats  # noqa: F401  (rollup tables and triggers on `history`)
+from metrics import DB_WRITE_SECONDS, timed
+
+
+# Columns for list views; full_content can hold whole documents and is only
+# returned by the single-entry endpoint
+LIST_COLUMNS = ('id', 'type', 'content', 'score', 'confidence', 'date', 'analysis')
+DETAIL_COLUMNS = LIST_COLUMNS + ('full_content',)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+@db.register_schema
+def _schema(conn):
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(history)')]
+    if 'job_id' not in columns:
+        conn.execute('ALTER TABLE history ADD COLUMN job_id TEXT')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_history_job_id ON history (job_id) WHERE job_id IS NOT NULL')
+
+
+def utc_now_iso():
+    """Sortable UTC timestamp stored in `created_at`."""
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def utc_date_str():
+    """Timestamp format used for the `date` column of server-side results."""
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC")
+
+
+def add_history_entry(user_id, entry_type, content, score, confidence, full_content, analysis, date=None,
+                      blob_hash=None, job_id=None):
+    """
+    Insert one history row and return its id. `blob_hash` references a stored
+    upload (blob_store.py); with `job_id` (jobs.py) the row is written once and
+    later calls return the existing row's id.
+    """
+    with timed(DB_WRITE_SECONDS, operation='history_insert'):
+        cur = db.execute(
+            '''INSERT INTO history (user_id, type, content, score, confidence, date, full_content, analysis, created_at,
+                                  blob_hash, job_id)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (job_id) WHERE job_id IS NOT NULL DO NOTHING''',
+            (user_id, entry_type, content, score, confidence, date or utc_date_str(), full_content, analysis,
+             utc_now_iso(), blob_hash, job_id)
+        )
+    if cur.rowcount == 0:
+        return db.query_one('SELECT id FROM history WHERE job_id = ?', (job_id,))[0]
+    return cur.lastrowid
+
+
+def add_history_record(user_id, record, date=None, job_id=None):
+    """Insert a detection record (see detection.py) and return its id; see add_history_entry for `job_id`."""
+    args = (user_id, record['type'], record['content'], record['score'], record['confidence'],
+            record['full_content'], record['analysis'], date, record.get('blob_hash'), job_id)
+    hashes = record.get('image_hashes')
+    if not hashes:
+        return add_history_entry(*args)
+    from detectors import near_dup
+    # Row and near-duplicate index entry are written together
+    with db.transaction():
+        new_id = add_history_entry(*args)
+        near_dup.add(new_id, user_id, hashes['model'], hashes)
+    return new_id
+
+
+def add_history_records(user_id, records, date=None):
+    """
+    Insert many detection records in one transaction (executemany) and
+    return their ids, in order.
+    """
+    if not records:
+        return []
+    date = date or utc_date_str()
+    created_at = utc_now_iso()
+    rows = [(user_id, r['type'], r['content'], r['score'], r['confidence'], date, r['full_content'],
+             r['analysis'], created_at, r.get('blob_hash')) for r in records]
+    if any(r.get('image_hashes') for r in records):
+        # Imported (and its schema created) before the transaction starts
+        from detectors import near_dup
+    with timed(DB_WRITE_SECONDS, operation='history_insert_many'), db.transaction() as conn:
+        conn.executemany(
+            '''INSERT INTO history (user_id, type, content, score, confidence, date, full_content, analysis, created_at,
+                                  blob_hash)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            rows
+        )
+        # One writer holds the lock, so AUTOINCREMENT ids of this statement are consecutive
+        last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+        ids = list(range(last_id - len(rows) + 1, last_id + 1))
+        hashed = [(new_id, r['image_hashes']) for new_id, r in zip(ids, records) if r.get('image_hashes')]
+        if hashed:
+            near_dup.add_many(user_id, hashed)
+    return ids
+
+
+def row_to_entry(row, columns):
+    """Map a history row to the camelCase dict the frontend uses."""
+    entry = dict(zip(columns, row))
+    if 'full_content' in entry:
+        entry['fullContent'] = entry.pop('full_content')
+    return entry
+
+
+def history_filters(user_id, types=None, min_score=None, max_score=None, since=None, until=None, alias=None):
+    """WHERE clause + args for a user's history with optional filters.
+
+    `since`/`until` compare against `created_at` ("YYYY-MM-DD[ HH:MM:SS]", UTC);
+    `until` given as a bare date includes that whole day. `alias` qualifies
+    the columns when `history` is joined under that name.
+    """
+    col = f'{alias}.' if alias else ''
+    where = [f'{col}user_id = ?']
+    args = [user_id]
+    if types:
+        where.append(f"{col}type IN ({', '.join('?' * len(types))})")
+        args.extend(types)
+    if min_score is not None:
+        where.append(f'{col}score >= ?')
+        args.append(min_score)
+    if max_score is not None:
+        where.append(f'{col}score <= ?')
+        args.append(max_score)
+    if since:
+        where.append(f'{col}created_at >= ?')
+        args.append(since)
+    if until:
+        where.append(f'{col}created_at <= ?')
+        args.append(until + ' 23:59:59' if len(until) == 10 else until)
+    return where, args
+
+
+def list_history(user_id, limit=DEFAULT_PAGE_SIZE, cursor=None, **filters):
+    """
+    One page of a user's history, newest first, without full_content.
+
+    `cursor` is the `next_cursor` of the previous page (the last id seen).
+    Returns (entries, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    where, args = history_filters(user_id, **filters)
+    if cursor is not None:
+        where.append('id < ?')
+        args.append(int(cursor))
+    sql = (f"SELECT {', '.join(LIST_COLUMNS)} FROM history WHERE {' AND '.join(where)} "
+           f"ORDER BY id DESC LIMIT ?")
+    # Fetch one extra row to know whether another page exists
+    args.append(limit + 1)
+    rows = db.query_all(sql, args)
+    entries = [row_to_entry(r, LIST_COLUMNS) for r in rows[:limit]]
+    next_cursor = entries[-1]['id'] if len(rows) > limit else None
+    return entries, next_cursor
+
+
+def iter_history_rows(user_id, columns=LIST_COLUMNS, batch_size=1000, **filters):
+    """
+    Yield raw rows (tuples of `columns`) of a user's history, newest first.
+
+    Walks the keyset index in batches of `batch_size`, so memory stays flat
+    and no read transaction is held open between batches.
+    """
+    if 'id' not in columns:
+        raise ValueError("columns must include 'id'")
+    id_pos = columns.index('id')
+    base_where, base_args = history_filters(user_id, **filters)
+    cursor = None
+    while True:
+        where, args = list(base_where), list(base_args)
+        if cursor is not None:
+            where.append('id < ?')
+            args.append(cursor)
+        args.append(batch_size)
+        rows = db.query_all(
+            f"SELECT {', '.join(columns)} FROM history WHERE {' AND '.join(where)} ORDER BY id DESC LIMIT ?",
+            args
+        )
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        cursor = rows[-1][id_pos]
+
+
+def get_history_entry(user_id, entry_id):
+    """Full entry (including fullContent) or None."""
+    row = db.query_one(
+        f"SELECT {', '.join(DETAIL_COLUMNS)} FROM history WHERE id = ? AND user_id = ?",
+        (entry_id, user_id)
+    )
+    return row_to_entry(row, DETAIL_COLUMNS) if row else None
+
+
+def delete_history_entry(user_id, entry_id):
+    """Delete one of the user's entries. Returns False if it was not found."""
+    with timed(DB_WRITE_SECONDS, operation='history_delete'):
+        return db.execute('DELETE FROM history WHERE id = ? AND user_id = ?', (entry_id, user_id)).rowcount > 0
+
+
+def clear_history(user_id):
+    """Delete all of the user's entries; returns the number removed."""
+    with timed(DB_WRITE_SECONDS, operation='history_clear'):
+        return db.execute('DELETE FROM history WHERE user_id = ?', (user_id,)).rowcount
@@ -0,0 +1,309 @@
+"""
+Asynchronous detection jobs backed by a local SQLite queue.
+
+The web tier only saves the upload and enqueues a job; a separate pool of
+worker processes claims queued jobs, runs the detector, writes the
+`history` row (via history_store, exactly like the synchronous endpoints)
+and stores the result on the job.
+
+Run the worker pool next to the web server:
+    python -m jobs --workers 2
+
+For local development the app can instead run workers as threads inside
+the web process (JOBS_INPROCESS_WORKERS=1).
+
+Job states: queued -> running -> done | failed. Workers renew a job's
+lease every JOBS_LEASE_SECONDS / 3 while it runs; a running job whose
+worker stops heart-beating for JOBS_LEASE_SECONDS is put back in the queue
+(up to JOBS_MAX_ATTEMPTS times). Progress and results of an attempt that
+lost its lease are discarded, and its history row is keyed by the job id
+(history.job_id, unique), so however many attempts finish, the job has
+one history row.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import uuid
+
+import db
+from metrics import QUEUE_DEPTH
+
+DB_PATH = os.environ.get('JOBS_DB_PATH', 'jobs.db')
+LEASE_SECONDS = float(os.environ.get('JOBS_LEASE_SECONDS', '600'))
+MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', '3'))
+INPROCESS_WORKERS = int(os.environ.get('JOBS_INPROCESS_WORKERS', '0'))
+
+# Idle polling backs off up to this interval (SQLite has no notifications)
+_POLL_MIN = 0.05
+_POLL_MAX = 1.0
+
+JOB_TYPES = ('image', 'text', 'video')
+
+_inprocess_started = False
+_inprocess_lock = threading.Lock()
+
+
+def _jobs_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress REAL NOT NULL DEFAULT 0,
+        payload TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        heartbeat_at REAL,
+        finished_at REAL
+    )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at)')
+
+
+db.register_schema(_jobs_schema, DB_PATH)
+
+# Evaluated only when /metrics is scraped
+QUEUE_DEPTH.set_function(
+    lambda: db.query_one("SELECT COUNT(*) FROM jobs WHERE status = 'queued'", (), DB_PATH)[0], queue='jobs'
+)
+
+
+def _row_to_job(row):
+    keys = ('id', 'user_id', 'type', 'status', 'progress', 'payload', 'result', 'error',
+            'attempts', 'created_at', 'started_at', 'finished_at')
+    job = dict(zip(keys, row))
+    job['payload'] = json.loads(job['payload'])
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+# ---------- Producer side (web tier) ----------
+
+def enqueue(user_id, job_type, payload):
+    """Add a job to the queue and return its id."""
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"Unknown job type '{job_type}'")
+    job_id = uuid.uuid4().hex
+    db.execute(
+        'INSERT INTO jobs (id, user_id, type, payload, created_at) VALUES (?, ?, ?, ?, ?)',
+        (job_id, user_id, job_type, json.dumps(payload), time.time()),
+        DB_PATH
+    )
+    if INPROCESS_WORKERS > 0:
+        start_inprocess_workers(INPROCESS_WORKERS)
+    return job_id
+
+
+def get_job(job_id, user_id=None):
+    """Job dict (without payload) or None. With user_id, only that user's job."""
+    sql = '''SELECT id, user_id, type, status, progress, payload, result, error,
+                    attempts, created_at, started_at, finished_at
+             FROM jobs WHERE id = ?'''
+    args = [job_id]
+    if user_id is not None:
+        sql += ' AND user_id = ?'
+        args.append(user_id)
+    row = db.query_one(sql, args, DB_PATH)
+    if row is None:
+        return None
+    job = _row_to_job(row)
+    job.pop('payload')
+    return job
+
+
+# ---------- Consumer side (workers) ----------
+
+def _requeue_expired(conn, now):
+    conn.execute(
+        '''UPDATE jobs SET status = 'failed', error = 'Worker lost too many times', finished_at = ?
+           WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?''',
+        (now, now - LEASE_SECONDS, MAX_ATTEMPTS)
+    )
+    conn.execute(
+        '''UPDATE jobs SET status = 'queued', worker = NULL
+           WHERE status = 'running' AND heartbeat_at < ?''',
+        (now - LEASE_SECONDS,)
+    )
+
+
+def claim_next(worker_id):
+    """Atomically move the oldest queued job to 'running' and return it, or None."""
+    now = time.time()
+    with db.transaction(DB_PATH) as conn:
+        _requeue_expired(conn, now)
+        row = conn.execute(
+            '''SELECT id, user_id, type, status, progress, payload, result, error,
+                      attempts, created_at, started_at, finished_at
+               FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1'''
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            '''UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1,
+                              started_at = ?, heartbeat_at = ?, progress = 0
+               WHERE id = ?''',
+            (worker_id, now, now, row[0])
+        )
+    job = _row_to_job(row)
+    # The attempt this worker now owns; a requeued job gets a new one
+    job['attempts'] += 1
+    job['worker'] = worker_id
+    return job
+
+
+# Matches only the attempt that claimed the job, so a worker whose lease has
+# expired (and whose job was requeued) cannot touch the new attempt's row
+_OWNER = "id = ? AND worker = ? AND attempts = ? AND status = 'running'"
+
+
+def _owner_args(job):
+    return (job['id'], job['worker'], job['attempts'])
+
+
+def set_progress(job, progress):
+    """Record progress (and renew the lease) of a job this worker claimed."""
+    db.execute(
+        f'UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE {_OWNER}',
+        (max(0.0, min(1.0, float(progress))), time.time()) + _owner_args(job),
+        DB_PATH
+    )
+
+
+def heartbeat(job):
+    """Renew the lease; returns False once the job is no longer this attempt's."""
+    return db.execute(f'UPDATE jobs SET heartbeat_at = ? WHERE {_OWNER}', (time.time(),) + _owner_args(job),
+                      DB_PATH).rowcount > 0
+
+
+def _heartbeat_loop(job, stop):
+    while not stop.wait(LEASE_SECONDS / 3):
+        try:
+            if not heartbeat(job):
+                logging.warning(f"Job {job['id']} lost its lease (attempt {job['attempts']})")
+                return
+        except Exception:
+            logging.exception(f"Heartbeat for job {job['id']} failed")
+
+
+def _finish(job, status, result=None, error=None):
+    """Store the outcome; ignored (returns False) if a newer attempt owns the job."""
+    finished = db.execute(
+        f'''UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?,
+                           progress = CASE WHEN ? = 'done' THEN 1.0 ELSE progress END
+            WHERE {_OWNER}''',
+        (status, json.dumps(result) if result is not None else None, error,
+         time.time(), status) + _owner_args(job),
+        DB_PATH
+    ).rowcount > 0
+    if not finished:
+        logging.warning(f"Job {job['id']} attempt {job['attempts']} finished after losing its lease; "
+                        f"result discarded")
+    return finished
+
+
+def run_job(job):
+    """Run one claimed job: detect, write history, store the result."""
+    # Imported here so `enqueue`/`get_job` stay light for the web tier
+    import detection
+    from history_store import add_history_record, utc_date_str
+
+    payload = job['payload']
+
+    def progress(fraction):
+        set_progress(job, fraction)
+
+    if job['type'] == 'image':
+        record = detection.image_record(payload['path'], payload['filename'], payload['digest'], progress,
+                                        user_id=job['user_id'])
+    elif job['type'] == 'text':
+        record = detection.text_record(payload['text'], progress)
+    else:
+        record = detection.video_record(payload['path'], payload['filename'], payload.get('strategy'), progress)
+
+    # A requeued job is already running elsewhere; skip the write early. The lease can
+    # still expire right after this check, so the row itself is keyed by job id.
+    if not heartbeat(job):
+        raise RuntimeError('Job lease lost before the result was stored')
+    date_str = utc_date_str()
+    new_id = add_history_record(job['user_id'], record, date_str, job_id=job['id'])
+    return detection.record_response(new_id, date_str, record)
+
+
+def work(stop_event=None, worker_id=None):
+    """Claim and run jobs until `stop_event` is set."""
+    worker_id = worker_id or f"{os.getpid()}-{threading.get_ident()}"
+    delay = _POLL_MIN
+    while stop_event is None or not stop_event.is_set():
+        job = claim_next(worker_id)
+        if job is None:
+            time.sleep(delay)
+            delay = min(_POLL_MAX, delay * 2)
+            continue
+        delay = _POLL_MIN
+        # Detectors may report progress rarely (image and text only at the end),
+        # so the lease is renewed independently while the job runs
+        stop_heartbeat = threading.Event()
+        threading.Thread(target=_heartbeat_loop, args=(job, stop_heartbeat),
+                         name=f"job-heartbeat-{job['id'][:8]}", daemon=True).start()
+        try:
+            result = run_job(job)
+        except Exception as e:
+            logging.exception(f"Job {job['id']} failed")
+            _finish(job, 'failed', error=str(e))
+        else:
+            _finish(job, 'done', result=result)
+        finally:
+            stop_heartbeat.set()
+
+
+def start_inprocess_workers(count):
+    """Run `count` worker threads inside this process (development mode)."""
+    global _inprocess_started
+    with _inprocess_lock:
+        if _inprocess_started:
+            return
+        for i in range(count):
+            threading.Thread(target=work, name=f'job-worker-{i}', daemon=True).start()
+        _inprocess_started = True
+
+
+def _worker_process(index):
+    stop = threading.Event()
+    # Finish the current job, then exit
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    work(stop, worker_id=f"worker-{index}-{os.getpid()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run detection job workers.')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('JOBS_WORKERS', '2')),
+                        help='number of worker processes')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    db.init_schema(DB_PATH)
+    procs = [multiprocessing.Process(target=_worker_process, args=(i,), daemon=False)
+             for i in range(max(1, args.workers))]
+    for p in procs:
+        p.start()
+
+    def shutdown(*_):
+        for p in procs:
+            p.terminate()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for p in procs:
+        p.join()
+
+
+if __name__ == '__main__':
+    main()
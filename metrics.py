@@ -0,0 +1,226 @@
+"""
+Prometheus-style metrics without extra dependencies.
+
+Enable with METRICS_ENABLED=1; GET /metrics then serves the text
+exposition format. When disabled every hook is a no-op (one attribute check),
+and /metrics returns 404.
+
+    from metrics import MODEL_FORWARD_SECONDS, timed
+    with timed(MODEL_FORWARD_SECONDS, detector='image', model=name):
+        outputs = pipe(images)
+
+Metrics are per process. With several gunicorn workers, each scrape sees
+the worker that answered it; scrape workers individually (or run one
+worker per container) for exact totals. Job workers (jobs.py) run in
+their own processes and are not included.
+"""
+import abc
+import math
+import os
+import threading
+import time
+
+ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+PREFIX = 'aidetector_'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_REGISTRY = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric(abc.ABC):
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        _REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    @abc.abstractmethod
+    def _samples(self):
+        """Exposition lines for every label set, without HELP / TYPE."""
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1.0, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = self._children.get(key, 0.0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._children.items())
+        return [f'{self.name}_total{_format_labels(self.labelnames, k)} {_format_value(v)}' for k, v in items]
+
+
+class Gauge(_Metric):
+    """A settable gauge, or one computed at scrape time with `set_function`."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = float(value)
+
+    def set_function(self, fn, **labels):
+        """Read the value from fn() on each scrape (zero cost between scrapes)."""
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = fn
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._children)
+            functions = dict(self._functions)
+        for key, fn in functions.items():
+            try:
+                values[key] = float(fn())
+            except Exception:
+                continue
+        return [f'{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}' for k, v in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        if not ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                # [per-bucket counts..., sum]
+                child = self._children[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    child[i] += 1
+                    break
+            child[-1] += value
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._children.items())
+        lines = []
+        for key, child in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, child):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(child[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('metric', 'labels', 'started')
+
+    def __init__(self, metric, labels):
+        self.metric = metric
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metric.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(histogram, **labels):
+    """Context manager observing the block's duration (no-op when disabled)."""
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(histogram, labels)
+
+
+def render():
+    """All metrics in Prometheus text exposition format (version 0.0.4)."""
+    return '\n'.join(metric.render() for metric in _REGISTRY) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# ---------- Application metrics ----------
+
+REQUEST_SECONDS = Histogram('http_request_seconds', 'HTTP request latency by endpoint.',
+                            ('endpoint', 'method', 'status'))
+UPLOAD_SAVE_SECONDS = Histogram('upload_save_seconds', 'Time to stream an upload to disk while hashing it.')
+IMAGE_DECODE_SECONDS = Histogram('image_decode_seconds', 'Time to open an image and convert it to RGB.')
+MODEL_FORWARD_SECONDS = Histogram('model_forward_seconds', 'Model forward pass time per batch.',
+                                  ('detector', 'model'))
+NORMALIZE_SECONDS = Histogram('normalize_results_seconds', 'Time to map raw model outputs to AI/Human scores.',
+                              ('detector',))
+DB_WRITE_SECONDS = Histogram('db_write_seconds', 'SQLite write time by operation.', ('operation',))
+DETECTIONS = Counter('detections', 'Detection results by detector, model and label.',
+                     ('detector', 'model', 'label'))
+PIPELINE_WAIT_SECONDS = Gauge('pipeline_wait_seconds',
+                              'Most recent wait for the model (batch queue or pipeline lock) before inference.',
+                              ('detector',))
+QUEUE_DEPTH = Gauge('queue_depth', 'Items waiting for a detector or job worker.', ('queue',))
+IMAGE_CASCADE_IMAGES = Counter('image_cascade_images', 'Images scored by the image cascade, by escalation.',
+                               ('escalated',))
+ADMISSION_DECISIONS = Counter('admission_decisions',
+                              'Detection requests by priority class and admission decision '
+                              '(admitted / rate_limited / shed / timed_out).', ('priority', 'decision'))
+ADMISSION_WAIT_SECONDS = Histogram('admission_wait_seconds', 'Time admitted requests waited for a slot.',
+                                   ('priority',))
+USER_CACHE_LOOKUPS = Counter('user_cache_lookups', 'Flask-Login user loads by result (hit / miss).', ('result',))
@@ -1,4 +1,6 @@
 let historyData = []; // Global state for history data
+let historyNextCursor = null; // Keyset cursor for the next history page (null = no more)
+let historyFilters = {}; // Active history filters (q, type, min_score, max_score, since, until)
 let deleteIndex = -1;
 
 // NEW: prevent runtime error from base.html call
@@ -46,9 +48,24 @@ function initMobileMenu() {
     });
 }
 
-// Fetch history data from server with cache busting
-function fetchHistory() {
-    return fetch('/api/history?' + new Date().getTime(), {
+// Build the /api/history query string for the active filters and cursor
+function historyQuery(cursor) {
+    const params = new URLSearchParams();
+    Object.entries(historyFilters).forEach(([key, value]) => {
+        if (value !== '' && value !== null && value !== undefined) params.set(key, value);
+    });
+    if (cursor) params.set('cursor', cursor);
+    params.set('_', new Date().getTime()); // cache busting
+    return params.toString();
+}
+
+// Fetch history data from server. append=true loads the next page.
+function fetchHistory(append = false) {
+    const cursor = append ? historyNextCursor : null;
+    if (append && !cursor) return Promise.resolve();
+    // A search term switches to the full-text search endpoint (same paging and filters)
+    const endpoint = historyFilters.q ? '/api/history/search?' : '/api/history?';
+    return fetch(endpoint + historyQuery(cursor), {
         credentials: 'same-origin' // Include cookies for session authentication
     })
     .then(response => {
@@ -64,8 +81,14 @@ function fetchHistory() {
     })
     .then(data => {
         if (data) {
-            historyData = Array.isArray(data) ? data : [];
-            console.log('History data fetched, length:', historyData.length, 'data:', historyData);
+            const items = Array.isArray(data.items) ? data.items : [];
+            historyData = append ? historyData.concat(items) : items;
+            historyNextCursor = data.next_cursor || null;
+            console.log('History page fetched, length:', items.length, 'total loaded:', historyData.length);
+            // Relevance ranking only covers the newest matches of a very common term
+            if (!append && data.truncated) {
+                showNotification('Many entries match: only the most recent ones are ranked. Refine the search to see older matches.', 'warning');
+            }
             updateHistoryTable();
         } else {
             throw new Error('No data received');
@@ -74,11 +97,36 @@ function fetchHistory() {
     .catch(error => {
         console.error('Error fetching history:', error);
         showNotification('Failed to load history: ' + error.message, 'error');
-        historyData = []; // Reset to empty on error
+        if (!append) {
+            historyData = []; // Reset to empty on error
+            historyNextCursor = null;
+        }
         updateHistoryTable();
     });
 }
 
+function loadMoreHistory() {
+    return fetchHistory(true);
+}
+
+// Read the filter form on the history page and reload from the first page
+function applyHistoryFilters(event) {
+    if (event) event.preventDefault();
+    const value = id => {
+        const el = document.getElementById(id);
+        return el ? el.value : '';
+    };
+    historyFilters = {
+        q: value('filter-query').trim(),
+        type: value('filter-type'),
+        min_score: value('filter-min-score'),
+        max_score: value('filter-max-score'),
+        since: value('filter-since'),
+        until: value('filter-until')
+    };
+    return fetchHistory();
+}
+
 // Initialize application with server data
 function initialize() {
     console.log('Initializing application...');
@@ -164,63 +212,49 @@ function analyzeText(event) {
         return;
     }
     showProgressModal('text', 3000);
-    setTimeout(() => {
-        const score = Math.floor(Math.random() * 100);
-        const confidence = Math.floor(Math.random() * 20) + 80;
-        const preview = text.substring(0, 70) + (text.length > 70 ? '...' : '');
-        fetch('/api/history', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
+    fetch('/api/detect/text', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        credentials: 'same-origin',
+        body: JSON.stringify({ text: text })
+    })
+    .then(response => response.json().then(data => {
+        if (!response.ok) throw new Error(data.message || `HTTP error! status: ${response.status}`);
+        return data;
+    }))
+    .then(data => {
+        if (data.status === 'success') {
+            const newEntry = {
+                id: data.id,
                 type: 'text',
-                content: preview,
-                score: score,
-                confidence: confidence,
-                date: new Date().toLocaleString(),
+                content: data.content,
+                score: data.score,
+                confidence: data.confidence,
+                date: data.date,
                 fullContent: text,
-                analysis: ''
-            })
-        })
-        .then(response => {
-            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-            return response.json();
-        })
-        .then(data => {
-            if (data.status === 'success') {
-                const newEntry = {
-                    id: data.id,
-                    type: 'text',
-                    content: preview,
-                    score: score,
-                    confidence: confidence,
-                    date: new Date().toLocaleString(),
-                    fullContent: text,
-                    analysis: score < 30 ? 'Likely human-created content' :
-                           score < 70 ? 'Moderate AI generation probability' :
-                           'High probability AI-generated content'
-                };
-                historyData.unshift(newEntry);
-                updateHistoryTable();
-                displayResult(newEntry);
-                document.getElementById('text-input').value = '';
-                document.getElementById('char-count').textContent = '0 characters';
-                document.getElementById('word-count').textContent = '0 words';
-                document.getElementById('text-quality').textContent = '';
-                hideProgressModal();
-                showNotification('Text analysis completed and saved to history!', 'success');
-                setTimeout(() => {
-                    window.location.href = `/results?id=${data.id}`;
-                }, 100);
-            } else {
-                throw new Error(data.message || 'Failed to save to history');
-            }
-        })
-        .catch(error => {
-            console.error('Error saving text analysis:', error);
+                analysis: data.analysis
+            };
+            historyData.unshift(newEntry);
+            updateHistoryTable();
+            displayResult(newEntry);
+            document.getElementById('text-input').value = '';
+            document.getElementById('char-count').textContent = '0 characters';
+            document.getElementById('word-count').textContent = '0 words';
+            document.getElementById('text-quality').textContent = '';
             hideProgressModal();
-            showNotification('Error saving analysis: ' + error.message, 'error');
-        });
-    }, 3000);
+            showNotification('Text analysis completed and saved to history!', 'success');
+            setTimeout(() => {
+                window.location.href = `/results?id=${data.id}`;
+            }, 100);
+        } else {
+            throw new Error(data.message || 'Text analysis failed');
+        }
+    })
+    .catch(error => {
+        console.error('Error analyzing text:', error);
+        hideProgressModal();
+        showNotification('Error analyzing text: ' + error.message, 'error');
+    });
 }
 
 function analyzeImage(event) {
@@ -300,63 +334,49 @@ function analyzeVideo(event) {
         return;
     }
     showProgressModal('video', 6000);
-    setTimeout(() => {
-        const score = Math.floor(Math.random() * 100);
-        const confidence = Math.floor(Math.random() * 30) + 70;
-        const fileSize = (file.size / 1024 / 1024).toFixed(2);
-        const fullName = `${file.name} (${fileSize} MB)`;
-        fetch('/api/history', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
+    const formData = new FormData();
+    formData.append('video', file);
+    fetch('/api/detect/video', {
+        method: 'POST',
+        credentials: 'same-origin',
+        body: formData
+    })
+    .then(response => response.json().then(data => {
+        if (!response.ok) throw new Error(data.message || `HTTP error! status: ${response.status}`);
+        return data;
+    }))
+    .then(data => {
+        if (data.status === 'success') {
+            const newEntry = {
+                id: data.id,
                 type: 'video',
-                content: file.name,
-                score: score,
-                confidence: confidence,
-                date: new Date().toLocaleString(),
-                fullContent: fullName,
-                analysis: ''
-            })
-        })
-        .then(response => {
-            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-            return response.json();
-        })
-        .then(data => {
-            if (data.status === 'success') {
-                const newEntry = {
-                    id: data.id,
-                    type: 'video',
-                    content: file.name,
-                    score: score,
-                    confidence: confidence,
-                    date: new Date().toLocaleString(),
-                    fullContent: fullName,
-                    analysis: score < 30 ? 'Authentic human-created content' :
-                           score < 70 ? 'Moderate AI generation probability' :
-                           'Strong deepfake indicators detected'
-                };
-                historyData.unshift(newEntry);
-                updateHistoryTable();
-                displayResult(newEntry);
-                fileInput.value = '';
-                document.getElementById('video-upload-area').classList.remove('hidden');
-                document.getElementById('video-preview').classList.add('hidden');
-                hideProgressModal();
-                showNotification('Video analysis completed and saved to history!', 'success');
-                setTimeout(() => {
-                    window.location.href = `/results?id=${data.id}`;
-                }, 100);
-            } else {
-                throw new Error(data.message || 'Failed to save to history');
-            }
-        })
-        .catch(error => {
-            console.error('Error saving video analysis:', error);
+                content: data.filename,
+                score: data.score,
+                confidence: data.confidence,
+                date: data.date,
+                fullContent: data.path,
+                analysis: data.analysis
+            };
+            historyData.unshift(newEntry);
+            updateHistoryTable();
+            displayResult(newEntry);
+            fileInput.value = '';
+            document.getElementById('video-upload-area').classList.remove('hidden');
+            document.getElementById('video-preview').classList.add('hidden');
             hideProgressModal();
-            showNotification('Error saving analysis: ' + error.message, 'error');
-        });
-    }, 6000);
+            showNotification('Video analysis completed and saved to history!', 'success');
+            setTimeout(() => {
+                window.location.href = `/results?id=${data.id}`;
+            }, 100);
+        } else {
+            throw new Error(data.message || 'Video analysis failed');
+        }
+    })
+    .catch(error => {
+        console.error('Error analyzing video:', error);
+        hideProgressModal();
+        showNotification('Error analyzing video: ' + error.message, 'error');
+    });
 }
 
 // Display analysis result on the page
@@ -429,7 +449,9 @@ function updateHistoryTable() {
     const tbody = document.getElementById('history-table-body');
     const mobileContainer = document.getElementById('history-table-mobile');
     const emptyState = document.getElementById('empty-state');
+    const loadMore = document.getElementById('load-more-history');
     console.log('Updating history table with data:', historyData);
+    if (loadMore) loadMore.classList.toggle('hidden', !historyNextCursor);
     if (!historyData.length) {
         if (tbody) tbody.innerHTML = '';
         if (mobileContainer) mobileContainer.innerHTML = '';
@@ -462,6 +484,7 @@ function updateHistoryTable() {
                                 ${item.content}
                             </div>
                             <div class="text-xs text-gray-500 mt-1">${item.analysis}</div>
+                            ${item.snippet ? `<div class="text-xs text-gray-600 mt-1 truncate">${item.snippet}</div>` : ''}
                         </div>
                     </td>
                     <td class="px-6 py-4 whitespace-nowrap">
@@ -522,6 +545,7 @@ function updateHistoryTable() {
                     </div>
                     <div class="text-sm text-gray-900 mb-1"><strong>Content:</strong> ${item.content}</div>
                     <div class="text-sm text-gray-500 mb-1"><strong>Analysis:</strong> ${item.analysis}</div>
+                    ${item.snippet ? `<div class="text-sm text-gray-600 mb-1"><strong>Match:</strong> ${item.snippet}</div>` : ''}
                     <div class="text-sm mb-1"><strong>AI Probability:</strong> <span class="${scoreClass}">${item.score}%</span></div>
                     <div class="text-sm mb-1"><strong>Confidence:</strong> <span class="${confidenceClass}">${item.confidence}%</span></div>
                     <div class="text-sm text-gray-500"><strong>Date:</strong> ${item.date}</div>
@@ -609,24 +633,22 @@ function clearAllHistory() {
     }
 }
 
-function exportHistory() {
+// Download the whole (filtered or searched) history; the server streams it,
+// so this works no matter how many rows are loaded in the page
+function exportHistory(format = 'csv') {
     if (historyData.length === 0) {
         showNotification('No data to export', 'error');
         return;
     }
-    const csvContent = "data:text/csv;charset=utf-8," +
-        "Type,Content,AI Score,Confidence,Date,Analysis\n" +
-        historyData.map(item =>
-            `"${item.type}","${item.content.replace(/"/g, '""')}","${item.score}%","${item.confidence}%","${item.date}","${item.analysis.replace(/"/g, '""')}"`
-        ).join("\n");
-    const encodedUri = encodeURI(csvContent);
+    const params = new URLSearchParams(historyQuery(null));
+    params.delete('_');
+    params.set('format', format);
     const link = document.createElement("a");
-    link.setAttribute("href", encodedUri);
-    link.setAttribute("download", `ai_detection_history_${new Date().toISOString().split('T')[0]}.csv`);
+    link.setAttribute("href", '/api/history/export?' + params.toString());
     document.body.appendChild(link);
     link.click();
     document.body.removeChild(link);
-    showNotification('History exported successfully', 'success');
+    showNotification('History export started', 'success');
 }
 
 function viewDetails(index) {
@@ -0,0 +1,107 @@
+"""
+In-process cache of `users` rows for Flask-Login's user_loader.
+
+Flask-Login resolves the session's user id on every request that touches
+`current_user` (every @login_required endpoint and every page rendering
+base.html). Caching the row here means the auth layer adds no database
+round-trip on hot paths such as history polling and detection calls.
+The user_loader skips static files altogether (app.py load_user).
+
+Entries expire after USER_CACHE_TTL_SECONDS (default 60) and at most
+USER_CACHE_MAX_ENTRIES (default 10000) users are kept, least recently used
+first out. Code that changes or deletes a user row calls
+`invalidate(user_id)` after committing. That drops the entry here and
+touches a stamp file (USER_CACHE_STAMP_PATH, default <DATABASE_PATH>.user-stamp);
+every worker process empties its cache the next time it sees the stamp
+change, so the change applies everywhere on the next request rather than
+after the TTL. Creating a user needs no call, since misses are never
+cached. USER_CACHE_TTL_SECONDS=0 disables the cache.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import db
+from metrics import USER_CACHE_LOOKUPS
+
+TTL = float(os.environ.get('USER_CACHE_TTL_SECONDS', '60'))
+MAX_ENTRIES = int(os.environ.get('USER_CACHE_MAX_ENTRIES', '10000'))
+STAMP_PATH = os.environ.get('USER_CACHE_STAMP_PATH', f'{db.DB_PATH}.user-stamp')
+
+_entries = OrderedDict()    # str(user_id) -> (expires_at, row)
+_lock = threading.Lock()
+_stamp = None               # stamp file mtime the entries were loaded under
+
+
+def _stamp_mtime():
+    try:
+        return os.stat(STAMP_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def _check_stamp():
+    # Caller holds _lock: forget everything once another process invalidated
+    global _stamp
+    mtime = _stamp_mtime()
+    if mtime != _stamp:
+        _entries.clear()
+        _stamp = mtime
+
+
+def get(user_id):
+    """Cached row for `user_id`, or None if missing or expired."""
+    key = str(user_id)
+    with _lock:
+        _check_stamp()
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _entries[key]
+            return None
+        _entries.move_to_end(key)
+        return entry[1]
+
+
+def put(user_id, row):
+    if TTL <= 0:
+        return
+    with _lock:
+        _entries[str(user_id)] = (time.monotonic() + TTL, row)
+        _entries.move_to_end(str(user_id))
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def invalidate(user_id=None):
+    """
+    Drop one user (or everyone, with no argument) from this process's cache
+    and tell the other processes to drop their cached rows too.
+    """
+    global _stamp
+    with _lock:
+        # Apply other processes' invalidations first; ours is applied here directly
+        _check_stamp()
+        if user_id is None:
+            _entries.clear()
+        else:
+            _entries.pop(str(user_id), None)
+        with open(STAMP_PATH, 'a'):
+            pass
+        os.utime(STAMP_PATH)
+        _stamp = _stamp_mtime()
+
+
+def get_or_load(user_id, load):
+    """Cached row, else `load(user_id)` (cached unless None)."""
+    row = get(user_id)
+    if row is not None:
+        USER_CACHE_LOOKUPS.inc(result='hit')
+        return row
+    USER_CACHE_LOOKUPS.inc(result='miss')
+    row = load(user_id)
+    if row is not None:
+        put(user_id, row)
+    return row
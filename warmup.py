@@ -0,0 +1,126 @@
+"""
+Detector warm-up and readiness state.
+
+The web app never imports ML code at startup; models load on first use.
+With warm-up enabled, each worker preloads the detectors and runs one test
+inference right after it starts, so no user request pays the cold load:
+
+    WARMUP_MODE=off         load lazily on first request (default)
+    WARMUP_MODE=background  warm up in a thread; /readyz is 503 until done
+    WARMUP_MODE=blocking    warm up before the worker serves anything
+                            (raise gunicorn's --timeout above the load time)
+    WARMUP_DETECTORS=image,text   which detectors to warm (also: video)
+
+Under gunicorn the post_fork hook (gunicorn.conf.py) calls start() in
+every worker; `python app.py` calls it before app.run().
+
+Each detector is in one of the states cold -> loading -> ready | failed.
+"""
+import logging
+import os
+import threading
+import time
+
+MODE = os.environ.get('WARMUP_MODE', 'off').strip().lower()
+DETECTORS = tuple(d.strip() for d in os.environ.get('WARMUP_DETECTORS', 'image,text').split(',') if d.strip())
+
+COLD, LOADING, READY, FAILED = 'cold', 'loading', 'ready', 'failed'
+
+_SAMPLE_TEXT = ('This is a short sample paragraph used only to warm up the text detector. '
+                'It is scored once at startup so the first real request finds the model ready.')
+
+_lock = threading.Lock()
+_states = {}
+_started_pid = None
+_mode = MODE
+
+
+def _warm_image():
+    from PIL import Image
+    from detectors.detect_image import detect_images_ai
+    detect_images_ai([Image.new('RGB', (224, 224), (127, 127, 127))])
+
+
+def _warm_text():
+    from detectors.detect_text import detect_text
+    detect_text(_SAMPLE_TEXT)
+
+
+def _warm_video():
+    # Frames are scored by the image model; also spawn the decode pool now
+    from detectors.detect_video import _get_pool
+    _warm_image()
+    _get_pool()
+
+
+WARMERS = {
+    'image': _warm_image,
+    'text': _warm_text,
+    'video': _warm_video,
+}
+
+
+def _set_state(name, state, error=None, seconds=None):
+    with _lock:
+        _states[name] = {'state': state, 'error': error, 'seconds': seconds}
+
+
+def warm_up(names=None):
+    """Load and test-run the given detectors now. Returns True if all are ready."""
+    names = names or DETECTORS
+    ok = True
+    for name in names:
+        warmer = WARMERS.get(name)
+        if warmer is None:
+            _set_state(name, FAILED, error=f"Unknown detector '{name}'")
+            ok = False
+            continue
+        _set_state(name, LOADING)
+        started = time.monotonic()
+        try:
+            warmer()
+        except Exception as e:
+            logging.exception(f"Warm-up of the {name} detector failed")
+            _set_state(name, FAILED, error=str(e), seconds=round(time.monotonic() - started, 3))
+            ok = False
+        else:
+            seconds = round(time.monotonic() - started, 3)
+            logging.info(f"{name} detector ready in {seconds}s")
+            _set_state(name, READY, seconds=seconds)
+    return ok
+
+
+def start(mode=None):
+    """Start warm-up in this process according to WARMUP_MODE (once per process)."""
+    global _started_pid, _mode
+    mode = (mode or MODE).strip().lower()
+    if mode == 'off':
+        return
+    if mode not in ('background', 'blocking'):
+        raise ValueError(f"Unknown WARMUP_MODE '{mode}' (expected off, background or blocking)")
+    with _lock:
+        pid = os.getpid()
+        if _started_pid == pid:
+            return
+        _started_pid = pid
+        _mode = mode
+        # States copied from a parent process do not describe this one
+        _states.clear()
+        for name in DETECTORS:
+            _states[name] = {'state': COLD, 'error': None, 'seconds': None}
+    if mode == 'blocking':
+        warm_up()
+    else:
+        threading.Thread(target=warm_up, name='detector-warmup', daemon=True).start()
+
+
+def status():
+    """{'mode', 'ready', 'detectors': {name: {'state', 'error', 'seconds'}}}"""
+    with _lock:
+        detectors = {name: dict(info) for name, info in _states.items()}
+    if _mode == 'off':
+        # Nothing to wait for; models load on first use
+        ready = True
+    else:
+        ready = bool(detectors) and all(info['state'] == READY for info in detectors.values())
+    return {'mode': _mode, 'ready': ready, 'detectors': detectors}